@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+
+"""
+    Adaptive time between queries of the status plugins.
+
+    After each query, the plugin passes the new counts of jobs.
+        - when nothing changed, the interval grows (backoff),
+        - when the counts change quickly, or some queue is starved,
+          the interval shrinks (tighten),
+        - otherwise, it moves back towards the configured sleep time.
+    The interval is always kept between the configured min and max.
+"""
+
+import logging
+
+
+def changefraction(old, new):
+    """
+    fraction of jobs that changed between two dictionaries of counts.
+    For example, {'a': 10, 'b': 10} -> {'a': 12, 'b': 8} is 0.2
+    """
+    keys = set(old.keys()) | set(new.keys())
+    changed = sum([abs(new.get(k, 0) - old.get(k, 0)) for k in keys])
+    total = sum(old.values())
+    if total == 0:
+        if changed == 0:
+            return 0.0
+        return 1.0
+    return float(changed) / total
+
+
+class AdaptiveInterval(object):
+    """
+    -----------------------------------------------------------------------
+    Calculates the next interval between queries.
+    With minimum == maximum the interval is fixed.
+    -----------------------------------------------------------------------
+    Public Interface:
+            update(counts, starved=False)
+            interval
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, name, base, minimum=None, maximum=None, backoff=1.5, tighten=0.5, threshold=0.1):
+        """
+        :param string name: for logging
+        :param int base: configured sleep time, and initial interval
+        :param int minimum: shortest interval. Defaults to base
+        :param int maximum: longest interval. Defaults to base
+        :param float backoff: interval multiplier when nothing changed
+        :param float tighten: interval multiplier when things change quickly
+        :param float threshold: fraction of jobs changing
+                                considered as changing quickly
+        """
+        self.log = logging.getLogger('autopyfactory.adaptiveinterval.%s' %name)
+        if minimum is None:
+            minimum = base
+        if maximum is None:
+            maximum = base
+        self.minimum = min(minimum, base)
+        self.maximum = max(maximum, base)
+        self.base = base
+        self.backoff = backoff
+        self.tighten = tighten
+        self.threshold = threshold
+        self.interval = base
+        self.counts = None
+        self.log.debug('AdaptiveInterval initialized with base=%s, min=%s, max=%s' %(base, self.minimum, self.maximum))
+
+
+    def update(self, counts, starved=False):
+        """
+        :param dict counts: number of jobs per key, for example (queue, state)
+        :param bool starved: True if some queue urgently needs fresh info
+        :return int: the interval until the next query
+        """
+        previous = self.counts
+        self.counts = counts
+        if self.minimum == self.maximum:
+            return self.interval
+
+        if previous is None:
+            reason = 'first query'
+            interval = self.base
+        else:
+            fraction = changefraction(previous, counts)
+            if starved:
+                reason = 'starved queues'
+                interval = self.interval * self.tighten
+            elif fraction >= self.threshold:
+                reason = '%.0f%% of jobs changed' %(fraction * 100)
+                interval = self.interval * self.tighten
+            elif fraction == 0:
+                reason = 'no changes'
+                interval = self.interval * self.backoff
+            else:
+                reason = '%.0f%% of jobs changed' %(fraction * 100)
+                interval = (self.interval + self.base) / 2.0
+        interval = int(max(self.minimum, min(self.maximum, interval)))
+
+        if interval != self.interval:
+            self.log.info('interval changed from %s to %s seconds (%s)' %(self.interval, interval, reason))
+        self.interval = interval
+        return interval
@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+
+"""
+    Aggregation of job classads into number of jobs
+    per APF queue and per job state.
+
+    The classads are first encoded as two columns of integers:
+    the index of the queue, and the index of the (remapped) state.
+    The (queue x state) matrix of counts is then calculated in a single pass,
+    with numpy.bincount() when numpy is installed,
+    or with a plain python loop otherwise.
+"""
+
+import logging
+
+from autopyfactory.info import StateCounts
+
+try:
+    import numpy
+except ImportError:
+    # Not critical. The pure python path is used instead.
+    numpy = None
+
+
+class StatusAggregator(object):
+    """
+    -----------------------------------------------------------------------
+    Counts jobs per queue and per state.
+    -----------------------------------------------------------------------
+    Public Interface:
+            aggregate(classad_l)
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, mappings, queuekey='match_apf_queue', statuskey='jobstatus', usenumpy=True):
+        """
+        :param dict mappings: raw value of statuskey -> state name.
+                              For example {'1': 'pending', '2': 'running'}
+        :param string queuekey: classad with the name of the queue
+        :param string statuskey: classad with the status of the job
+        :param bool usenumpy: use numpy if it is available
+        """
+        self.log = logging.getLogger('autopyfactory.aggregation')
+        self.queuekey = queuekey
+        self.statuskey = statuskey
+        self.usenumpy = usenumpy and numpy is not None
+
+        # states, and the code of the state for each raw value.
+        # Raw values are accepted both as strings and as integers.
+        self.states = []
+        self.statecodes = {}
+        for raw, state in mappings.items():
+            if state not in self.states:
+                self.states.append(state)
+            code = self.states.index(state)
+            self.statecodes[raw] = code
+            try:
+                self.statecodes[int(raw)] = code
+            except (TypeError, ValueError):
+                pass
+            self.statecodes[str(raw)] = code
+
+
+    def aggregate(self, classad_l):
+        """
+        :param list classad_l: job classads (dictionaries)
+        :return dict: StateCounts object indexed by queue name
+        """
+        queuenames, queuecodes, statecodes = self._encode(classad_l)
+        nstates = len(self.states)
+        size = len(queuenames) * nstates
+        if self.usenumpy:
+            counts = self._bincount_numpy(queuecodes, statecodes, nstates, size)
+        else:
+            counts = self._bincount_python(queuecodes, statecodes, nstates, size)
+        return self._records(queuenames, counts)
+
+
+    def _encode(self, classad_l):
+        """
+        converts the classads into two columns of integer codes.
+        Jobs with no queue, or with a status not in the mappings, are ignored.
+        """
+        queueindex = {}
+        queuenames = []
+        queuecodes = []
+        statecodes = []
+        getcode = self.statecodes.get
+        queuekey = self.queuekey
+        statuskey = self.statuskey
+        for ca in classad_l:
+            qname = ca.get(queuekey, None)
+            if qname is None:
+                continue
+            scode = getcode(ca.get(statuskey, None), None)
+            if scode is None:
+                continue
+            qcode = queueindex.get(qname, None)
+            if qcode is None:
+                qcode = len(queuenames)
+                queueindex[qname] = qcode
+                queuenames.append(qname)
+            queuecodes.append(qcode)
+            statecodes.append(scode)
+        return queuenames, queuecodes, statecodes
+
+
+    def _bincount_numpy(self, queuecodes, statecodes, nstates, size):
+        if not queuecodes:
+            return [0] * size
+        cells = numpy.array(queuecodes, dtype=numpy.intp) * nstates + numpy.array(statecodes, dtype=numpy.intp)
+        return numpy.bincount(cells, minlength=size).tolist()
+
+
+    def _bincount_python(self, queuecodes, statecodes, nstates, size):
+        counts = [0] * size
+        for qcode, scode in zip(queuecodes, statecodes):
+            counts[qcode * nstates + scode] += 1
+        return counts
+
+
+    def _records(self, queuenames, counts):
+        nstates = len(self.states)
+        out = {}
+        for qcode, qname in enumerate(queuenames):
+            row = counts[qcode * nstates : (qcode + 1) * nstates]
+            out[qname] = StateCounts(dict([(state, n) for state, n in zip(self.states, row) if n]))
+        return out
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+"""
+    Incremental condor_history for a schedd.
+
+    Each query only asks for the records with EnteredCurrentStatus
+    or CompletionDate not older than the high-water mark of the previous one.
+    Records are indexed by clusterid.procid, so the ones
+    at the high-water mark itself are not counted twice.
+    Records older than the window are forgotten.
+"""
+
+import logging
+import time
+
+
+def finishtime(ca):
+    """
+    latest of EnteredCurrentStatus and CompletionDate for a history record
+    """
+    t = 0
+    for attr in ['enteredcurrentstatus', 'completiondate']:
+        try:
+            t = max(t, int(ca.get(attr, 0)))
+        except (TypeError, ValueError):
+            pass
+    return t
+
+
+class CondorHistory(object):
+    """
+    -----------------------------------------------------------------------
+    Finished jobs of a schedd, accumulated from incremental
+    condor_history queries.
+    -----------------------------------------------------------------------
+    Public Interface:
+            update(schedd, attribute_l)
+            trim(now=None)
+            records()
+            hwm
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, window=86400):
+        """
+        :param int window: seconds the records are kept. 0 means forever
+        """
+        self.log = logging.getLogger('autopyfactory.condorhistory')
+        self.window = window
+        # finished jobs, indexed by clusterid.procid
+        self.history_d = {}
+        # high-water mark of EnteredCurrentStatus/CompletionDate
+        # among the jobs already in self.history_d
+        self.hwm = 0
+
+
+    def update(self, schedd, attribute_l):
+        """
+        queries the schedd for the records since the high-water mark.
+        Exceptions from the query are raised, and nothing changes.
+        :param schedd: object with a condor_history(attribute_l, constraint_l) method
+        :param list attribute_l: classads to be queried
+        :return list: the records returned by the query
+        """
+        constraint_l = None
+        if self.hwm:
+            constraint_l = ['EnteredCurrentStatus >= %d || CompletionDate >= %d' %(self.hwm, self.hwm)]
+        classad_l = schedd.condor_history(attribute_l, constraint_l)
+        self.log.debug('condor_history returned %d new records' %len(classad_l))
+
+        hwm = self.hwm
+        for ca in classad_l:
+            key = '%s.%s' %(ca.get('clusterid'), ca.get('procid'))
+            self.history_d[key] = ca
+            hwm = max(hwm, finishtime(ca))
+        self.hwm = hwm
+        return classad_l
+
+
+    def trim(self, now=None):
+        """
+        forgets the records that left the window
+        """
+        if not self.window:
+            return
+        if now is None:
+            now = int(time.time())
+        oldest = now - self.window
+        for key in [k for k, ca in self.history_d.items() if finishtime(ca) < oldest]:
+            del self.history_d[key]
+
+
+    def records(self):
+        """
+        :return list: the records kept, one per job
+        """
+        return self.history_d.values()
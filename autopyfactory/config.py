@@ -52,6 +52,9 @@ class ConfigHandler(_thread):
 
     def _run(self):
         self.log.debug('starting')
+        if self.reconfig and self._thread_last_action > 0:
+            # not needed the first time, the Factory has just read them
+            self._run_mappings()
         # order matters here: 
         # first reconfig AuthManager, then APFQueuesManager
         try:
@@ -68,6 +71,22 @@ class ConfigHandler(_thread):
         self.log.debug('leaving')
 
 
+    def _run_mappings(self):
+        """
+        reloads mappings.conf. 
+        The plugins see all the new mappings at once.
+        If it fails, the previous mappings are kept.
+        """
+        self.log.debug('starting')
+        try:
+            self.factory.mappings.load(self.factory.mappingscf)
+            self.factory.mappingscl = self.factory.mappings.mappingscl
+        except Exception as e:
+            self.log.error("Exception: %s   %s " % ( str(e), traceback.format_exc()))
+            self.log.error('reloading mappings failed. Keeping the previous ones.')
+        self.log.debug('leaving')
+
+
     def _run_auth(self):
         self.log.debug('starting')
         if self.authmanagerenabled:
@@ -0,0 +1,317 @@
+#! /usr/bin/env python
+
+"""
+    Central scheduler for the cycles of all APFQueue objects.
+"""
+
+import heapq
+import logging
+import threading
+import time
+import traceback
+
+from Queue import Queue
+
+from autopyfactory.interfaces import _thread
+from autopyfactory.schedpipeline import evaluatemany
+
+
+class CycleScheduler(_thread):
+    """
+    -----------------------------------------------------------------------
+    Single dispatcher for the cycles of all APFQueue objects.
+    It keeps a priority queue with the next time each APFQueue is due,
+    and hands the due APFQueues to a bounded pool of worker threads.
+    An APFQueue cycle is only fired when its apfqueue.sleep time
+    has elapsed and its BatchStatus plugin has published new info
+    since the previous cycle.
+    Number of threads does not depend on the number of APFQueues.
+    -----------------------------------------------------------------------
+    Public Interface:
+            add(apfqueue)
+            remove(apfqueue)
+            wakeup()
+            the interface inherited from _thread
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, factory):
+
+        _thread.__init__(self)
+        factory.threadsregistry.add("core", self)
+        self.log = logging.getLogger('autopyfactory.cyclescheduler')
+
+        self.factory = factory
+        self.nworkers = factory.fcl.generic_get('Factory', 'cyclescheduler.workers', 'getint', default_value=10)
+        # seconds before checking again APFQueues that are due
+        # but still have no fresh status info.
+        # Only needed for status plugins that do not publish snapshots.
+        self.recheck = factory.fcl.generic_get('Factory', 'cyclescheduler.recheck', 'getint', default_value=60)
+        # evaluate the sched plugins of all APFQueues ready at once,
+        # before handing them to the workers
+        self.vectorized = factory.fcl.generic_get('Factory', 'cyclescheduler.vectorized', 'getboolean', default_value=False)
+
+        self.cond = threading.Condition()
+        self.queues = set()     # APFQueues currently being scheduled
+        self.heap = []          # entries (duetime, seq, apfqueue)
+        self.seq = 0            # tie-breaker for APFQueues due at the same time
+        self.waiting = []       # APFQueues due, but with no fresh status info yet
+        self.publishers = []    # status plugins we are subscribed to
+        self.woken = False      # wakeup() was called during the last dispatch
+        self.workqueue = Queue()
+        self.workers = []
+        self.log.debug('CycleScheduler: Object initialized.')
+
+
+    # ----------------------------------------------------------------------
+    #  public interface
+    # ----------------------------------------------------------------------
+
+    def add(self, apfqueue):
+        """
+        starts scheduling the cycles of an APFQueue.
+        The first cycle is due immediately.
+        """
+        self.cond.acquire()
+        try:
+            if apfqueue not in self.queues:
+                self.log.debug('adding queue %s' %apfqueue.apfqname)
+                self.queues.add(apfqueue)
+                self._push(apfqueue, time.time())
+                self.cond.notify()
+        finally:
+            self.cond.release()
+        self._subscribe(apfqueue)
+
+
+    def remove(self, apfqueue):
+        """
+        stops scheduling the cycles of an APFQueue.
+        A cycle already in progress is allowed to finish.
+        """
+        self.cond.acquire()
+        try:
+            self.log.debug('removing queue %s' %apfqueue.apfqname)
+            self.queues.discard(apfqueue)
+            # entries in the heap are discarded lazily when popped
+            self.waiting = [q for q in self.waiting if q is not apfqueue]
+        finally:
+            self.cond.release()
+
+
+    def wakeup(self):
+        """
+        forces the dispatcher to re-evaluate which APFQueues are ready.
+        """
+        self.cond.acquire()
+        try:
+            self.woken = True
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+
+    def _subscribe(self, apfqueue):
+        """
+        subscribes to the status plugins of an APFQueue, 
+        if not done yet. 
+        Status plugins are singletons, shared by many APFQueues.
+        """
+        for plugin in [apfqueue.batchstatus_plugin, apfqueue.wmsstatus_plugin]:
+            if plugin is None or not hasattr(plugin, 'subscribe'):
+                continue
+            if plugin not in self.publishers:
+                self.log.debug('subscribing to plugin %s' %plugin.__class__.__name__)
+                self.publishers.append(plugin)
+                plugin.subscribe(self.wakeup)
+
+
+    # ----------------------------------------------------------------------
+    #  dispatcher loop
+    # ----------------------------------------------------------------------
+
+    def _prerun(self):
+        self.log.debug('starting %s worker threads' %self.nworkers)
+        for i in range(self.nworkers):
+            worker = threading.Thread(target=self._work, name='apfqueue-worker-%d' %i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+
+    def _mainloop(self):
+        """
+        wait until the next APFQueue is due, or until woken up,
+        instead of polling every second.
+        """
+        self.cond.acquire()
+        try:
+            while not self.stopevent.isSet():
+                self.woken = False
+                due_l = []
+                try:
+                    due_l = self._dispatch(time.time())
+                except Exception as ex:
+                    self.log.error('an exception has been captured during the dispatch loop: %s' %ex)
+                    self.log.debug(traceback.format_exc(None))
+                if due_l:
+                    # readyforcycle() runs plugin code, 
+                    # so it is never called with self.cond acquired
+                    self.cond.release()
+                    try:
+                        notready_l = self._handout(due_l)
+                    finally:
+                        self.cond.acquire()
+                    self._wait(notready_l)
+                    if self.woken:
+                        # new status info was published meanwhile
+                        continue
+                self.cond.wait(self._timeout(time.time()))
+        finally:
+            self.cond.release()
+
+
+    def _dispatch(self, now):
+        """
+        takes the APFQueues that are due:
+        those already waiting for fresh status info,
+        and those whose sleep time has just elapsed.
+        Must be called with self.cond acquired.
+        :return list: the APFQueues to be checked by readyforcycle()
+        """
+        due_l = self.waiting
+        self.waiting = []
+        while self.heap and self.heap[0][0] <= now:
+            duetime, seq, apfqueue = heapq.heappop(self.heap)
+            if apfqueue in self.queues:
+                due_l.append(apfqueue)
+        return due_l
+
+
+    def _wait(self, notready_l):
+        """
+        keeps the APFQueues that are due, but not ready yet,
+        to be checked again.
+        Must be called with self.cond acquired.
+        """
+        for apfqueue in notready_l:
+            # it may have been removed meanwhile
+            if apfqueue in self.queues:
+                self.log.debug('queue %s is due, but there is no fresh status info yet' %apfqueue.apfqname)
+                self.waiting.append(apfqueue)
+
+
+    def _handout(self, due_l):
+        """
+        moves the APFQueues that are ready to the workers queue.
+        Must be called with self.cond released.
+        :return list: the APFQueues that are not ready
+        """
+        ready_l = []
+        notready_l = []
+        for apfqueue in due_l:
+            try:
+                ready = apfqueue.readyforcycle()
+            except Exception as ex:
+                self.log.error('an exception has been captured checking if queue %s is ready: %s' %(apfqueue.apfqname, ex))
+                self.log.debug(traceback.format_exc(None))
+                ready = False
+            if ready:
+                ready_l.append(apfqueue)
+            else:
+                notready_l.append(apfqueue)
+        if self.vectorized:
+            self._presched(ready_l)
+        for apfqueue in ready_l:
+            self.workqueue.put(apfqueue)
+        return notready_l
+
+
+    def _presched(self, apfqueue_l):
+        """
+        evaluates the sched plugins of many APFQueues in one pass.
+        Only APFQueues with all their sched plugins compiled:
+        the others call their plugins in their own cycle, in a worker.
+        If it fails, each APFQueue calls its sched plugins as usual.
+        """
+        apfqueue_l = [apfqueue for apfqueue in apfqueue_l if apfqueue.schedpipeline.compiled]
+        if len(apfqueue_l) < 2:
+            return
+        try:
+            (nsub_l, trace_l) = evaluatemany([apfqueue.schedpipeline for apfqueue in apfqueue_l])
+        except Exception as ex:
+            self.log.error('factory-wide evaluation of the sched plugins failed: %s' %ex)
+            self.log.debug(traceback.format_exc(None))
+            return
+        for i, apfqueue in enumerate(apfqueue_l):
+            apfqueue.presetsched = (nsub_l[i], trace_l[i])
+        self.log.debug('sched plugins evaluated for %d queues' %len(apfqueue_l))
+
+
+    def _timeout(self, now):
+        """
+        calculates how long the dispatcher can sleep.
+        None means until it is woken up.
+        """
+        timeout = None
+        if self.heap:
+            timeout = max(0, self.heap[0][0] - now)
+        if self.waiting:
+            if timeout is None:
+                timeout = self.recheck
+            else:
+                timeout = min(timeout, self.recheck)
+        return timeout
+
+
+    def _push(self, apfqueue, duetime):
+        """
+        Must be called with self.cond acquired.
+        """
+        self.seq += 1
+        heapq.heappush(self.heap, (duetime, self.seq, apfqueue))
+
+
+    # ----------------------------------------------------------------------
+    #  workers
+    # ----------------------------------------------------------------------
+
+    def _work(self):
+        """
+        body of each worker thread.
+        Runs one APFQueue cycle at a time and re-schedules the APFQueue.
+        """
+        while True:
+            apfqueue = self.workqueue.get()
+            if apfqueue is None:
+                # signal to stop
+                break
+            try:
+                apfqueue.runcycle()
+            except Exception as ex:
+                self.log.warning('an exception has been captured during cycle for queue %s: %s' %(apfqueue.apfqname, ex))
+                self.log.error(traceback.format_exc(None))
+            self._rearm(apfqueue)
+
+
+    def _rearm(self, apfqueue):
+        """
+        schedules the next cycle of an APFQueue,
+        apfqueue.sleep seconds after the end of the current one.
+        """
+        self.cond.acquire()
+        try:
+            if apfqueue.stopevent.isSet():
+                self.log.debug('queue %s is stopped. Not scheduling it anymore' %apfqueue.apfqname)
+                self.queues.discard(apfqueue)
+            elif apfqueue in self.queues:
+                self._push(apfqueue, time.time() + apfqueue.sleep)
+                self.cond.notify()
+        finally:
+            self.cond.release()
+
+
+    def _join(self):
+        self.wakeup()
+        for worker in self.workers:
+            self.workqueue.put(None)
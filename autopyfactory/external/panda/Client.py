@@ -5,14 +5,25 @@ Extracted from panda package:
     pandaserver/userinterface/Client.py
 """
 
+import hashlib
 import logging
 import os
 import re
 import sys
 import urllib
 import subprocess
+import uuid
+import zlib
 import cPickle as pickle
 
+try:
+    import simplejson as json
+except ImportError:
+    # Not critical. It is only faster.
+    import json
+
+from autopyfactory.httpclient import HTTPClient, HTTPClientError
+
 # configuration
 try:
     baseURL = os.environ['PANDA_URL']
@@ -76,6 +87,9 @@ def getPandas():
 
 # look for a grid proxy certificate
 def _x509():
+    # see the proxy set by the factory
+    if _proxyPath:
+        return _proxyPath
     # see X509_USER_PROXY
     try:
         return os.environ['X509_USER_PROXY']
@@ -91,12 +105,95 @@ def _x509():
     return ''
 
 
+# settings of the HTTP transport.
+# They can be changed with setTransport()
+_transport = {'timeout'        : 600,
+              'retries'        : 3,
+              'backoff'        : 1,
+              'maxconnections' : 4,
+              }
+
+# proxy to be used for authentication, set with setProxy().
+# When not set, X509_USER_PROXY and the default location are tried.
+_proxyPath = None
+
+
+def setTransport(timeout=600, retries=3, backoff=1, maxconnections=4):
+    """
+    configures the HTTP transport.
+    Only clients created after the call are affected.
+    """
+    _transport['timeout'] = timeout
+    _transport['retries'] = retries
+    _transport['backoff'] = backoff
+    _transport['maxconnections'] = maxconnections
+
+
+# decoders for the responses of the server.
+# Each one is a tuple (function telling if a response can be decoded, 
+#                      function decoding it)
+# JSON is safe, and is requested from the server when enabled.
+# Pickle can execute arbitrary code while decoding,
+# so it must be enabled explicitly with setDecoders(),
+# for servers not supporting JSON.
+def _isJSON(output,contentType):
+    if 'json' in contentType:
+        return True
+    return output.lstrip()[:1] in ('{','[')
+
+def _isPickle(output,contentType):
+    return True
+
+_decoders = {'json'   : (_isJSON, json.loads),
+             'pickle' : (_isPickle, pickle.loads),
+             }
+
+# decoders to be tried, in order
+_enabledDecoders = ['json']
+
+
+def setDecoders(names):
+    """
+    sets the decoders to be tried, in order.
+    For example ['json', 'pickle']
+    """
+    global _enabledDecoders
+    for name in names:
+        if name not in _decoders:
+            raise ValueError("unknown decoder %s" % name)
+    _enabledDecoders = list(names)
+
+
+# decode a response with the first enabled decoder accepting it
+def _decode(output,contentType=''):
+    for name in _enabledDecoders:
+        accepts, decode = _decoders[name]
+        if accepts(output,contentType):
+            return decode(output)
+    raise ValueError("no decoder enabled for response with Content-Type '%s'" % contentType)
+
+
+def setProxy(proxyPath):
+    """
+    sets the grid proxy certificate used for authentication,
+    for example the one provided by the AuthManager
+    """
+    global _proxyPath
+    _proxyPath = proxyPath
+
+
 # curl class
+#
+# It used to fork a curl process for each call.
+# Now the requests are made in-process, through a pool of
+# persistent connections shared by all _Curl objects
+# with the same certificate.
+# The name and the return values are kept for compatibility:
+#       (0, output)                     on success
+#       ((code, output), output)        on failure
 class _Curl:
     # constructor
     def __init__(self):
-        # path to curl
-        self.path = 'curl'
         # verification of the host certificate
         self.verifyHost = False
         # request a compressed response
@@ -106,150 +203,88 @@ class _Curl:
         self.sslKey  = ''
         # verbose
         self.verbose = True
+        # status, headers and content type of the last response
+        self.status = None
+        self.headers = {}
+        self.contentType = ''
         self.log = logging.getLogger('autopyfactory.pandaclient')
 
 
     # GET method
-    def get(self,url,data):
-        # make command
-        com = '%s --silent --get' % self.path
-        if not self.verifyHost:
-            com += ' --insecure'
-        if self.compress:
-            com += ' --compressed'
-        if self.sslCert != '':
-            com += ' --cert %s' % self.sslCert
-        if self.sslKey != '':
-            com += ' --key %s' % self.sslKey
-        # timeout
-        com += ' -m 600' 
-        # data
-        strData = ''
-        for key in data.keys():
-            strData += 'data="%s"\n' % urllib.urlencode({key:data[key]})
-        # write data to temporary config file
-        try:
-            tmpName = os.environ['PANDA_TMP']
-        except:
-            tmpName = '/tmp'
-        whoami = subprocess.check_output('whoami').strip()
-        uuid = subprocess.check_output('uuidgen').strip()
-        tmpName += '/%s_%s' % (whoami, uuid)
-        self.log.debug("tmpName is %s" % tmpName)
-        tmpFile = open(tmpName,'w')
-        tmpFile.write(strData)
-        tmpFile.close()
-        com += ' --config %s' % tmpName
-        com += ' %s' % url
-        # execute
-        if self.verbose:
-            self.log.debug( "com is %s " % com )
-        ret = 0
-        out = ""
-            
-        try:
-            out = subprocess.check_output(com, shell=True)
-            #self.log.debug("regular return output %s" % out)
-            ret = 0
-        except subprocess.CalledProcessError as cpe:
-            ret = cpe.returncode
-            out = cpe.output
-            self.log.debug("ret is %s  out is %s " % (ret, out))
-        finally:
-            # remove temporary file
-            os.remove(tmpName)
-        if ret != 0:
-            ret = (ret % 255 , out)
-        return (ret, out)
+    def get(self,url,data,headers=None):
+        strData = urllib.urlencode(data)
+        if strData != '':
+            url += '?' + strData
+        return self._request('GET', url, None, dict(headers or {}))
 
 
     # POST method
     def post(self,url,data):
-        # make command
-        com = '%s --silent' % self.path
-        if not self.verifyHost:
-            com += ' --insecure'
-        if self.compress:
-            com += ' --compressed'
-        if self.sslCert != '':
-            com += ' --cert %s' % self.sslCert
-        if self.sslKey != '':
-            com += ' --key %s' % self.sslKey
-        # timeout
-        com += ' -m 600' 
-        # data
-        strData = ''
-        for key in data.keys():
-            strData += 'data="%s"\n' % urllib.urlencode({key:data[key]})
-        # write data to temporary config file
-        try:
-            tmpName = os.environ['PANDA_TMP']
-        except:
-            tmpName = '/tmp'
-        tmpName += '/%s_%s' % (subprocess.check_output('whoami').strip(),subprocess.check_output('uuidgen').strip())
-        tmpFile = open(tmpName,'w')
-        tmpFile.write(strData)
-        tmpFile.close()
-        com += ' --config %s' % tmpName
-        com += ' %s' % url
-        # execute
-        if self.verbose:
-            self.log.debug( "com is %s " % com )
-        ret = 0
-        out = ""
-            
-        try:
-            out = subprocess.check_output(com, shell=True)
-            #self.log.debug("regular return output %s" % out)
-            ret = 0
-        except subprocess.CalledProcessError as cpe:
-            ret = cpe.returncode
-            out = cpe.output
-            self.log.debug("ret is %s  out is %s " % (ret, out))
-        finally:
-            # remove temporary file
-            os.remove(tmpName)
-        if ret != 0:
-            ret = (ret % 255 , out)
-        return (ret, out)
+        return self._request('POST', url, urllib.urlencode(data), {})
 
 
     # PUT method
     def put(self,url,data):
-        # make command
-        com = '%s --silent' % self.path
-        if not self.verifyHost:
-            com += ' --insecure'
-        if self.compress:
-            com += ' --compressed'
-        if self.sslCert != '':
-            com += ' --cert %s' % self.sslCert
-        if self.sslKey != '':
-            com += ' --key %s' % self.sslKey
-        # emulate PUT 
+        # emulate PUT: files are uploaded as multipart/form-data
+        boundary = '----autopyfactory%s' % uuid.uuid4().hex
+        body = []
         for key in data.keys():
-            com += ' -F "%s=@%s"' % (key,data[key])
-        com += ' %s' % url
-        # execute
+            tmpFile = open(data[key],'rb')
+            try:
+                content = tmpFile.read()
+            finally:
+                tmpFile.close()
+            body.append('--%s' % boundary)
+            body.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (key,os.path.basename(data[key])))
+            body.append('Content-Type: application/octet-stream')
+            body.append('')
+            body.append(content)
+        body.append('--%s--' % boundary)
+        body.append('')
+        headers = {'Content-Type' : 'multipart/form-data; boundary=%s' % boundary}
+        return self._request('POST', url, '\r\n'.join(body), headers)
+
+
+    # send the request, and decode the response
+    def _request(self,method,url,body,headers):
+        if self.compress:
+            headers['Accept-Encoding'] = 'gzip'
+        if 'json' in _enabledDecoders:
+            if len(_enabledDecoders) > 1:
+                headers['Accept'] = 'application/json, */*;q=0.5'
+            else:
+                headers['Accept'] = 'application/json'
         if self.verbose:
-            self.log.debug( "com is %s " % com )
-        ret = 0
-        out = ""
-            
+            self.log.debug("%s %s" % (method, url))
         try:
-            out = subprocess.check_output(com, shell=True)
-            #self.log.debug("regular return output %s" % out)
-            ret = 0
-        except subprocess.CalledProcessError as cpe:
-            ret = cpe.returncode
-            out = cpe.output
-            self.log.debug("ret is %s  out is %s " % (ret, out))
-        finally:
-            # remove temporary file
-            os.remove(tmpName)
-        if ret != 0:
-            ret = (ret % 255 , out)
-        return (ret, out)
+            result = self._client().request(method, url, body, headers)
+        except HTTPClientError as e:
+            self.log.debug("request failed: %s" % e)
+            out = str(e)
+            return ((EC_Failed, out), out)
+        self.status = result.status
+        self.headers = result.headers
+        self.contentType = result.getheader('content-type', '')
+        out = result.body
+        if result.getheader('content-encoding') == 'gzip':
+            out = zlib.decompress(out, 16 + zlib.MAX_WBITS)
+        if result.status >= 400:
+            self.log.debug("ret is %s  out is %s " % (result.status, out))
+            return ((result.status % 255, out), out)
+        return (0, out)
+
+
+    # the shared HTTP client for this certificate
+    def _client(self):
+        name = 'panda:%s:%s' % (self.sslCert, self.sslKey)
+        return HTTPClient(name,
+                          maxconnections=_transport['maxconnections'],
+                          timeout=_transport['timeout'],
+                          retries=_transport['retries'],
+                          backoff=_transport['backoff'],
+                          keyfile=self.sslKey or None,
+                          certfile=self.sslCert or None,
+                          verify=self.verifyHost)
             
 
 """
@@ -288,7 +323,7 @@ def submitJobs(jobs,srvID=None,toPending=False):
         logging.debug( output )
         return status,output
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr =  "ERROR submitJobs : %s %s" % (type,value)
@@ -316,7 +351,7 @@ def runTaskAssignment(jobs):
         logging.debug( output )
         return status,output
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr =  "ERROR runTaskAssignment : %s %s" % (type,value)
@@ -335,7 +370,7 @@ def getJobStatus(ids,srvID=None):
     data = {'ids':strIDs}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR getJobStatus : %s %s" % (type,value)
@@ -354,7 +389,7 @@ def getPandaIDwithJobExeID(ids):
     data = {'ids':strIDs}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR getPandaIDwithJobExeID : %s %s" % (type,value)
@@ -370,7 +405,7 @@ def getAssigningTask():
     url = baseURL + '/getAssigningTask'
     status,output = curl.get(url,{})
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         logging.debug( output )
         type, value, traceBack = sys.exc_info()
@@ -390,7 +425,7 @@ def seeCloudTask(ids):
     data = {'ids':strIDs}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR seeCloudTask : %s %s" % (type,value)
@@ -412,7 +447,7 @@ def killJobs(ids,code=None,verbose=False,srvID=None,useMailAsID=False):
     data = {'ids':strIDs,'code':code,'useMailAsID':useMailAsID}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR killJobs : %s %s" % (type,value)
@@ -435,7 +470,7 @@ def reassignJobs(ids,forPending=False):
         data['forPending'] = True
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR reassignJobs : %s %s" % (type,value)
@@ -454,7 +489,7 @@ def queryPandaIDs(ids):
     data = {'ids':strIDs}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR queryPandaIDs : %s %s" % (type,value)
@@ -473,7 +508,7 @@ def queryJobInfoPerCloud(cloud,schedulerID=None):
         data['schedulerID'] = schedulerID
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR queryJobInfoPerCloud : %s %s" % (type,value)
@@ -494,7 +529,7 @@ def getJobStatistics(sourcetype=None):
             data['sourcetype'] = sourcetype            
         status,output = curl.get(url,data)
         try:
-            tmpRet = status,pickle.loads(output)
+            tmpRet = status,_decode(output,curl.contentType)
             if status != 0:
                 return tmpRet
         except:
@@ -529,7 +564,7 @@ def getJobStatisticsForBamboo():
         data = {}
         status,output = curl.get(url,data)
         try:
-            tmpRet = status,pickle.loads(output)
+            tmpRet = status,_decode(output,curl.contentType)
             if status != 0:
                 return tmpRet
         except:
@@ -567,7 +602,7 @@ def getHighestPrioJobStat(perPG=False):
     data = {'perPG':perPG}
     status,output = curl.get(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         logging.debug( output )
         type, value, traceBack = sys.exc_info()
@@ -584,7 +619,7 @@ def getJobsToBeUpdated(limit=5000,lockedby='',srvID=None):
     url = _getURL('URL',srvID) + '/getJobsToBeUpdated'
     status,output = curl.get(url,{'limit':limit,'lockedby':lockedby})
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         logging.debug( output )
         type, value, traceBack = sys.exc_info()
@@ -607,7 +642,7 @@ def updateProdDBUpdateTimes(params,verbose=False,srvID=None):
     data = {'params':strPar}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR updateProdDBUpdateTimes : %s %s" % (type,value)
@@ -623,7 +658,7 @@ def getPandaIDsSite(site,status,limit=500):
     url = baseURL + '/getPandaIDsSite'
     status,output = curl.get(url,{'site':site,'status':status,'limit':limit})
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         logging.debug( output )
         type, value, traceBack = sys.exc_info()
@@ -654,7 +689,7 @@ def getJobStatisticsPerSite(predefined=False,workingGroup='',countryGroup='',job
             data['readArchived'] = readArchived    
         status,output = curl.get(url,data)
         try:
-            tmpRet = status,pickle.loads(output)
+            tmpRet = status,_decode(output,curl.contentType)
             if status != 0:
                 return tmpRet
         except:
@@ -689,7 +724,7 @@ def getJobStatisticsWithLabel(site=''):
         data['site'] = site
     status,output = curl.get(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         logging.debug( output )
         type, value, traceBack = sys.exc_info()
@@ -707,7 +742,7 @@ def getJobStatisticsPerUserSite():
     data = {}
     status,output = curl.get(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         logging.debug( output )
         type, value, traceBack = sys.exc_info()
@@ -727,7 +762,7 @@ def queryLastFilesInDataset(datasets):
     data = {'datasets':strDSs}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         logging.debug( "ERROR queryLastFilesInDataset : %s %s" % (type,value))
@@ -796,7 +831,7 @@ def resubmitJobs(ids):
     data = {'ids':strIDs}
     status,output = curl.post(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         logging.debug( "ERROR resubmitJobs : %s %s" % (type,value))
@@ -814,7 +849,7 @@ def getSiteSpecs(siteType=None):
         data = {'siteType':siteType}
     status,output = curl.get(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR getSiteSpecs : %s %s" % (type,value)
@@ -830,7 +865,7 @@ def getCloudSpecs():
     url = baseURL + '/getCloudSpecs'
     status,output = curl.get(url,{})
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR getCloudSpecs : %s %s" % (type,value)
@@ -838,6 +873,71 @@ def getCloudSpecs():
         return EC_Failed,output+'\n'+errStr
 
 
+# conditional GET
+#
+# validators is what was returned by the previous call for the same URL,
+# or None the first time. Returns (status, output, validators),
+# with output None when the content has not changed.
+# Servers supporting ETag or Last-Modified answer 304 Not Modified,
+# for the others the content is compared with the hash of the previous one.
+def _getIfModified(url,data,validators):
+    validators = validators or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last-modified'):
+        headers['If-Modified-Since'] = validators['last-modified']
+    # instantiate curl
+    curl = _Curl()
+    # execute
+    status,output = curl.get(url,data,headers)
+    if status != 0:
+        return status,output,validators
+    if curl.status == 304:
+        return 0,None,validators
+    newValidators = {'etag'          : curl.headers.get('etag'),
+                     'last-modified' : curl.headers.get('last-modified'),
+                     'hash'          : hashlib.md5(output).hexdigest(),
+                     'content-type'  : curl.contentType,
+                     }
+    if newValidators['hash'] == validators.get('hash'):
+        return 0,None,newValidators
+    return 0,output,newValidators
+
+
+# get site specs, only if they changed since the previous call
+def getSiteSpecsIfModified(siteType=None,validators=None):
+    url = baseURL + '/getSiteSpecs'
+    data = {}
+    if siteType != None:
+        data = {'siteType':siteType}
+    status,output,validators = _getIfModified(url,data,validators)
+    if status != 0 or output is None:
+        return status,output,validators
+    try:
+        return status,_decode(output,validators['content-type']),validators
+    except:
+        type, value, traceBack = sys.exc_info()
+        errStr = "ERROR getSiteSpecsIfModified : %s %s" % (type,value)
+        logging.debug( errStr )
+        return EC_Failed,output+'\n'+errStr,None
+
+
+# get cloud specs, only if they changed since the previous call
+def getCloudSpecsIfModified(validators=None):
+    url = baseURL + '/getCloudSpecs'
+    status,output,validators = _getIfModified(url,{},validators)
+    if status != 0 or output is None:
+        return status,output,validators
+    try:
+        return status,_decode(output,validators['content-type']),validators
+    except:
+        type, value, traceBack = sys.exc_info()
+        errStr = "ERROR getCloudSpecsIfModified : %s %s" % (type,value)
+        logging.debug( errStr )
+        return EC_Failed,output+'\n'+errStr,None
+
+
 # get nPilots
 def getNumPilots():
     # instantiate curl
@@ -846,7 +946,7 @@ def getNumPilots():
     url = baseURL + '/getNumPilots'
     status,output = curl.get(url,{})
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR getNumPilots : %s %s" % (type,value)
@@ -879,7 +979,7 @@ def getRW(priority=0):
     data = {'priority':priority}        
     status,output = curl.get(url,data)
     try:
-        return status,pickle.loads(output)
+        return status,_decode(output,curl.contentType)
     except:
         type, value, traceBack = sys.exc_info()
         errStr = "ERROR getRW : %s %s" % (type,value)
@@ -45,7 +45,10 @@ from autopyfactory.authmanager import AuthManager
 from autopyfactory.cleanlogs import CleanLogs
 from autopyfactory.config import ConfigHandler
 from autopyfactory.configloader import Config, ConfigManager
+from autopyfactory.cyclescheduler import CycleScheduler
 from autopyfactory.logserver import LogServer
+from autopyfactory.mappings import MappingsRegistry
+from autopyfactory.pilotbudget import PilotBudget
 from autopyfactory.queues import APFQueuesManager
 from autopyfactory.threadsmanagement import ThreadsRegistry
 
@@ -374,7 +377,7 @@ class Factory(object):
     Class implementing the main loop. 
     The class has two main goals:
             1. load the config files
-            2. launch a new thread per queue 
+            2. launch a new APFQueue object per queue 
 
     Information about queues created and running is stored in a 
     APFQueuesManager object.
@@ -434,6 +437,12 @@ class Factory(object):
         # APF Queues Manager 
         self.apfqueuesmanager = APFQueuesManager(self)
 
+        # scheduler for the cycles of all APF Queues
+        self.cyclescheduler = CycleScheduler(self)
+
+        # pilots allowed per factory, shared by all APF Queues
+        self.pilotbudget = PilotBudget(self)
+
         self._authmanager()
         self._queues_monitor_conf()
         self._mappings()
@@ -507,8 +516,11 @@ class Factory(object):
         self.mappingscf = self.fcl.generic_get('Factory', 'mappingsConf') 
         self.log.debug("mappings.conf file(s) = %s" % self.mappingscf)
 
+        # parsed once, and shared by all plugins
+        self.mappings = MappingsRegistry()
         try:
-            self.mappingscl = ConfigManager().getConfig(self.mappingscf)
+            self.mappings.load(self.mappingscf)
+            self.mappingscl = self.mappings.mappingscl
         except ConfigFailure:
             self.log.error('Failed to create ConfigLoader object for mappings')
             sys.exit(0)
@@ -561,6 +573,8 @@ class Factory(object):
         self.log.debug("Starting.")
         self.log.info("Starting all Queue threads...")
 
+        self.cyclescheduler.start()
+
         # first call to reconfig() to load initial qcl configuration
         ###self.reconfig()
         
@@ -0,0 +1,365 @@
+#! /usr/bin/env python
+
+"""
+    Thread-safe HTTP(S) client with persistent (keep-alive) connections.
+
+    Connections are pooled per scheme://host:port,
+    and the number of simultaneous connections to each server is bounded.
+    Failed requests are retried with exponential backoff,
+    but only for idempotent methods, unless the caller asks for it,
+    and never after a timeout: the server may have processed the request.
+
+    Clients are shared: all the callers asking for the same name
+    get the same HTTPClient object. For example:
+
+        client = HTTPClient('monitor', timeout=30)
+        result = client.request('PUT', 'http://host/api/jobs', data)
+        result.status
+        result.read()
+"""
+
+import errno
+import httplib
+import logging
+import socket
+import ssl
+import threading
+import time
+import urlparse
+
+from StringIO import StringIO
+
+
+class HTTPClientError(Exception):
+    """
+    Raised when a request fails after all retries.
+    """
+    pass
+
+
+class _staleconnection(Exception):
+    """
+    A reused connection was closed by the server
+    before any byte of the response was received.
+    """
+    pass
+
+
+class HTTPResult(object):
+    """
+    -----------------------------------------------------------------------
+    Response of a HTTP request.
+    The body has already been read, so the connection could be reused.
+    It mimics the file-like object returned by urllib2.urlopen()
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.code = status
+        self.reason = reason
+        self.headers = dict(headers)
+        self.body = body
+        self._fp = StringIO(body)
+
+    def read(self, *k):
+        return self._fp.read(*k)
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def __str__(self):
+        return "HTTPResult: %s %s (%d bytes)" % (self.status, self.reason, len(self.body))
+
+
+class _connectionpool(object):
+    """
+    -----------------------------------------------------------------------
+    Idle connections to a single server,
+    and a semaphore to bound the number of connections in use.
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, scheme, host, port, maxconnections, keyfile=None, certfile=None, verify=True):
+        self.log = logging.getLogger('autopyfactory.httpclient')
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.keyfile = keyfile
+        self.certfile = certfile
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.idle = []
+        self.slots = threading.BoundedSemaphore(maxconnections)
+
+
+    # errors meaning that the server closed an idle connection
+    closederrnos = [errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED]
+
+    def request(self, method, path, body, headers, timeout):
+        """
+        sends a single request, reusing an idle connection if possible.
+        If a reused connection turns out to be closed by the server
+        before any response was received, the request is sent again 
+        once on a new connection.
+        """
+        self.slots.acquire()
+        try:
+            conn, reused = self._getconnection(timeout)
+            try:
+                return self._send(conn, method, path, body, headers, reused)
+            except _staleconnection as e:
+                self.log.debug('persistent connection to %s was closed (%s). Opening a new one' %(self.host, e))
+                conn = self._newconnection(timeout)
+                return self._send(conn, method, path, body, headers, False)
+        finally:
+            self.slots.release()
+
+
+    def _send(self, conn, method, path, body, headers, reused=False):
+        """
+        :raise _staleconnection: if a reused connection was found closed
+        """
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+        except Exception as e:
+            conn.close()
+            if reused and self._closed(e):
+                raise _staleconnection(e)
+            raise
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self.lock.acquire()
+            try:
+                self.idle.append(conn)
+            finally:
+                self.lock.release()
+        return HTTPResult(response.status, response.reason, response.getheaders(), data)
+
+
+    def _closed(self, e):
+        """
+        True if the error means that the server had closed the connection
+        before the request, so it was not processed.
+        A timeout does not: the server may be processing it.
+        """
+        if isinstance(e, socket.timeout):
+            return False
+        if isinstance(e, httplib.BadStatusLine):
+            return True
+        return isinstance(e, socket.error) and e.errno in self.closederrnos
+
+
+    def _getconnection(self, timeout):
+        """
+        returns a tuple (connection, True if it is an idle connection being reused)
+        """
+        self.lock.acquire()
+        try:
+            conn = None
+            if self.idle:
+                conn = self.idle.pop()
+        finally:
+            self.lock.release()
+        if conn is None:
+            return self._newconnection(timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+
+    def _newconnection(self, timeout):
+        if self.scheme == 'https':
+            kw = {}
+            if not self.verify and hasattr(ssl, '_create_unverified_context'):
+                # python >= 2.7.9 checks the server certificate by default
+                kw['context'] = ssl._create_unverified_context()
+            return httplib.HTTPSConnection(self.host, self.port,
+                                           key_file=self.keyfile,
+                                           cert_file=self.certfile,
+                                           timeout=timeout,
+                                           **kw)
+        return httplib.HTTPConnection(self.host, self.port, timeout=timeout)
+
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+        finally:
+            self.lock.release()
+
+
+class _httpclient(object):
+    """
+    -----------------------------------------------------------------------
+    HTTP client with one pool of persistent connections per server.
+    -----------------------------------------------------------------------
+    Public Interface:
+            request(method, url, data=None, headers=None, timeout=None, retry=None)
+            close()
+    -----------------------------------------------------------------------
+    """
+
+    # status codes worth trying again
+    retrycodes = [502, 503, 504]
+    # methods retried by default. 
+    # Not PUT or POST: the services we talk to do not guarantee
+    # that sending them twice is harmless
+    idempotent = ['GET', 'HEAD', 'OPTIONS', 'DELETE']
+
+    def __init__(self, name, maxconnections=4, timeout=30, retries=3, backoff=1, keyfile=None, certfile=None, verify=True):
+        """
+        :param string name: name of the shared client
+        :param int maxconnections: max number of simultaneous connections per server
+        :param int timeout: seconds for each request
+        :param int retries: number of times a failed request is tried again
+        :param int backoff: seconds before the first retry, doubled for each following one
+        :param string keyfile: private key for HTTPS client authentication
+        :param string certfile: certificate for HTTPS client authentication
+        :param bool verify: check the certificate of HTTPS servers
+        """
+        self.log = logging.getLogger('autopyfactory.httpclient')
+        self.name = name
+        self.maxconnections = maxconnections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.keyfile = keyfile
+        self.certfile = certfile
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.log.debug('HTTP client %s initialized with maxconnections=%s, timeout=%s, retries=%s, backoff=%s' %(name, maxconnections, timeout, retries, backoff))
+
+
+    def request(self, method, url, data=None, headers=None, timeout=None, retry=None):
+        """
+        :param string method: "GET", "PUT", "POST" or "DELETE"
+        :param string url: full URL
+        :param string data: body of the request
+        :param dict headers: additional HTTP headers
+        :param int timeout: overrides the default timeout
+        :param bool retry: True if the request can be safely sent again.
+                 Defaults to True only for idempotent methods.
+                 Requests are never sent again after a timeout.
+        :return HTTPResult: the response,
+                 it could have an error status code after all retries.
+        :raise HTTPClientError: if no response was ever received
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if retry is None:
+            retry = method.upper() in self.idempotent
+        retries = 0
+        if retry:
+            retries = self.retries
+        pool, path = self._getpool(url)
+
+        h = {}
+        if data is not None:
+            # same default as urllib2
+            h['Content-Type'] = 'application/x-www-form-urlencoded'
+        if headers:
+            h.update(headers)
+
+        attempt = 0
+        while True:
+            try:
+                result = pool.request(method, path, data, h, timeout)
+                if result.status not in self.retrycodes or attempt >= retries:
+                    return result
+                self.log.debug('%s %s returned %s' %(method, url, result.status))
+            except socket.timeout as e:
+                raise HTTPClientError('%s %s timed out after %d attempts: %s' %(method, url, attempt + 1, e))
+            except (socket.error, httplib.HTTPException) as e:
+                if attempt >= retries:
+                    raise HTTPClientError('%s %s failed after %d attempts: %s' %(method, url, attempt + 1, e))
+                self.log.debug('%s %s failed: %s' %(method, url, e))
+            wait = self.backoff * (2 ** attempt)
+            attempt += 1
+            self.log.debug('retrying %s %s in %s seconds (attempt %d)' %(method, url, wait, attempt))
+            time.sleep(wait)
+
+
+    def _getpool(self, url):
+        """
+        returns the connection pool for the server in the URL,
+        and the path (plus query) to be requested.
+        """
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme or 'http'
+        host = parts.hostname
+        port = parts.port
+        if port is None:
+            if scheme == 'https':
+                port = httplib.HTTPS_PORT
+            else:
+                port = httplib.HTTP_PORT
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' %(path, parts.query)
+
+        key = (scheme, host, port)
+        self.lock.acquire()
+        try:
+            pool = self.pools.get(key, None)
+            if pool is None:
+                pool = _connectionpool(scheme, host, port, self.maxconnections, self.keyfile, self.certfile, self.verify)
+                self.pools[key] = pool
+        finally:
+            self.lock.release()
+        return pool, path
+
+
+    def close(self):
+        """
+        closes all idle connections
+        """
+        self.lock.acquire()
+        try:
+            for pool in self.pools.values():
+                pool.close()
+        finally:
+            self.lock.release()
+
+
+# =============================================================================
+#   Singleton wrapper
+# =============================================================================
+
+class HTTPClient(object):
+
+    instances = {}
+    lock = threading.Lock()
+
+    def __new__(cls, *k, **kw):
+        # ---------------------------
+        # get the id:
+        #
+        # the name of the client,
+        # so all callers for the same service share connections.
+        # Options are only used by the first caller.
+        id = k[0]
+        # ---------------------------
+
+        HTTPClient.lock.acquire()
+        try:
+            if not id in HTTPClient.instances.keys():
+                HTTPClient.instances[id] = _httpclient(*k, **kw)
+            return HTTPClient.instances[id]
+        finally:
+            HTTPClient.lock.release()
@@ -21,13 +21,13 @@ major, minor, release, st, num = sys.version_info
 General info scheme:
 
     BatchStatusPlugin
-       getInfo   ->    BatchStatusInfo[apfqname] -> BatchQueueInfo(QueueInfo)
+       getInfo   ->    BatchStatusInfo[apfqname] -> StateCounts
                                                        .state1  -> 0
                                                        .state2  -> 123
        getJobInfo ->   BatchStatusInfo[apfqname] -> 
                   
     WMSStatusPlugin
-       getInfo   ->     WMSStatusInfo[wmsqname]  ->  JobsInfo(QueueInfo)
+       getInfo   ->     WMSStatusInfo[wmsqname]  ->  WMSQueueInfo
                                                            .state1 -> 0
                                                            .state2 -> 123
                           
@@ -37,11 +37,11 @@ General info scheme:
              
 Inheritance:
 
-    BaseStatusInfo           BaseInfo
-        |                       |
-        V                       V
-    BatchStatusInfo       BatchQueueInfo
-    WMSStatusInfo         WMSQueueInfo
+    BaseStatusInfo           BaseInfo          CountsRecord
+        |                       |                  |
+        V                       V                  V
+    BatchStatusInfo         SiteInfo           WMSQueueInfo
+    WMSStatusInfo           CloudInfo
   
 """
     
@@ -76,10 +76,10 @@ class BaseInfo(object):
     Base for aggregate (attribute-oriented) Info classes which are used per APF/WMS queue.
     Public Interface:
     
-            fill(dictionary, mappings=None, reset=True)                
+            fill(dictionary, mappings=None, reset=True, unknown=None)
     """
 
-    def fill(self, dictionary, mappings=None, reset=True):
+    def fill(self, dictionary, mappings=None, reset=True, unknown=None):
         """
         method to fill object attributes with values from a dictionary.
 
@@ -106,48 +106,50 @@ class BaseInfo(object):
         then, the mapping must be like
                 mapping = {'a':'x', 'b':'y'}
 
+        The mapping can also be a compiled MappingTable.
+
         If reset is True, new values override whatever the attributes had.
         If reset is False, the new values are added to the previous value.
+        In both cases, values of keys mapped to the same attribute are added.
+
+        Keys not in the mappings are ignored. They are added to the set
+        unknown, if given, so the caller can report them only once.
+        Otherwise they are reported in a single message.
         """
-        usedk = []
+        if isinstance(mappings, MappingTable):
+            mappings = mappings.mappings
+        attrs = self.__dict__
+        usedk = set()
+        ignored = []
         for k,v in dictionary.iteritems():
-            try:
-                if mappings:
-                    if mappings.has_key(k):
-                        k = mappings[k]
-                    else:
-                        # a key in the dictionary is not in the mapping
-                        # we ignore that case
-                        log = logging.getLogger('autopyfactory')
-                        log.warning('ignoring unkown key %s in the dictionary' %k)
-                        continue
-            except KeyError as e:
-                log = logging.getLogger('autopyfactory')
-                log.error("fill(): Exception: %s" % str(e))
-                log.error("Stack Trace: %s " % traceback.format_exc()) 
-                log.error("k: %s v: %s dictionary: %s mappings: %s" % (k,v, dictionary, mappings))
-            
+            if mappings:
+                try:
+                    k = mappings[k]
+                except KeyError:
+                    # a key in the dictionary is not in the mapping
+                    # we ignore that case
+                    ignored.append(k)
+                    continue
 
             # if the key is new, then ...
             #       if no reset: we add the value to the old one
             #       if reset: we do nothing, so the final value will be the new one
             # if the key is not new...
             #       we just add the value to the stored one
-            if k not in usedk:
-                usedk.append(k)
-                if not reset:
-                    try:
-                        v = self.__dict__[k] + v
-                    except KeyError:
-                        pass
-                    self.__dict__[k] = v
-            else:
+            if k in usedk or not reset:
                 try:
-                    v = self.__dict__[k] + v
+                    v = attrs[k] + v
                 except KeyError:
-                    # missing keys no longer handled. 
                     pass
-            self.__dict__[k] = v
+            usedk.add(k)
+            attrs[k] = v
+
+        if ignored:
+            if unknown is not None:
+                unknown.update(ignored)
+            else:
+                log = logging.getLogger('autopyfactory')
+                log.warning('ignoring unkown keys %s in the dictionary' %ignored)
 
     def __getattr__(self, name):
         """
@@ -167,7 +169,7 @@ class BatchStatusInfo(BaseStatusInfo):
     
     def __init__(self):
         self.log = logging.getLogger('autopyfactory')
-        self.default = QueueInfo
+        self.default = StateCounts
 
     def __str__(self):
         s = "BatchStatusInfo: %d queues." % len(self)
@@ -208,7 +210,146 @@ class CloudInfo(BaseInfo):
 
 
 
-class WMSQueueInfo(BaseInfo):
+class MappingTable(object):
+    """
+    -----------------------------------------------------------------------
+    Mappings raw key -> state, from a section of mappings.conf,
+    compiled once into an index in a list of states,
+    so counts can be accumulated into a plain list.
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, mappings, states=None):
+        """
+        :param dict mappings: raw key -> state
+        :param list states: states to go first in the list,
+                            for example the slots of a CountsRecord
+        """
+        self.mappings = dict(mappings)
+        self.states = list(states or [])
+        position = dict([(state, i) for i, state in enumerate(self.states)])
+        self.index = {}
+        for raw, state in self.mappings.items():
+            if state not in position:
+                position[state] = len(self.states)
+                self.states.append(state)
+            self.index[raw] = position[state]
+
+    def __eq__(self, other):
+        return isinstance(other, MappingTable) and self.mappings == other.mappings
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class CountsRecord(object):
+    """
+    -----------------------------------------------------------------------
+    Compact record with the number of jobs per state.
+    Known states, listed in the subclass, live in __slots__ 
+    and default to 0. Any other state goes into a side dictionary.
+    Objects are built in bulk with fromdicts().
+    -----------------------------------------------------------------------
+    Public Interface:
+            fromdicts(dicts, mappings=None, unknown=None)     (classmethod)
+            add(counts, mappings=None, unknown=None)
+            getraw()
+    -----------------------------------------------------------------------
+    """
+    __slots__ = ['_extra']
+    states = []
+
+    def __init__(self):
+        for state in self.states:
+            object.__setattr__(self, state, 0)
+        object.__setattr__(self, '_extra', None)
+
+    @classmethod
+    def fromdicts(cls, dicts, mappings=None, unknown=None):
+        """
+        builds a record adding the counts from a list of dictionaries.
+        If mappings are given, keys are translated into states,
+        and keys not in the mappings are ignored, 
+        and added to the set unknown if given.
+        Mappings should be a MappingTable, compiled once,
+        but a plain dictionary is also accepted.
+        """
+        record = cls()
+        if mappings is None:
+            for counts in dicts:
+                record.add(counts)
+            return record
+        if not isinstance(mappings, MappingTable):
+            mappings = MappingTable(mappings, cls.states)
+        totals = record._accumulate(dicts, mappings, unknown)
+        for state, n in zip(mappings.states, totals):
+            if n:
+                setattr(record, state, n)
+        return record
+
+    def add(self, counts, mappings=None, unknown=None):
+        """
+        adds the counts in a dictionary {state: n}
+        """
+        if mappings is None:
+            for k, n in counts.iteritems():
+                setattr(self, k, getattr(self, k) + n)
+            return
+        if not isinstance(mappings, MappingTable):
+            mappings = MappingTable(mappings, self.states)
+        totals = self._accumulate([counts], mappings, unknown)
+        for state, n in zip(mappings.states, totals):
+            if n:
+                setattr(self, state, getattr(self, state) + n)
+
+    def _accumulate(self, dicts, mappings, unknown):
+        """
+        adds the counts, in a single pass, 
+        into a list ordered as mappings.states
+        """
+        totals = [0] * len(mappings.states)
+        index = mappings.index
+        for counts in dicts:
+            for k, n in counts.iteritems():
+                i = index.get(k)
+                if i is None:
+                    if unknown is not None:
+                        unknown.add(k)
+                    continue
+                totals[i] += n
+        return totals
+
+    def __getattr__(self, name):
+        """
+        Return 0 for states with no jobs.
+        Only called for names that are not slots.
+        """
+        if name.startswith('__') or name == '_extra':
+            raise AttributeError(name)
+        extra = self._extra
+        if extra is None:
+            return 0
+        return extra.get(name, 0)
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[intern(str(name))] = value
+
+    def getraw(self):
+        """
+        returns the counts as a new dictionary
+        """
+        raw = dict([(state, getattr(self, state)) for state in self.states])
+        if self._extra:
+            raw.update(self._extra)
+        return raw
+
+
+class WMSQueueInfo(CountsRecord):
     """
     -----------------------------------------------------------------------
     Empty anonymous placeholder for attribute-based WMS job information.
@@ -227,18 +368,8 @@ class WMSQueueInfo(BaseInfo):
 
     -----------------------------------------------------------------------
     """
-
-    def __init__(self):
-        self.log = logging.getLogger('autopyfactory')
-
-    def __getattr__(self, name):
-        """
-        Return 0 for non-existent attributes, otherwise behave normally.         
-        """
-        try:
-            return self.__getattribute__(name)
-        except AttributeError:
-            return 0        
+    states = ['notready', 'ready', 'running', 'done', 'failed', 'unknown']
+    __slots__ = states
 
     def __str__(self):
         s = "WMSQueueInfo: notready=%s, ready=%s, running=%s, done=%s, failed=%s, unknown=%s" %\
@@ -290,19 +421,58 @@ class SiteInfo(BaseInfo):
         self.log = logging.getLogger('autopyfactory')
 
 
-class QueueInfo(BaseInfo):
+class StateCounts(object):
     """
-    Empty anonymous placeholder for aggregated queue information for a single APF queue.  
+    -----------------------------------------------------------------------
+    Immutable record with the number of jobs per state for a single APF queue,
+    as calculated by autopyfactory.aggregation.StatusAggregator.
+    States are accessed as attributes (.pending, .running, ...).
 
-    Returns 0 as value for any un-initialized attribute. 
-    
+    Returns 0 as value for any state with no jobs.
+    -----------------------------------------------------------------------
     """
-    def __init__(self):
-        self.log = logging.getLogger('autopyfactory')
-    
+
+    def __init__(self, counts=None):
+        """
+        :param dict counts: number of jobs indexed by state
+        """
+        if counts is None:
+            counts = {}
+        object.__setattr__(self, '_counts', counts)
+
+    def __getattr__(self, name):
+        """
+        Return 0 for states with no jobs.
+        """
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._counts.get(name, 0)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StateCounts objects are read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("StateCounts objects are read-only")
+
+    def getraw(self):
+        """
+        returns a copy of the counts as a dictionary
+        """
+        return dict(self._counts)
+
+    def __eq__(self, other):
+        return isinstance(other, StateCounts) and self._counts == other._counts
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
     def __str__(self):
-        s = "QueueInfo: pending=%d, running=%d, suspended=%d" % (self.pending, 
-                                                                 self.running, 
-                                                                 self.suspended)
+        s = "StateCounts: %s" % ", ".join(["%s=%d" % (k, v) for k, v in sorted(self._counts.items())])
         return s
-  
+
+    def __repr__(self):
+        return str(self)
+
+
+# the counts of a single APF queue are StateCounts objects
+QueueInfo = StateCounts
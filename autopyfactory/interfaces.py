@@ -8,14 +8,25 @@ class SchedInterface(object):
     -----------------------------------------------------------------------
     Public Interface:
             calcSubmitNum()
+            compile()
     -----------------------------------------------------------------------
     """
     def calcSubmitNum(self, nsub=0):
         """
         Calculates number of jobs to submit for the associated APF queue. 
+        Returns (nsub, msg). msg is a record (name, ((key, value), ...)),
+        rendered as text only when needed, a string, or None.
         """
         raise NotImplementedError
 
+    def compile(self):
+        """
+        Returns the same algorithm as a SchedStep, 
+        for autopyfactory.schedpipeline, 
+        or None if calcSubmitNum() must be called.
+        """
+        return None
+
 
 class BatchStatusInterface(object):
     """
@@ -26,6 +37,8 @@ class BatchStatusInterface(object):
     Public Interface:
             getInfo()
             getJobInfo()
+            getTotalInfo()
+            getWMSQueueInfo()
     
     Returns BatchStatusInfo object
      
@@ -46,6 +59,21 @@ class BatchStatusInterface(object):
         about that queue.  
         """
         raise NotImplementedError
+
+    def getTotalInfo(self):
+        """
+        Returns aggregate statistics about jobs in batch system, 
+        added over all queues. 
+        """
+        raise NotImplementedError
+
+    def getWMSQueueInfo(self, wmsqueue=None):
+        """
+        Returns aggregate statistics about jobs in batch system, 
+        added over the queues serving each WMS queue. Indexed by WMS queue.
+        If wmsqueue is provided, returns just the object for that WMS queue.
+        """
+        raise NotImplementedError
     
 
 class BatchHistoryInterface(object):
@@ -324,3 +352,133 @@ class _thread(threading.Thread):
 
     def _join(self):
         pass
+
+
+    def _forcenextloop(self):
+        """
+        the next loop of actions starts without waiting for 
+        _thread_loop_interval. 
+        If a loop is already running, that one is enough.
+        """
+        self._thread_last_action = 0
+
+
+# ================================================================================
+#       STATUS SNAPSHOTS PUBLISHING 
+# ================================================================================
+
+class _publisher(object):
+    """
+    -----------------------------------------------------------------------
+    Mixin for the status plugins. 
+    Each time a plugin has a new snapshot of info ready, it calls _publish(),
+    which increases the snapshot version and signals the subscribers, 
+    so they do not need to poll getInfo() to find out. 
+    -----------------------------------------------------------------------
+    Public Interface:
+            subscribe(callback)
+            unsubscribe(callback)
+            waitForSnapshot(version=0, timeout=None)
+            getSnapshotAge()
+            snapshotversion
+            last_timestamp
+    -----------------------------------------------------------------------
+    """
+
+    def _initpublisher(self):
+        # version of the last snapshot published, 0 means none yet
+        self.snapshotversion = 0
+        # time of the last snapshot published, as seconds since epoch
+        self.last_timestamp = 0
+        self._snapshotcond = threading.Condition()
+        self._subscribers = []
+
+
+    def subscribe(self, callback):
+        """
+        callback is called, with no arguments, 
+        every time a new snapshot is published. 
+        It is called from the plugin thread, so it must be fast.
+        """
+        self._snapshotcond.acquire()
+        try:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+        finally:
+            self._snapshotcond.release()
+
+
+    def unsubscribe(self, callback):
+        self._snapshotcond.acquire()
+        try:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+        finally:
+            self._snapshotcond.release()
+
+
+    def waitForSnapshot(self, version=0, timeout=None):
+        """
+        blocks until a snapshot newer than version is published,
+        or timeout seconds have passed. 
+        Returns the current snapshot version.
+        """
+        self._snapshotcond.acquire()
+        try:
+            if self.snapshotversion <= version:
+                self._snapshotcond.wait(timeout)
+            return self.snapshotversion
+        finally:
+            self._snapshotcond.release()
+
+
+    def getSnapshotAge(self):
+        """
+        seconds since the last snapshot was published, 
+        or None if there is none yet.
+        Allows the callers to decide by themselves what to do
+        with info that is getting old.
+        """
+        if self.snapshotversion == 0:
+            return None
+        return time.time() - self.last_timestamp
+
+
+    def _servable(self, timestamp, softmaxage, hardmaxage):
+        """
+        stale-while-revalidate check for info stored at time timestamp.
+            - younger than softmaxage: it is served.
+            - older than softmaxage: it is still served,
+              but a new query is requested right away.
+            - older than hardmaxage: it is not served anymore.
+        A maxage of 0 means no limit.
+        """
+        age = int(time.time()) - timestamp
+        if hardmaxage > 0 and age > hardmaxage:
+            self.log.warning('Info is %d seconds old, more than hard maxage %d. Not serving it.' %(age, hardmaxage))
+            return False
+        if softmaxage > 0 and age > softmaxage:
+            self.log.warning('Info is %d seconds old, more than maxage %d. Serving it while refreshing.' %(age, softmaxage))
+            if isinstance(self, _thread):
+                self._forcenextloop()
+        return True
+
+
+    def _publish(self):
+        """
+        to be called by the plugin after the new info has been stored
+        """
+        self._snapshotcond.acquire()
+        try:
+            self.snapshotversion += 1
+            self.last_timestamp = time.time()
+            self._snapshotcond.notifyAll()
+            subscribers = list(self._subscribers)
+        finally:
+            self._snapshotcond.release()
+
+        for callback in subscribers:
+            try:
+                callback()
+            except Exception as ex:
+                self.log.warning('exception captured when notifying a subscriber: %s' %ex)
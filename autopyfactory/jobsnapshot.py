@@ -0,0 +1,194 @@
+#! /usr/bin/env python
+
+"""
+    Compact, column oriented, snapshot of the jobs in a Condor queue.
+
+    Instead of one object per job, with every classad set as attribute,
+    the values are stored in one column per attribute and per APF queue.
+    Numerical attributes are stored in arrays of integers,
+    the rest of them in plain lists.
+
+        JobSnapshot
+            .queueindex      {apfqname: index}
+            .queuenames      [apfqname, ...]
+            [apfqname]   ->  [JobRow, JobRow, ...]   (created on demand)
+                                 .clusterid -> 1234
+                                 .qdate     -> 1500000000
+"""
+
+import logging
+
+from array import array
+
+
+class JobRow(object):
+    """
+    -----------------------------------------------------------------------
+    Lightweight, read-only, view of a single job in a JobSnapshot.
+    Values are read from the columns only when the attribute is accessed.
+    -----------------------------------------------------------------------
+    """
+    __slots__ = ['_columns', '_i']
+
+    def __init__(self, columns, i):
+        self._columns = columns
+        self._i = i
+
+    def __getattr__(self, attr):
+        try:
+            column = self._columns[attr]
+        except KeyError:
+            raise AttributeError("job has no attribute %s" %attr)
+        return column[self._i]
+
+    def __str__(self):
+        s = "JobRow: %s.%s " % (self.clusterid, self.procid)
+        for k in sorted(self._columns.keys()):
+            s += " %s=%s " % (k, self._columns[k][self._i])
+        return s
+
+    def __repr__(self):
+        return str(self)
+
+
+class JobSnapshot(object):
+    """
+    -----------------------------------------------------------------------
+    Jobs from a condor_q query, stored as per APF queue columns.
+    -----------------------------------------------------------------------
+    Public Interface:
+            keys()
+            __getitem__(apfqname)
+            __contains__(apfqname)
+            __len__()
+            column(apfqname, attr)
+            njobs(apfqname=None)
+    -----------------------------------------------------------------------
+    """
+
+    # attributes stored as arrays of integers
+    intattrs = ['clusterid',
+                'procid',
+                'qdate',
+                'jobstatus',
+                'enteredcurrentstatus',
+                'gridjobstatus',
+               ]
+
+    def __init__(self, classad_l, attribute_l):
+        """
+        :param list classad_l: output of condor_q
+        :param list attribute_l: attributes to be stored for each job
+        """
+        self.log = logging.getLogger('autopyfactory.jobsnapshot')
+
+        self.attribute_l = [attr for attr in attribute_l if attr != 'match_apf_queue']
+        self.queueindex = {}
+        self.queuenames = []
+        self.columns = []
+
+        for ca in classad_l:
+            qname = ca.get('match_apf_queue', None)
+            if qname is None:
+                continue
+            qi = self.queueindex.get(qname, None)
+            if qi is None:
+                qi = self._addqueue(qname)
+            columns = self.columns[qi]
+            for attr in self.attribute_l:
+                value = ca.get(attr, None)
+                if attr in JobSnapshot.intattrs:
+                    value = self._toint(value)
+                columns[attr].append(value)
+        self.log.debug("Created job snapshot with %d jobs for %d queues" %(self.njobs(), len(self.queuenames)))
+
+
+    def _addqueue(self, qname):
+        """
+        adds a new set of empty columns for an APF queue.
+        The name of the queue is interned, as the same
+        names are seen again on every snapshot.
+        """
+        qname = intern(str(qname))
+        qi = len(self.queuenames)
+        self.queueindex[qname] = qi
+        self.queuenames.append(qname)
+        columns = {}
+        for attr in self.attribute_l:
+            if attr in JobSnapshot.intattrs:
+                columns[attr] = array('l')
+            else:
+                columns[attr] = []
+        self.columns.append(columns)
+        return qi
+
+
+    def _toint(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
+
+
+    def keys(self):
+        return list(self.queuenames)
+
+
+    def __contains__(self, qname):
+        return qname in self.queueindex
+
+
+    def __len__(self):
+        return len(self.queuenames)
+
+
+    def __getitem__(self, qname):
+        """
+        returns a new list of JobRow views for the jobs in an APF queue.
+        Callers are free to sort or pop from that list.
+        """
+        qi = self.queueindex.get(qname, None)
+        if qi is None:
+            return []
+        columns = self.columns[qi]
+        return [JobRow(columns, i) for i in range(self._length(columns))]
+
+
+    def column(self, qname, attr):
+        """
+        returns the column of values of a given attribute
+        for the jobs in an APF queue.
+        Must not be modified by callers.
+        """
+        qi = self.queueindex.get(qname, None)
+        if qi is None:
+            return []
+        return self.columns[qi][attr]
+
+
+    def njobs(self, qname=None):
+        """
+        number of jobs in an APF queue, or in all of them
+        """
+        if qname is not None:
+            qi = self.queueindex.get(qname, None)
+            if qi is None:
+                return 0
+            return self._length(self.columns[qi])
+        return sum([self._length(columns) for columns in self.columns])
+
+
+    def _length(self, columns):
+        for column in columns.values():
+            return len(column)
+        return 0
+
+
+    def __str__(self):
+        s = "JobSnapshot: "
+        for qname in self.queuenames:
+            s += " %s=%d " % (qname, self.njobs(qname))
+        return s
+
+    def __repr__(self):
+        return str(self)
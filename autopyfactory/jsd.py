@@ -77,3 +77,42 @@ class JSDFile(object):
         jsdfile.close()
         self.log.debug('Leaving.')
 
+
+
+class JSDTemplate(object):
+    """
+    -----------------------------------------------------------------------
+    Submit description rendered once, with placeholders for the 
+    log directory and the log URL, the only parts that change
+    from one cycle to another (once per day).
+    -----------------------------------------------------------------------
+    Public Interface:
+            render(logdir, logurl, n=None)
+            text
+    -----------------------------------------------------------------------
+    """
+    LOGDIR_TOKEN = '@@APF_LOGDIR@@'
+    LOGURL_TOKEN = '@@APF_LOGURL@@'
+
+    def __init__(self, jsdfile):
+        """
+        :param JSDFile jsdfile: built with the tokens 
+                                as log directory and log URL
+        """
+        self.text = '\n'.join(jsdfile.lines)
+        self.rendered = None     # tuple (logdir, text with logdir and logurl in place)
+
+    def render(self, logdir, logurl, n=None):
+        """
+        returns the submit description for n pilots, as a string,
+        with the same content JSDFile.write() writes.
+        If n is None, there is no 'queue' line.
+        """
+        if self.rendered is None or self.rendered[0] != logdir:
+            # the date directory only changes once per day
+            text = self.text.replace(JSDTemplate.LOGDIR_TOKEN, logdir)
+            text = text.replace(JSDTemplate.LOGURL_TOKEN, logurl)
+            self.rendered = (logdir, text)
+        if n is None:
+            return '%s\n' %self.rendered[1]
+        return '%s\nqueue %d\n' %(self.rendered[1], n)
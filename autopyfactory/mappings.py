@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+"""
+    Registry of the mappings (mappings.conf), owned by the Factory.
+
+    The file is parsed only when the configuration is (re)loaded,
+    and each section is kept as a read-only dictionary.
+    The plugins ask the registry for the section each time they need it,
+    which is just a dictionary lookup, so they get the new mappings
+    after a reconfig. The same object is returned until then, so plugins
+    can recompile their own structures only when the object changes.
+
+        factory.mappings.get('CONDORBATCHSTATUS-JOBSTATUS2INFO')
+            -> FrozenMapping {'0': 'pending', '1': 'pending', ...}
+
+        factory.mappings.table('PANDAWMSSTATUS-JOBSSTATISTICSPERSITE2INFO', WMSQueueInfo.states)
+            -> MappingTable, compiled once
+"""
+
+import logging
+import threading
+
+from autopyfactory.configloader import ConfigManager
+from autopyfactory.info import MappingTable
+
+
+class FrozenMapping(dict):
+    """
+    -----------------------------------------------------------------------
+    Read-only dictionary.
+    -----------------------------------------------------------------------
+    """
+
+    def _readonly(self, *k, **kw):
+        raise TypeError("FrozenMapping objects are read-only")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+
+class MappingsRegistry(object):
+    """
+    -----------------------------------------------------------------------
+    Parsed sections of mappings.conf, and the MappingTable objects
+    compiled from them.
+    Everything is replaced at once by load() or update().
+    -----------------------------------------------------------------------
+    Public Interface:
+            load(mappingscf)
+            update(mappingscl)
+            get(section)
+            table(section, states=None)
+            version
+            mappingscl
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger('autopyfactory.mappings')
+        self.lock = threading.Lock()
+        self.mappingscl = None
+        self.sections = {}
+        self.tables = {}
+        self.version = 0
+
+
+    def load(self, mappingscf):
+        """
+        parses the mappings configuration files.
+        :param string mappingscf: comma-separated list of sources
+        :raise ConfigFailure: if the files cannot be parsed.
+               In that case, the previous mappings are kept.
+        """
+        self.log.debug('loading mappings from %s' %mappingscf)
+        mappingscl = ConfigManager().getConfig(mappingscf)
+        self.update(mappingscl)
+
+
+    def update(self, mappingscl):
+        """
+        replaces all the mappings with the sections of a Config object
+        """
+        sections = {}
+        for section in mappingscl.sections():
+            sections[section] = FrozenMapping(mappingscl.section2dict(section))
+
+        self.lock.acquire()
+        try:
+            self.mappingscl = mappingscl
+            self.sections = sections
+            self.tables = {}
+            self.version += 1
+        finally:
+            self.lock.release()
+        self.log.info('mappings version %d loaded, with %d sections' %(self.version, len(sections)))
+
+
+    def get(self, section):
+        """
+        :return FrozenMapping: raw value -> state
+        :raise KeyError: if the section does not exist
+        """
+        return self.sections[section]
+
+
+    def table(self, section, states=None):
+        """
+        :param list states: states to go first in the table
+        :return MappingTable: compiled on the first call after each load
+        """
+        key = (section, tuple(states or []))
+        self.lock.acquire()
+        try:
+            table = self.tables.get(key, None)
+            if table is None:
+                table = MappingTable(self.sections[section], states)
+                self.tables[key] = table
+            return table
+        finally:
+            self.lock.release()
@@ -0,0 +1,315 @@
+#! /usr/bin/env python
+
+"""
+    Asynchronous, batched, delivery of messages to a monitor service.
+
+    APFQueues only add messages to an in-memory queue, and never wait
+    for the monitor. A separate thread sends them in bulk,
+    when enough of them have been accumulated or after some time.
+
+        - jobs are sent in batches, in the order they were added.
+          When the queue is full, the oldest jobs are dropped.
+        - label status messages are coalesced:
+          only the latest message for each label is sent.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+
+from autopyfactory.interfaces import _thread
+
+
+class MonitorPublisher(_thread):
+    """
+    -----------------------------------------------------------------------
+    Outbound queue of monitor messages, flushed by a dedicated thread.
+    The actual delivery is done by the sender object, which must implement
+        sendJobs(jobs)          jobs is a list of dictionaries
+        sendLabel(label, msg)
+    both returning True on success.
+    -----------------------------------------------------------------------
+    Public Interface:
+            addJobs(jobs)
+            setLabel(label, msg)
+            flush()
+            getMetrics()
+            the interface inherited from _thread
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, name, sender, threadsregistry, interval=30, batchsize=500, maxsize=10000, spoolfile=None):
+        """
+        :param string name: for logging
+        :param sender: object doing the actual delivery
+        :param ThreadsRegistry threadsregistry:
+        :param int interval: max seconds between flushes
+        :param int batchsize: max number of jobs per request,
+                              also triggers a flush when reached
+        :param int maxsize: max number of jobs waiting to be sent
+        :param string spoolfile: where pending messages are saved at shutdown,
+                                 and read back at startup
+        """
+        _thread.__init__(self)
+        threadsregistry.add("util", self)
+        self.log = logging.getLogger('autopyfactory.monitorpublisher.%s' %name)
+
+        self.sender = sender
+        self.interval = interval
+        self.batchsize = batchsize
+        self.maxsize = maxsize
+        self.spoolfile = spoolfile
+
+        self.lock = threading.Lock()
+        self.flushevent = threading.Event()
+        self.jobs = collections.deque()
+        self.labels = {}
+        self.lastflush = time.time()
+
+        self.metrics = {'jobs_added': 0,
+                        'jobs_sent': 0,
+                        'jobs_dropped': 0,
+                        'labels_added': 0,
+                        'labels_coalesced': 0,
+                        'labels_sent': 0,
+                        'requests_failed': 0,
+                        'flushes': 0,
+                        'last_flush_duration': 0.0,
+                       }
+        self.log.debug('MonitorPublisher: Object initialized.')
+
+
+    # ----------------------------------------------------------------------
+    #  public interface
+    # ----------------------------------------------------------------------
+
+    def addJobs(self, jobs):
+        """
+        queues a list of jobs to be sent.
+        Never blocks on the monitor.
+        """
+        if not jobs:
+            return
+        self.lock.acquire()
+        try:
+            self.jobs.extend(jobs)
+            self.metrics['jobs_added'] += len(jobs)
+            self._trim()
+            full = len(self.jobs) >= self.batchsize
+        finally:
+            self.lock.release()
+        if full:
+            self.flushevent.set()
+
+
+    def setLabel(self, label, msg):
+        """
+        queues the status message of a label.
+        Replaces any previous message for that label still pending.
+        """
+        self.lock.acquire()
+        try:
+            if label in self.labels:
+                self.metrics['labels_coalesced'] += 1
+            self.labels[label] = msg
+            self.metrics['labels_added'] += 1
+        finally:
+            self.lock.release()
+
+
+    def getMetrics(self):
+        """
+        returns a copy of the counters,
+        plus the number of messages currently waiting.
+        """
+        self.lock.acquire()
+        try:
+            metrics = dict(self.metrics)
+            metrics['jobs_pending'] = len(self.jobs)
+            metrics['labels_pending'] = len(self.labels)
+        finally:
+            self.lock.release()
+        return metrics
+
+
+    def flush(self):
+        """
+        sends everything pending.
+        Messages that could not be delivered are queued again.
+        """
+        start = time.time()
+        self.lock.acquire()
+        try:
+            jobs = list(self.jobs)
+            self.jobs.clear()
+            labels = self.labels
+            self.labels = {}
+            self.lastflush = start
+            self.metrics['flushes'] += 1
+        finally:
+            self.lock.release()
+
+        failedjobs = []
+        for i in range(0, len(jobs), self.batchsize):
+            batch = jobs[i : i + self.batchsize]
+            if failedjobs or not self._send(self.sender.sendJobs, batch):
+                # keep the order: nothing newer is sent after a failure
+                failedjobs.extend(batch)
+            else:
+                self.metrics['jobs_sent'] += len(batch)
+
+        failedlabels = {}
+        for label, msg in labels.items():
+            if self._send(self.sender.sendLabel, label, msg):
+                self.metrics['labels_sent'] += 1
+            else:
+                failedlabels[label] = msg
+
+        self._requeue(failedjobs, failedlabels)
+        self.metrics['last_flush_duration'] = time.time() - start
+        self.log.debug('flush done. Metrics: %s' %self.getMetrics())
+
+
+    # ----------------------------------------------------------------------
+    #  thread
+    # ----------------------------------------------------------------------
+
+    def _prerun(self):
+        self._readspool()
+
+
+    def _check_for_actions(self):
+        if self.flushevent.isSet():
+            return True
+        if time.time() - self.lastflush >= self.interval:
+            return True
+        return False
+
+
+    def _run(self):
+        self.flushevent.clear()
+        if self.jobs or self.labels:
+            self.flush()
+        else:
+            self.lastflush = time.time()
+
+
+    def _wait_for_abort(self):
+        # wakes up as soon as a batch is complete
+        self.flushevent.wait(self._thread_abort_interval)
+
+
+    def _join(self):
+        self.flushevent.set()
+
+
+    def _postrun(self):
+        """
+        last attempt to deliver everything,
+        and spool whatever is left.
+        """
+        try:
+            self.flush()
+        except Exception as ex:
+            self.log.error('final flush failed: %s' %ex)
+            self.log.debug(traceback.format_exc(None))
+        self._writespool()
+
+
+    # ----------------------------------------------------------------------
+    #  internals
+    # ----------------------------------------------------------------------
+
+    def _send(self, method, *k):
+        try:
+            ok = method(*k)
+        except Exception as ex:
+            self.log.warning('exception sending messages to monitor: %s' %ex)
+            self.log.debug(traceback.format_exc(None))
+            ok = False
+        if not ok:
+            self.metrics['requests_failed'] += 1
+        return ok
+
+
+    def _requeue(self, jobs, labels):
+        """
+        puts back undelivered messages, ahead of the ones added meanwhile.
+        Newer label messages take precedence over the undelivered ones.
+        """
+        if not jobs and not labels:
+            return
+        self.lock.acquire()
+        try:
+            self.jobs.extendleft(reversed(jobs))
+            self._trim()
+            for label, msg in labels.items():
+                if label not in self.labels:
+                    self.labels[label] = msg
+        finally:
+            self.lock.release()
+
+
+    def _trim(self):
+        """
+        drops the oldest jobs above maxsize.
+        Must be called with self.lock acquired.
+        """
+        ndropped = len(self.jobs) - self.maxsize
+        if ndropped > 0:
+            for i in range(ndropped):
+                self.jobs.popleft()
+            self.metrics['jobs_dropped'] += ndropped
+            self.log.warning('outbound queue is full, dropped %d oldest jobs' %ndropped)
+
+
+    def _readspool(self):
+        if not self.spoolfile or not os.path.isfile(self.spoolfile):
+            return
+        try:
+            f = open(self.spoolfile)
+            try:
+                spool = json.load(f)
+            finally:
+                f.close()
+            os.remove(self.spoolfile)
+            self.lock.acquire()
+            try:
+                self.jobs.extend(spool.get('jobs', []))
+                self._trim()
+                self.labels.update(spool.get('labels', {}))
+            finally:
+                self.lock.release()
+            self.log.info('recovered %d jobs and %d labels from spool file %s' %(len(self.jobs), len(self.labels), self.spoolfile))
+        except Exception as ex:
+            self.log.error('unable to read spool file %s: %s' %(self.spoolfile, ex))
+
+
+    def _writespool(self):
+        if not self.spoolfile:
+            return
+        self.lock.acquire()
+        try:
+            spool = {'jobs': list(self.jobs), 'labels': self.labels}
+        finally:
+            self.lock.release()
+        if not spool['jobs'] and not spool['labels']:
+            return
+        try:
+            spooldir = os.path.dirname(self.spoolfile)
+            if spooldir and not os.path.isdir(spooldir):
+                os.makedirs(spooldir)
+            tmpfile = self.spoolfile + '.tmp'
+            f = open(tmpfile, 'w')
+            try:
+                json.dump(spool, f)
+            finally:
+                f.close()
+            os.rename(tmpfile, self.spoolfile)
+            self.log.info('saved %d jobs and %d labels in spool file %s' %(len(spool['jobs']), len(spool['labels']), self.spoolfile))
+        except Exception as ex:
+            self.log.error('unable to write spool file %s: %s' %(self.spoolfile, ex))
@@ -0,0 +1,248 @@
+#! /usr/bin/env python
+
+"""
+    Factory-wide budget of pilots, shared by the APFQueues.
+
+    The budget is maxperfactory.maximum minus the pilots already
+    pending or running in all schedds, as in the StatusCache,
+    and minus the pilots granted after the snapshot
+    that should show them was collected: they may not be counted yet.
+    It is handed out in rounds. A round starts at the first request
+    after any batchstatus plugin has published a new snapshot:
+    the budget is divided with weighted water-filling (max-min fairness)
+    among the last number of pilots requested by each APFQueue,
+    first within each WMS queue, if it has its own maximum,
+    and then among all APFQueues.
+
+    Until the next round, each APFQueue gets at most its grant,
+    plus what is left of the budget not granted to anybody.
+    So the APFQueues together never submit more pilots than the budget,
+    no matter in which order their cycles run.
+"""
+
+import logging
+import threading
+import time
+
+from autopyfactory.statuscache import StatusCache
+
+
+def waterfill(demands, capacity, weights=None):
+    """
+    weighted max-min fair division of an integer capacity.
+    Every key gets min(demand, level * weight), with the highest
+    level the capacity allows. Units left by the rounding go to
+    the keys with the largest fractional parts.
+    :param dict demands: number requested, per key
+    :param int capacity: number to divide. None means no limit
+    :param dict weights: weight per key. Defaults to 1
+    :return dict: number allocated, per key
+    """
+    if weights is None:
+        weights = {}
+    alloc = dict([(k, 0) for k in demands])
+    if capacity is None:
+        alloc.update(demands)
+        return alloc
+
+    active = [k for k in demands if demands[k] > 0 and weights.get(k, 1) > 0]
+    # the keys with smaller demand per weight are satisfied first
+    active.sort(key=lambda k: (float(demands[k]) / weights.get(k, 1), k))
+    remaining = max(0, capacity)
+    totalweight = float(sum([weights.get(k, 1) for k in active]))
+    for i, k in enumerate(active):
+        if demands[k] * totalweight <= remaining * weights.get(k, 1):
+            alloc[k] = demands[k]
+            remaining -= demands[k]
+            totalweight -= weights.get(k, 1)
+            continue
+        # the rest can not be satisfied. Same level for all of them
+        rest = active[i:]
+        shares = [(remaining * weights.get(j, 1) / totalweight, j) for j in rest]
+        for (share, j) in shares:
+            alloc[j] = int(share)
+        left = remaining - sum([alloc[j] for j in rest])
+        shares.sort(key=lambda x: x[0] - int(x[0]), reverse=True)
+        for (share, j) in shares[:left]:
+            alloc[j] += 1
+        break
+    return alloc
+
+
+class Demand(object):
+    __slots__ = ['n', 'weight', 'wmsqueue', 'wmsmax', 'time']
+
+    def __init__(self, n, weight, wmsqueue, wmsmax, t):
+        self.n = n
+        self.weight = weight
+        self.wmsqueue = wmsqueue
+        self.wmsmax = wmsmax
+        self.time = t
+
+
+class PilotBudget(object):
+    """
+    -----------------------------------------------------------------------
+    Central allocator of the pilots allowed per Factory.
+    -----------------------------------------------------------------------
+    Public Interface:
+            grant(apfqname, n, weight=1, wmsqueue=None, wmsmax=None)
+            allocate()
+            maximum
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, factory):
+        self.log = logging.getLogger('autopyfactory.pilotbudget')
+        self.lock = threading.Lock()
+        self.statuscache = StatusCache()
+        self.maximum = factory.fcl.generic_get('Factory', 'maxperfactory.maximum', 'getint')
+        # requests not renewed for longer than this are ignored
+        self.maxage = factory.fcl.generic_get('Factory', 'maxperfactory.request.maxage', 'getint', default_value=1800)
+
+        self.demands = {}       # last Demand per APFQueue
+        self.grants = {}        # pilots still granted per APFQueue in this round
+        self.spare = 0          # budget not granted to any APFQueue
+        self.wmsspare = {}      # same, per WMS queue with a maximum
+        self.generation = None  # of the StatusCache in the last round
+        self.handedout = []     # (time, apfqname, wmsqueue, n) not yet seen in a snapshot
+        self.log.debug('PilotBudget initialized with maximum=%s' %self.maximum)
+
+
+    def grant(self, apfqname, n, weight=1, wmsqueue=None, wmsmax=None):
+        """
+        records the request of an APFQueue for the next rounds,
+        and returns how many pilots it can submit now.
+        :param int n: number of pilots the APFQueue wants
+        :param float weight: share of the APFQueue, relative to the others
+        :param string wmsqueue: WMS queue of the APFQueue
+        :param int wmsmax: maximum pending+running pilots for the WMS queue
+        :return int: between 0 and n. None if there is no status info yet.
+                     n if it is not positive: nothing to share then, 
+                     and other plugins may use negative numbers 
+                     to retire pilots
+        """
+        self.lock.acquire()
+        try:
+            self.demands[apfqname] = Demand(max(0, n), weight, wmsqueue, wmsmax, time.time())
+            if self.generation != self.statuscache.generation:
+                self._allocate()
+            if n <= 0:
+                return n
+            if self.generation is None:
+                return None
+
+            # first its own grant, then the spare budget
+            granted = self.grants.get(apfqname, 0)
+            out = min(n, granted + self._spare(wmsqueue))
+            fromspare = max(0, out - granted)
+            self.grants[apfqname] = granted - (out - fromspare)
+            if self.spare is not None:
+                self.spare -= fromspare
+            if self.wmsspare.get(wmsqueue) is not None:
+                self.wmsspare[wmsqueue] -= fromspare
+            if out > 0:
+                self.handedout.append((time.time(), apfqname, wmsqueue, out))
+            return out
+        finally:
+            self.lock.release()
+
+
+    def allocate(self):
+        """
+        starts a new round
+        """
+        self.lock.acquire()
+        try:
+            self._allocate()
+        finally:
+            self.lock.release()
+
+
+    def _spare(self, wmsqueue):
+        spare = self.spare
+        wmsspare = self.wmsspare.get(wmsqueue)
+        if spare is None:
+            return wmsspare if wmsspare is not None else float('inf')
+        if wmsspare is None:
+            return spare
+        return min(spare, wmsspare)
+
+
+    def _unobserved(self):
+        """
+        pilots handed out after the snapshot that should count them
+        was collected: the one of the schedd where the APFQueue has pilots,
+        or the oldest one if it has none yet.
+        Must be called with self.lock acquired.
+        :return list: tuples (time, apfqname, wmsqueue, n)
+        """
+        snapshot_l = self.statuscache.snapshots.values()
+        oldest = min([snapshot.timestamp for snapshot in snapshot_l])
+        handedout = []
+        for (t, apfqname, wmsqueue, n) in self.handedout:
+            timestamp_l = [snapshot.timestamp for snapshot in snapshot_l if apfqname in snapshot.queues]
+            if timestamp_l:
+                collected = min(timestamp_l)
+            else:
+                collected = oldest
+            if t >= collected:
+                handedout.append((t, apfqname, wmsqueue, n))
+        self.handedout = handedout
+        return handedout
+
+
+    def _allocate(self):
+        """
+        Must be called with self.lock acquired.
+        """
+        generation = self.statuscache.generation
+        if not self.statuscache.snapshots:
+            self.log.debug('no batch status info yet')
+            return
+        now = time.time()
+        for apfqname in [k for (k, d) in self.demands.items() if now - d.time > self.maxage]:
+            del self.demands[apfqname]
+
+        # pilots already in the batch system, or about to be
+        unobserved = self._unobserved()
+        budget = None
+        if self.maximum is not None:
+            total = self.statuscache.total()
+            budget = max(0, self.maximum - (total.pending + total.running) - sum([x[3] for x in unobserved]))
+
+        # first, within each WMS queue with a maximum
+        bywmsqueue = {}
+        for apfqname, demand in self.demands.items():
+            bywmsqueue.setdefault(demand.wmsqueue, []).append(apfqname)
+        capped = {}
+        wmsbudget = {}
+        for wmsqueue, apfqname_l in bywmsqueue.items():
+            wmsmax_l = [self.demands[k].wmsmax for k in apfqname_l if self.demands[k].wmsmax is not None]
+            if wmsqueue is None or not wmsmax_l:
+                for apfqname in apfqname_l:
+                    capped[apfqname] = self.demands[apfqname].n
+                continue
+            counts_l = [snapshot.wmsqueues[wmsqueue] for snapshot in self.statuscache.snapshots.values()]
+            current = sum([counts.pending + counts.running for counts in counts_l])
+            current += sum([x[3] for x in unobserved if x[2] == wmsqueue])
+            wmsbudget[wmsqueue] = max(0, min(wmsmax_l) - current)
+            capped.update(waterfill(dict([(k, self.demands[k].n) for k in apfqname_l]),
+                                    wmsbudget[wmsqueue],
+                                    dict([(k, self.demands[k].weight) for k in apfqname_l])))
+
+        # then, among all APFQueues
+        self.grants = waterfill(capped, budget, dict([(k, d.weight) for (k, d) in self.demands.items()]))
+        granted = sum(self.grants.values())
+        self.spare = None
+        if budget is not None:
+            self.spare = budget - granted
+        self.wmsspare = {}
+        for wmsqueue in wmsbudget:
+            self.wmsspare[wmsqueue] = wmsbudget[wmsqueue] - sum([self.grants[k] for k in bywmsqueue[wmsqueue]])
+        self.generation = generation
+        self.log.info('new round: budget=%s, unobserved=%s, requested=%s, granted=%s to %d queues' %(budget,
+                                                                                                   sum([x[3] for x in unobserved]),
+                                                                                                   sum([d.n for d in self.demands.values()]),
+                                                                                                   granted,
+                                                                                                   len(self.grants)))
@@ -0,0 +1,224 @@
+#! /usr/bin/env python
+
+"""
+    Process-wide sliding-window counts of finished pilots,
+    per APF queue (MATCH_APF_QUEUE):
+
+        PilotHistogram
+            watch(apfqname, window, maxtime)
+            feed(scheddid, classad_l)  <-  batchstatus condor_history sweeps
+            get(apfqname)              ->  (total, short) or None
+
+    Only the queues being watched are counted.
+    Pilots are placed in time buckets by JobStartDate.
+    Each queue keeps the running sums over its window,
+    and the buckets leaving the window are subtracted,
+    so a lookup does not depend on the number of pilots.
+    The window is rounded to whole buckets.
+"""
+
+import logging
+import threading
+import time
+
+
+class _bucket(object):
+    __slots__ = ['total', 'short', 'keys']
+
+    def __init__(self):
+        self.total = 0
+        self.short = 0
+        self.keys = []
+
+
+class _queuehistogram(object):
+    """
+    -----------------------------------------------------------------------
+    Counts of pilots for a single queue.
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, window, maxtime, width):
+        """
+        :param int window: seconds of JobStartDate observed
+        :param int maxtime: pilots with a shorter RemoteWallClockTime are short
+        :param int width: seconds per bucket
+        """
+        self.window = window
+        self.maxtime = maxtime
+        self.width = width
+        self.buckets = {}
+        self.seen = {}
+        self.total = 0
+        self.short = 0
+        self.oldest = None
+
+
+    def add(self, key, starttime, wallclock, now):
+        """
+        counts a pilot, once per key.
+        Pilots started before the window are ignored.
+        """
+        if key in self.seen:
+            return
+        self.expire(now)
+        index = int(starttime) // self.width
+        if index < self._cutoff(now):
+            return
+        bucket = self.buckets.get(index, None)
+        if bucket is None:
+            bucket = self.buckets[index] = _bucket()
+            if self.oldest is None or index < self.oldest:
+                self.oldest = index
+        bucket.total += 1
+        self.total += 1
+        if wallclock < self.maxtime:
+            bucket.short += 1
+            self.short += 1
+        bucket.keys.append(key)
+        self.seen[key] = index
+
+
+    def expire(self, now):
+        """
+        subtracts the buckets that left the window
+        """
+        if self.oldest is None:
+            return
+        cutoff = self._cutoff(now)
+        if self.oldest >= cutoff:
+            return
+        if cutoff - self.oldest > len(self.buckets):
+            expired = [index for index in self.buckets if index < cutoff]
+        else:
+            expired = range(self.oldest, cutoff)
+        for index in expired:
+            bucket = self.buckets.pop(index, None)
+            if bucket is not None:
+                self.total -= bucket.total
+                self.short -= bucket.short
+                for key in bucket.keys:
+                    del self.seen[key]
+        if self.buckets:
+            self.oldest = cutoff
+        else:
+            self.oldest = None
+
+
+    def _cutoff(self, now):
+        return (int(now) - self.window) // self.width + 1
+
+
+class PilotHistogram(object):
+    """
+    -----------------------------------------------------------------------
+    Counts of total and short pilots per APF queue.
+    There is only one per process. It is fed by the batchstatus plugins,
+    and read by the Throttle sched plugins.
+    -----------------------------------------------------------------------
+    Public Interface:
+            watch(apfqname, window, maxtime)
+            needsreplay(scheddid)
+            feed(scheddid, classad_l, replay=False)
+            get(apfqname)
+    -----------------------------------------------------------------------
+    """
+
+    instance = None
+
+    def __new__(cls, *k, **kw):
+        if PilotHistogram.instance is None:
+            PilotHistogram.instance = object.__new__(cls)
+            PilotHistogram.instance._inithistogram(*k, **kw)
+        return PilotHistogram.instance
+
+    def _inithistogram(self, width=60):
+        """
+        :param int width: seconds per bucket
+        """
+        self.log = logging.getLogger('autopyfactory.pilothistogram')
+        self.lock = threading.Lock()
+        self.width = width
+        self.queues = {}
+        # schedds that have fed all their history
+        # since the last change in the watched queues
+        self.replayed = set()
+
+
+    def watch(self, apfqname, window, maxtime):
+        """
+        starts counting the pilots of a queue.
+        Nothing changes if it is already watched with the same parameters.
+        Otherwise, its counts are rebuilt from the history
+        kept by the batchstatus plugins at their next sweep.
+        :param int window: seconds of JobStartDate observed
+        :param int maxtime: pilots with a shorter RemoteWallClockTime are short
+        """
+        self.lock.acquire()
+        try:
+            histogram = self.queues.get(apfqname, None)
+            if histogram is not None and histogram.window == window and histogram.maxtime == maxtime:
+                return
+            self.queues[apfqname] = _queuehistogram(window, maxtime, self.width)
+            self.replayed = set()
+        finally:
+            self.lock.release()
+        self.log.info('watching queue %s with window=%s, maxtime=%s' %(apfqname, window, maxtime))
+
+
+    def needsreplay(self, scheddid):
+        """
+        True if the schedd has to feed all its history,
+        and not only the new records, to the next feed()
+        """
+        return scheddid not in self.replayed
+
+
+    def feed(self, scheddid, classad_l, replay=False):
+        """
+        counts the pilots in a list of condor_history records.
+        Records already counted are ignored,
+        so the same record can be fed more than once.
+        :param string scheddid: the schedd the records come from
+        :param list classad_l: dictionaries with match_apf_queue, clusterid,
+                               procid, jobstartdate, remotewallclocktime
+        :param bool replay: True if classad_l is all the history of the schedd
+        """
+        now = int(time.time())
+        n = 0
+        self.lock.acquire()
+        try:
+            for ca in classad_l:
+                histogram = self.queues.get(ca.get('match_apf_queue'), None)
+                if histogram is None:
+                    continue
+                try:
+                    starttime = int(ca['jobstartdate'])
+                    wallclock = float(ca.get('remotewallclocktime', 0))
+                except (KeyError, TypeError, ValueError):
+                    # the pilot never started
+                    continue
+                key = '%s:%s.%s' %(scheddid, ca.get('clusterid'), ca.get('procid'))
+                histogram.add(key, starttime, wallclock, now)
+                n += 1
+            if replay:
+                self.replayed.add(scheddid)
+        finally:
+            self.lock.release()
+        self.log.debug('fed %d records from schedd %s, replay=%s' %(n, scheddid, replay))
+
+
+    def get(self, apfqname):
+        """
+        :return tuple: (total, short) pilots started within the window,
+                       or None if the queue is not watched
+        """
+        self.lock.acquire()
+        try:
+            histogram = self.queues.get(apfqname, None)
+            if histogram is None:
+                return None
+            histogram.expire(time.time())
+            return (histogram.total, histogram.short)
+        finally:
+            self.lock.release()
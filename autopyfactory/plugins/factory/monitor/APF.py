@@ -8,13 +8,15 @@
 
 import commands
 import logging
+import os
 import re
 import threading
 import StringIO
 import urllib
-import urllib2
 
+from autopyfactory.httpclient import HTTPClient
 from autopyfactory.interfaces import MonitorInterface
+from autopyfactory.monitorpublisher import MonitorPublisher
 
 try:
     import json as json
@@ -31,38 +33,6 @@ except ImportError as err:
 #  ==================================================
 
 
-class NoExceptionHTTPHandler(urllib2.BaseHandler):
-    """
-    A substitute/supplement to urllib2.HTTPErrorProcessor
-    that doesn't raise exceptions on status codes 201,204,206
-    For example, when a registration operation (via HTTP PUT command)
-    is successful, a code 201 CREATED is returned. 
-    urllib2 interprets that as an ERROR, and raises an exception. 
-    To avoid it we override the behavior of http_err_<RC> methods.
-    """
-
-    def http_error_201(self, request, response, code, msg, hdrs):
-        return response
-    def http_error_204(self, request, response, code, msg, hdrs):
-        return response
-    def http_error_206(self, request, response, code, msg, hdrs):
-        return response
-
-
-class RequestWithMethod(urllib2.Request):
-    """
-    To be used insted of urllib2.Request
-    This class gets the HTTP method (i.e. 'PUT') during the initlization
-    """
-
-    def __init__(self, method, *args, **kwargs):
-        self._method = method
-        urllib2.Request.__init__(self, *args, **kwargs)
-
-    def get_method(self):
-        return self._method
-
-
 #  ==================================================
 # This class is just to make the name of the HTTP
 # methods ("POST", "GET", etc) to look like macros
@@ -100,6 +70,27 @@ class _apf(MonitorInterface):
 
         self.monurl = self.mcl.generic_get(monitor_id, 'monitorURL')
 
+        # persistent connections, shared by all monitor plugins
+        self.httpclient = HTTPClient('monitor',
+                                     maxconnections=self.fcl.generic_get('Factory', 'monitor.http.maxconnections', 'getint', default_value=4),
+                                     timeout=self.fcl.generic_get('Factory', 'monitor.http.timeout', 'getint', default_value=30),
+                                     retries=self.fcl.generic_get('Factory', 'monitor.http.retries', 'getint', default_value=3),
+                                     backoff=self.fcl.generic_get('Factory', 'monitor.http.backoff', 'getint', default_value=1))
+
+        # messages are delivered asynchronously, in batches
+        spoolfile = None
+        spooldir = self.fcl.generic_get('Factory', 'monitor.publish.spooldir', default_value=None)
+        if spooldir:
+            # the queue monitor of the same section has its own spool file
+            spoolfile = os.path.join(spooldir, '%s.factory.json' %monitor_id)
+        self.publisher = MonitorPublisher('%s.factory' %monitor_id,
+                                          self,
+                                          apfqueue.factory.threadsregistry,
+                                          interval=self.fcl.generic_get('Factory', 'monitor.publish.interval', 'getint', default_value=30),
+                                          batchsize=self.fcl.generic_get('Factory', 'monitor.publish.batchsize', 'getint', default_value=500),
+                                          maxsize=self.fcl.generic_get('Factory', 'monitor.publish.maxsize', 'getint', default_value=10000),
+                                          spoolfile=spoolfile)
+
         self.log.debug('Instantiated monitor')
         try:
             self.registerFactory()     
@@ -110,6 +101,7 @@ class _apf(MonitorInterface):
         except:
             self.log.error("Exception during monitor label processing. Continuing...")
         
+        self.publisher.start()
         self.log.debug('Done.')
 
 
@@ -294,7 +286,7 @@ class _apf(MonitorInterface):
             out = None
         else:
             self.log.info('label %s is not registered yet. Registering.' %label)
-            out = self._registerLabel(apfqueue)
+            out = self._registerLabel(label)
 
         self.log.debug('Leaving')
         return out
@@ -304,11 +296,9 @@ class _apf(MonitorInterface):
         return label in self.registeredlabels
 
 
-    def _registerLabel(self, apfqueue):
+    def _registerLabel(self, labelname):
         """
-        We pass apfqueue as input because this class is a singleton,
-        so the apfqueue object passed by __init__() may not be the same 
-        apfqueue object calling this method. 
+        Label is the name of the section in queues.conf
         """
 
         self.log.debug('Starting')
@@ -318,7 +308,7 @@ class _apf(MonitorInterface):
         data = [] 
 
         label = {}
-        label['name'] = apfqueue.apfqname
+        label['name'] = labelname
         label['factory'] = self.fid
         label['wmsqueue'] = '' 
         label['batchqueue'] = ''
@@ -330,7 +320,7 @@ class _apf(MonitorInterface):
 
         out = self._call(http.PUT, url, data)
 
-        self.registeredlabels.append(apfqueue.apfqname)
+        self.registeredlabels.append(labelname)
 
         self.log.debug('Leaving')
         return out
@@ -346,18 +336,14 @@ class _apf(MonitorInterface):
 
         jobinfolist is the output of submit() method.
         It is a list of JobInfo objects
+
+        Messages are only queued here. 
+        They are sent, in batches, by the MonitorPublisher thread.
         """
 
         self.log.debug('Starting for apfqueue %s with info list %s' %(apfqueue.apfqname, 
                                                                      jobinfolist))
 
-        url = self.monurl + '/jobs'
-
-        # jobs can not be registered unless the label is already registered
-        self.registerLabel(apfqueue)
-        
-        out = None
-
         if jobinfolist:
         # ensure jobinfolist has any content, and is not None
             apfqname = apfqueue.apfqname
@@ -376,26 +362,66 @@ class _apf(MonitorInterface):
 
                 self.log.debug('updateJobs: adding data (%s, %s, %s)' %(ji.jobid, self.fid, apfqname))
 
-            data = json.dumps(data) 
-            out = self._call(http.PUT, url, data=data)
+            self.publisher.addJobs(data)
 
         self.log.debug('Leaving.')
-        return out
 
 
     def updateLabel(self, label, msg):
         """
-        update each label (==apfqname) in the monitor
+        update each label (==apfqname) in the monitor.
+
+        The message is only queued here. 
+        If a previous message for the same label has not been sent yet,
+        it is replaced by this one. 
         """
 
         self.log.debug('Starting for label %s and message %s' %(label, msg))
+        self.publisher.setLabel(label, msg)
+        self.log.debug('Leaving')
+
+
+    def sendJobs(self, jobs):
+        """
+        called by the MonitorPublisher thread
+        to register a batch of jobs, from any label.
+        Returns True on success.
+        """
+
+        self.log.debug('Starting with %d jobs' %len(jobs))
+
+        # jobs can not be registered unless the label is already registered
+        for labelname in set([job['label'] for job in jobs]):
+            if not self._isLabelRegistered(labelname):
+                self._registerLabel(labelname)
+
+        url = self.monurl + '/jobs'
+        data = json.dumps(jobs) 
+        out = self._call(http.PUT, url, data=data)
+
+        self.log.debug('Leaving.')
+        return out is not None
+
+
+    def sendLabel(self, label, msg):
+        """
+        called by the MonitorPublisher thread
+        to update the status of a label.
+        Returns True on success.
+        """
+
+        self.log.debug('Starting for label %s and message %s' %(label, msg))
+
+        if not self._isLabelRegistered(label):
+            self._registerLabel(label)
 
         url = "%s/labels/%s:%s" %(self.monurl, self.fid, label)
         data = {'status': msg}
         data = urllib.urlencode(data)
-        self._call(http.POST, url, data=data) 
+        out = self._call(http.POST, url, data=data) 
 
         self.log.debug('Leaving')
+        return out is not None
 
 
     def _call(self, method, url, data=None):
@@ -406,14 +432,11 @@ class _apf(MonitorInterface):
 
         self.log.debug('Starting. method=%s, url=%s, data=%s' %(method, url, data))
 
-        opener = urllib2.build_opener(NoExceptionHTTPHandler) 
-        if data:
-            request = RequestWithMethod(method, url, data)
-        else:
-            request = RequestWithMethod(method, url)
-
         try:
-            out = opener.open(request)
+            out = self.httpclient.request(method, url, data)
+            if out.status >= 400:
+                self.log.debug('HTTP call failed with status %s %s' %(out.status, out.reason))
+                out = None
         except Exception as e:
             self.log.debug('HTTP call failed with error %s' % e)
             out = None  # Is this OK?
@@ -25,10 +25,15 @@ prepath = sep.join(fullpathlist[:-5])
 sys.path.insert(0, prepath)
 #print ("\nsys.path = %s " % sys.path )
 
-from libfactory.info import StatusInfo, IndexByKey, IndexByKeyRemap, Count
-from libfactory.info import DataItem as Job
 from libfactory.htcondorlib import HTCondorCollector, HTCondorSchedd
-from autopyfactory.interfaces import BatchStatusInterface, _thread
+from autopyfactory.adaptiveinterval import AdaptiveInterval
+from autopyfactory.aggregation import StatusAggregator
+from autopyfactory.condorhistory import CondorHistory
+from autopyfactory.interfaces import BatchStatusInterface, _thread, _publisher
+from autopyfactory.statuscache import StatusCache, StatusSnapshot
+from autopyfactory.jobsnapshot import JobSnapshot
+from autopyfactory.mappings import MappingsRegistry
+from autopyfactory.pilothistogram import PilotHistogram
 import autopyfactory.utils as utils
 
 # used for testing/simulation   
@@ -37,54 +42,7 @@ from autopyfactory.factory import Factory
 from autopyfactory.configloader import Config
 from autopyfactory.threadsmanagement import ThreadsRegistry
 
-class CondorJobInfo(object):
-    """
-    This object represents a Condor job.     
-        
-    """
-    jobattrs = ['match_apf_queue',
-                'clusterid',
-                'procid',
-                'qdate', 
-                'ec2instancename',
-                'ec2instancetype',
-                'enteredcurrentstatus',
-                'jobstatus',
-                'ec2remotevirtualmachinename',
-                'ec2securitygroups',
-                'ec2spotprice',
-                'gridjobstatus',
-                 ]  
-
-
-    def __init__(self, dict):
-        """
-        Creates CondorJobInfo object from arbitrary dictionary of attributes. 
-        
-        """
-        self.log = logging.getLogger('autopyfactory.batchstatus')
-        self.jobattrs = []
-        for k in dict.keys():
-            self.__setattr__(k,dict[k])
-            self.jobattrs.append(k)
-        self.jobattrs.sort()
-        #self.log.debug("Made CondorJobInfo object with %d attributes" % len(self.jobattrs))    
-        
-    def __str__(self):
-        s = "CondorJobInfo: %s.%s " % (self.clusterid, 
-                                      self.procid)
-        #for k in CondorJobInfo.jobattrs:
-        #    s += " %s=%s " % ( k, self.__getattribute__(k))
-        for k, v in self.__dict__.items():
-            s += " %s=%s " % ( k, v)
-        return s
-    
-    def __repr__(self):
-        s = str(self)
-        return s
-
-
-class _condor(_thread, BatchStatusInterface):
+class _condor(_thread, _publisher, BatchStatusInterface):
     """
     -----------------------------------------------------------------------
     This class is expected to have separate instances for each object. 
@@ -96,6 +54,7 @@ class _condor(_thread, BatchStatusInterface):
     """
     def __init__(self, apfqueue, config, section):
         _thread.__init__(self)
+        _publisher._initpublisher(self)
         apfqueue.factory.threadsregistry.add("plugin", self)      
         self.log = logging.getLogger('autopyfactory.batchstatus.%s' %apfqueue.apfqname)
         self.log.debug('BatchStatusPlugin: Initializing object...')
@@ -106,8 +65,16 @@ class _condor(_thread, BatchStatusInterface):
         try:
             self.condoruser = apfqueue.fcl.get('Factory', 'factoryUser')
             self.factoryid = apfqueue.fcl.get('Factory', 'factoryId')
-            self.maxage = apfqueue.fcl.generic_get('Factory', 'batchstatus.condor.maxage', default_value=360) 
+            self.maxage = apfqueue.fcl.generic_get('Factory', 'batchstatus.condor.maxage', 'getint', default_value=360) 
+            # info older than maxage is still served, while refreshing it,
+            # until it is older than the hard maxage
+            self.hardmaxage = max(self.maxage, apfqueue.fcl.generic_get('Factory', 'batchstatus.condor.maxage.hard', 'getint', default_value=self.maxage))
             self.sleeptime = self.apfqueue.fcl.getint('Factory', 'batchstatus.condor.sleep')
+            # bounds for the adaptive interval between queries
+            self.sleepmin = self.apfqueue.fcl.generic_get('Factory', 'batchstatus.condor.sleep.min', 'getint', default_value=self.sleeptime)
+            self.sleepmax = self.apfqueue.fcl.generic_get('Factory', 'batchstatus.condor.sleep.max', 'getint', default_value=self.sleeptime)
+            # how long finished jobs are kept from the condor_history sweeps
+            self.historywindow = self.apfqueue.fcl.generic_get('Factory', 'batchstatus.condor.history.window', 'getint', default_value=86400)
             ###self.queryargs = self.apfqueue.qcl.generic_get(self.apfqname, 'batchstatus.condor.queryargs') 
             self.scheddhost = self.apfqueue.qcl.generic_get(self.apfqname, 'batchstatus.condor.scheddhost', default_value='localhost')
             self.scheddport = self.apfqueue.qcl.generic_get(self.apfqname, 'batchstatus.condor.scheddport', default_value=9618 )
@@ -135,19 +102,47 @@ class _condor(_thread, BatchStatusInterface):
             self.condoruser = 'apf'
             self.factoryid = 'test-local'
             self.sleeptime = 10
+            self.sleepmin = 10
+            self.sleepmax = 10
+            self.historywindow = 86400
             self.log.warning("Got AttributeError during init. We should be running stand-alone for testing.")
 
+        # same ID used by the Condor() wrapper
+        self.scheddid = '%s:%s:%s:%s' %(getattr(self, 'scheddhost', 'localhost'),
+                                        getattr(self, 'scheddport', 9618),
+                                        getattr(self, 'collectorhost', 'localhost'),
+                                        getattr(self, 'collectorport', 9618))
+        self.statuscache = StatusCache()
+        self.pilothistogram = PilotHistogram()
+
         self._thread_loop_interval = self.sleeptime
-        self.currentnewinfo = None
+        self.pollinterval = AdaptiveInterval('batchstatus.condor', self.sleeptime, self.sleepmin, self.sleepmax)
+        self.lastupdate = None
         self.processednewinfo_d = None
+        self.snapshot = None
         self.jobinfo = None              
-        self.last_timestamp = 0
 
         # mappings
-        self.jobstatus2info = self.apfqueue.factory.mappingscl.section2dict('CONDORBATCHSTATUS-JOBSTATUS2INFO')
-        self.log.info('jobstatus2info mappings are %s' %self.jobstatus2info)
+        self.jobstatus2info = None
+        self.aggregator = None
+        self._updatemappings()
 
         # query attributes
+        # classads kept for each job in the JobSnapshot
+        self.jobinfo_attribute_l = ['match_apf_queue',
+                                    'clusterid',
+                                    'procid',
+                                    'qdate', 
+                                    'ec2instancename',
+                                    'ec2instancetype',
+                                    'enteredcurrentstatus',
+                                    'jobstatus',
+                                    'ec2remotevirtualmachinename',
+                                    'ec2securitygroups',
+                                    'ec2spotprice',
+                                    'gridjobstatus',
+                                    ]
+
         self.condor_q_attribute_l = ['match_apf_queue', 
                                      'jobstatus'
                                     ]
@@ -155,9 +150,19 @@ class _condor(_thread, BatchStatusInterface):
                                           'jobstatus', 
                                           'enteredcurrentstatus', 
                                           'remotewallclocktime',
-                                          'qdate'
+                                          'qdate',
+                                          'clusterid',
+                                          'procid',
+                                          'completiondate',
+                                          'jobstartdate'
                                           ]
 
+        # output of the last sweep
+        self.condor_q_classad_l = None
+        self.querytime = None   # when the last condor_q was done
+        self.condor_history_classad_l = []
+        # finished jobs, accumulated from the incremental condor_history queries
+        self.history = CondorHistory(self.historywindow)
 
         self.rawdata = None
 
@@ -193,20 +198,49 @@ class _condor(_thread, BatchStatusInterface):
         else:
             if queue:
                 self.log.debug('Current info is %s' % self.jobinfo)                    
-                self.log.debug('Leaving and returning info of %d entries.' % len(self.jobinfo))
+                self.log.debug('Leaving and returning info of %d entries.' % self.jobinfo.njobs(queue))
+                # a new list of JobRow views, callers can sort it or pop from it
                 return self.jobinfo[queue]
             else:
                 self.log.debug('Current info is %s' % self.jobinfo)
-                self.log.debug('No queue given, returning entire BatchStatusInfo object')
+                self.log.debug('No queue given, returning entire JobSnapshot object')
                 return self.jobinfo
 
     
     def _updatelib(self):
         self.Lock.acquire()
-        self._updatejobinfo()
-        self._updatenewinfo()
-        self.last_timestamp = time.time()
-        self.Lock.release()
+        try:
+            if not self._sweep():
+                # keep the previous snapshot, with its timestamp,
+                # so maxage and hard maxage still apply
+                return
+            self._updatejobinfo()
+            self._updatenewinfo()
+        finally:
+            self.Lock.release()
+        # signal the APFQueues waiting for new info
+        self._publish()
+        self._adaptinterval()
+
+
+    def _adaptinterval(self):
+        """
+        recalculates the time until the next query.
+        A queue is starved when it has just run out of pending pilots.
+        """
+        if self.snapshot is None:
+            return
+        counts = {}
+        for apfqname, statecounts in self.snapshot.queues.items():
+            for state, n in statecounts.getraw().items():
+                counts[(apfqname, state)] = n
+        previous = self.pollinterval.counts or {}
+        starved = False
+        for (apfqname, state), n in previous.items():
+            if state == 'pending' and n > 0 and counts.get((apfqname, state), 0) == 0:
+                starved = True
+                break
+        self._thread_loop_interval = self.pollinterval.update(counts, starved)
 
 
     def getInfo(self, queue=None):
@@ -214,31 +248,68 @@ class _condor(_thread, BatchStatusInterface):
         Returns a  object populated by the analysis 
         over the output of a condor_q command
 
-        If the info recorded is older than that maxage,
-        None is returned, as we understand that info is too old and 
-        not reliable anymore.
+        If the info recorded is older than maxage, it is still returned 
+        while a new query is done. 
+        If it is older than the hard maxage, None is returned, 
+        as we understand that info is too old and not reliable anymore.
+        Callers can check the age with getSnapshotAge().
+
+        If queue is not given, a read-only view of the entire info is returned.
         """           
         self.log.debug('Starting with self.maxage=%s' % self.maxage)
         
-        #if self.currentnewinfo is None:
-        if self.processednewinfo_d is None:
+        snapshot = self._getsnapshot()
+        if snapshot is None:
+            return None
+
+        if queue:
+            if queue not in snapshot.queues:
+                self.log.warning('there is no info available for queue %s. Returning an empty info object' %queue)
+            return snapshot.queues[queue]
+        else:
+            return snapshot.queues
+
+
+    def getTotalInfo(self):
+        """
+        Returns the number of jobs per state added over all queues,
+        precomputed once per snapshot.
+        """
+        snapshot = self._getsnapshot()
+        if snapshot is None:
+            return None
+        return snapshot.total
+
+
+    def getWMSQueueInfo(self, wmsqueue=None):
+        """
+        Returns the number of jobs per state added over the queues 
+        serving each WMS queue, precomputed once per snapshot.
+        """
+        snapshot = self._getsnapshot()
+        if snapshot is None:
+            return None
+        if wmsqueue:
+            return snapshot.wmsqueues[wmsqueue]
+        else:
+            return snapshot.wmsqueues
+
+
+    def _getsnapshot(self):
+        """
+        returns the current StatusSnapshot,
+        or None if there is none yet, or if it is too old.
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
             self.log.debug('Not initialized yet. Returning None.')
             return None
 
-        if self.maxage > 0 and\
-           (int(time.time()) - self.currentnewinfo.timestamp) > self.maxage:
+        if not self._servable(snapshot.timestamp, self.maxage, self.hardmaxage):
             self.log.debug('Info too old. Leaving and returning None.')
             return None
+        return snapshot
 
-        if queue:
-            try:
-                return self.processednewinfo_d[queue]
-            except Exception:
-                self.log.warning('there is no info available for queue %s. Returning an empty info object' %queue)
-                return Job()
-        else:
-            return self.processednewinfo_d
-      
 
     def getRawInfo(self):
         """
@@ -248,85 +319,125 @@ class _condor(_thread, BatchStatusInterface):
         return self.rawdata
 
     
-    def _updatenewinfo(self):
+    def _sweep(self):
         """
-        Query Condor for job status, and populate  object.
+        Query Condor once per cycle:
+            - a single condor_q with the attributes needed
+              both by getInfo() and getJobInfo()
+            - a condor_history only for the jobs that finished 
+              since the previous sweep
         It uses the condor python bindings.
+        :return bool: False if any of the queries failed
         """
         self.log.debug('Starting.')
+        querytime = int(time.time())
         try:
-            self.condor_q_classad_l = self.schedd.condor_q(self.condor_q_attribute_l)
-            self.log.debug('output of condor_q: %s' %self.condor_q_classad_l)
+            condor_q_classad_l = self.schedd.condor_q(self._q_attributes())
+            self.log.debug('output of condor_q: %s' %condor_q_classad_l)
+            self._updatehistory()
+        except Exception as e:
+            self.log.error("Exception: %s" % str(e))
+            self.log.debug("Exception: %s" % traceback.format_exc())
+            return False
+        self.condor_q_classad_l = condor_q_classad_l
+        self.querytime = querytime
+        self.log.debug('Leaving.')
+        return True
 
-            self.condor_history_classad_l = self.schedd.condor_history(self.condor_history_attribute_l)
-            self.log.debug('output of condor_history: %s' %self.condor_history_classad_l)
 
-            self.rawdata = self.condor_q_classad_l + self.condor_history_classad_l
+    def _q_attributes(self):
+        """
+        list of classads for the merged condor_q query
+        """
+        attribute_l = list(self.jobinfo_attribute_l)
+        for attr in self.condor_q_attribute_l:
+            if attr not in attribute_l:
+                attribute_l.append(attr)
+        return attribute_l
+
+
+    def _updatehistory(self):
+        """
+        incremental condor_history.
+        Only the jobs that finished since the previous sweep are requested.
+        """
+        classad_l = self.history.update(self.schedd, self.condor_history_attribute_l)
+
+        # the new records also feed the pilots counts for the Throttle plugins
+        if self.pilothistogram.needsreplay(self.scheddid):
+            self.pilothistogram.feed(self.scheddid, self.history.records(), replay=True)
+        else:
+            self.pilothistogram.feed(self.scheddid, classad_l)
+
+        self.history.trim()
+        self.condor_history_classad_l = self.history.records()
 
-            self.currentnewinfo = StatusInfo(self.rawdata)
-            # --- process the status info 
-            self.processednewinfo_d = self.__process(self.currentnewinfo)
 
-            #self.currentnewinfo = rawdata
-            #self.last_timestamp = time.time()
+    def _updatenewinfo(self):
+        """
+        populate the aggregated info object 
+        with the output of the last sweep.
+        """
+        self.log.debug('Starting.')
+        if self.condor_q_classad_l is None:
+            self.log.debug('No sweep done yet. Leaving.')
+            return
+        try:
+            self._updatemappings()
+            self.rawdata = self.condor_q_classad_l + self.condor_history_classad_l
+            # --- count jobs per queue and per state
+            self.processednewinfo_d = self.aggregator.aggregate(self.rawdata)
+            self.log.debug('processed information = %s' %self.processednewinfo_d)
+            self.snapshot = StatusSnapshot(self.processednewinfo_d, self._wmsqueues(), self.snapshotversion + 1, self.querytime)
+            self.statuscache.put(self.scheddid, self.snapshot)
+            self.lastupdate = int(time.time())
             self.cache = {}
 
         except Exception as e:
             self.log.error("Exception: %s" % str(e))
             self.log.debug("Exception: %s" % traceback.format_exc())
         self.log.debug('Leaving.')
-    ### END TEST ###
 
-    
-    ### BEGIN TEST ###
-    #
-    # FIXME
-    #
-    #   for the time being, all hardcoded in a single method
-    #
-    def __process(self, info):
-
-
-        indexbyqueue = IndexByKey('match_apf_queue')
-        indexbystatus = IndexByKeyRemap ('jobstatus', self.jobstatus2info)
-        count = Count()
-
-        info = info.indexby(indexbyqueue)
-        info = info.indexby(indexbystatus)
-        info = info.process(count)
-
-        # convert info into a dictionary of objects Jobs
-        # this is just temporary
-        raw = info.getraw()
-        jobs_d = {}
-        for q, data in raw.items():
-            job = Job( raw[q] )
-            jobs_d[q] = job
-        self.log.debug('returning processed information = %s' %jobs_d)    
-        return jobs_d
-    ### END TEST ###
+
+    def _updatemappings(self):
+        """
+        gets the mappings from the Factory registry.
+        The aggregator is only rebuilt when they have been reloaded.
+        """
+        jobstatus2info = self.apfqueue.factory.mappings.get('CONDORBATCHSTATUS-JOBSTATUS2INFO')
+        if jobstatus2info is not self.jobstatus2info:
+            self.log.info('jobstatus2info mappings are %s' %jobstatus2info)
+            self.jobstatus2info = jobstatus2info
+            self.aggregator = StatusAggregator(jobstatus2info)
+
+
+    def _wmsqueues(self):
+        """
+        WMS queue for each APF queue in the factory configuration
+        """
+        wmsqueue_d = {}
+        qcl = getattr(self.apfqueue.factory, 'qcl', None)
+        if qcl is None:
+            return wmsqueue_d
+        for section in qcl.sections():
+            wmsqueue = qcl.generic_get(section, 'wmsqueue')
+            if wmsqueue:
+                wmsqueue_d[section] = wmsqueue
+        return wmsqueue_d
+
 
     def _updatejobinfo(self):
         '''
-        Query Condor for job list.
-        Return dictionary indexed by queuename, with value a List of CondorJobInfo objects. 
+        Build the job list from the output of the last sweep.
+        The result is a JobSnapshot, indexed by queuename, 
+        which returns a list of JobRow views for each queue.
         '''
         self.log.debug('Starting.')
-        ### BEGIN TEST ###
-        #classadlist = condor_q(CondorJobInfo.jobattrs)
-        classadlist = self.schedd.condor_q(CondorJobInfo.jobattrs)
-        ### END  TEST ###
-        newjobinfo = {}
-
-        for ca in classadlist:
-            if 'match_apf_queue' in ca.keys(): 
-                ji = CondorJobInfo(ca)            
-                try:
-                    ql = newjobinfo[ji.match_apf_queue]
-                    ql.append(ji)
-                except KeyError:
-                    newjobinfo[ji.match_apf_queue] = [ ji]
-        self.log.debug("Created jobinfo list of %s items" % len(newjobinfo))
+        if self.condor_q_classad_l is None:
+            self.log.debug('No sweep done yet. Leaving.')
+            return
+        newjobinfo = JobSnapshot(self.condor_q_classad_l, self.jobinfo_attribute_l)
+        self.log.debug("Created jobinfo snapshot for %s queues" % len(newjobinfo))
         self.log.info("Replacing old info with newly generated info.")
         self.jobinfo = newjobinfo
         self.log.debug('Leaving.')
@@ -500,6 +611,8 @@ class MockFactory(object):
     def __init__(self):
         self.threadsregistry = ThreadsRegistry()
         self.mappingscl = getMockMappingsConfig()
+        self.mappings = MappingsRegistry()
+        self.mappings.update(self.mappingscl)
         self.fcl = getMockFactoryConfig()
         
 # Factory.getFactoryMock(fcl, am)
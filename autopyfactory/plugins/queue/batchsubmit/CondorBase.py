@@ -9,11 +9,13 @@ import logging
 import os
 import re
 import string
+import threading
 import time
 import traceback
 
 
 from autopyfactory import jsd
+from autopyfactory import submitcoordinator
 from libfactory.htcondorlib import HTCondorSchedd, condor_version, condor_config_files, JobSubmissionDescription
 from autopyfactory.interfaces import BatchSubmitInterface
 import autopyfactory.utils as utils
@@ -90,12 +92,30 @@ class CondorBase(BatchSubmitInterface):
             self.baselogdir = os.path.expanduser(self.fcl.generic_get('Factory', 'baseLogDir')) 
             self.baselogdirurl = self.fcl.generic_get('Factory', 'baseLogDirUrl') 
             self.factoryjobid = '$ENV(HOSTNAME)#$(Cluster).$(Process)'
+            # write a copy of each submit file on disk, for debugging only
+            self.writejsd = qcl.generic_get(self.apfqname, 'batchsubmit.condorbase.writejsd', 'getboolean', default_value=False)
+
+            # submit template, compiled at the first submission
+            self.template = None
+            self.logdirs = set()     # log directories already created
 
-           
             ###condor.checkCondor()
             self.log.debug('condor version = %s' %condor_version())
+            # submit descriptions can be passed from memory
+            self.submitfrommemory = self._submitsfrommemory()
             self.log.debug('condor config file = %s ' %condor_config_files())
 
+            # submissions from all queues to the (local) schedd 
+            # are gathered into bulk transactions.
+            # It uses the python bindings, as libfactory does for condor >= 8.7
+            self.submitcoordinator = None
+            if submitcoordinator.htcondor is not None and self.submitfrommemory and\
+               self.fcl.generic_get('Factory', 'batchsubmit.bulk.enabled', 'getboolean', default_value=True):
+                self.submitcoordinator = submitcoordinator.SubmitCoordinator('local', 
+                                                                             window=self.fcl.generic_get('Factory', 'batchsubmit.bulk.window', 'getfloat', default_value=2.0),
+                                                                             idle=self.fcl.generic_get('Factory', 'batchsubmit.bulk.idle', 'getfloat', default_value=0.2),
+                                                                             timeout=self.fcl.generic_get('Factory', 'batchsubmit.bulk.timeout', 'getint', default_value=120))
+
 
             self.log.info(': Object properly initialized.')
         except Exception as e:
@@ -120,23 +140,19 @@ class CondorBase(BatchSubmitInterface):
         try:
             if n > 0:
                 self._calculateDateDir()
-                self.JSD = jsd.JSDFile()
-                self._addJSD()
-                self._custom_attrs()
-                self._finishJSD(n)
-                jsdfile = self._writeJSD()
-                if jsdfile:
-                    _jsd = JobSubmissionDescription()
-                    _jsd.loadf(jsdfile)
-                    clusterid = self.schedd.condor_submit(_jsd, n)
+                if self._makeLogDir():
+                    jsdtext = self._renderJSD(n)
+                    clusterid = self._submitJSD(jsdtext, n)
                     joblist = []
                     now = datetime.datetime.utcnow()
                     for i in range(n):
                         jobid = '%s.%s' %(clusterid, i)
                         joblist.append( JobInfo(jobid, 'submitted', now) ) 
+                    if self.writejsd:
+                        self._writeJSDCopy(jsdtext)
 
                 else:
-                    self.log.debug('jsdfile has no value. Doing nothing')
+                    self.log.debug('log directory could not be created. Doing nothing')
             elif n < 0:
                 # For certain plugins, this means to retire or terminate nodes...
                 self.log.debug('Preparing to retire/kill %s jobs' % abs(n))
@@ -177,6 +193,9 @@ class CondorBase(BatchSubmitInterface):
                         killlist.append( "%s.%s" % (j.clusterid, j.procid))
                     except IndexError:
                         self.log.warning("Tried to pop jobinfo from an empty list.")
+                if not killlist:
+                    self.log.debug("No jobs to kill for apfqueue %s" % self.apfqname)
+                    return
                 self.log.debug("About to kill list of %s ids. First one is %s" % (len(killlist), killlist[0] ))
                 ### BEGIN TEST ###
                 #from autopyfactory.condorlib import condor_rm
@@ -368,6 +387,136 @@ class CondorBase(BatchSubmitInterface):
 
 
 
+    def _compileJSD(self):
+        """
+        renders, only once, the parts of the submit description 
+        that do not change from one cycle to another:
+        everything but the log directory, the log URL, and the 'queue' line.
+        Those are left as placeholders.
+        """
+        self.log.debug('compileJSD: Starting.')
+        logDir, logUrl = self.logDir, self.logUrl
+        self.logDir, self.logUrl = jsd.JSDTemplate.LOGDIR_TOKEN, jsd.JSDTemplate.LOGURL_TOKEN
+        try:
+            self.JSD = jsd.JSDFile()
+            self._addJSD()
+            self._custom_attrs()
+            self.template = jsd.JSDTemplate(self.JSD)
+        finally:
+            self.logDir, self.logUrl = logDir, logUrl
+        self.log.debug('compileJSD: the submit template is\n %s ' %self.template.text)
+        self.log.debug('compileJSD: Leaving.')
+
+
+    def _renderJSD(self, n=None):
+        """
+        returns the submit description for n pilots,
+        as a string, from the precompiled template.
+        If n is None, there is no 'queue' line.
+        """
+        if self.template is None:
+            self._compileJSD()
+        return self.template.render(self.logDir, self.logUrl, n)
+
+
+    def _submitJSD(self, jsdtext, n):
+        """
+        submits n pilots, in a bulk transaction together with other queues
+        when possible, or on its own otherwise.
+        Returns the cluster ID.
+        """
+        if self.submitcoordinator is not None:
+            try:
+                return self.submitcoordinator.submit(self.apfqname, self._renderJSD(), n)
+            except Exception as e:
+                # transactions are atomic, nothing was submitted.
+                # Or the batch did not leave in time, without these pilots
+                self.log.warning('bulk submission failed (%s). Submitting on its own.' %e)
+        _jsd = self._loadJSD(jsdtext)
+        return self.schedd.condor_submit(_jsd, n)
+
+
+    def _loadJSD(self, jsdtext):
+        """
+        creates the JobSubmissionDescription object for the schedd
+        directly from memory. 
+        Versions of libfactory without loads(), and condor < 8.7,
+        where the schedd runs condor_submit on the file the description
+        was loaded from, still need the content to be read from a file.
+        """
+        _jsd = JobSubmissionDescription()
+        if self.submitfrommemory and hasattr(_jsd, 'loads'):
+            _jsd.loads(jsdtext)
+        else:
+            self.log.debug('Reading the submit description from file.')
+            jsdfile = self._dumpJSD(jsdtext)
+            _jsd.loadf(jsdfile)
+        return _jsd
+
+
+    def _submitsfrommemory(self):
+        """
+        True if the schedd submits with the python bindings,
+        which is the case for condor >= 8.7.
+        """
+        try:
+            # like '$CondorVersion: 8.6.12 Jul 31 2018 BuildID: 446077 $'
+            version = condor_version().split()[1]
+            version = tuple([int(x) for x in version.split('.')[:2]])
+        except Exception as e:
+            self.log.warning('unable to parse condor version (%s). Submitting from file.' %e)
+            return False
+        return version >= (8, 7)
+
+
+    def _makeLogDir(self):
+        """
+        condor needs the log directory to exist before submission.
+        Directories already created are remembered, 
+        so the filesystem is only checked once per day.
+        """
+        if self.logDir in self.logdirs:
+            return True
+        if not os.access(self.logDir, os.F_OK):
+            try:
+                os.makedirs(self.logDir)
+                self.log.debug('Created directory %s', self.logDir)
+            except OSError as err:
+                self.log.error('Failed to create directory %s (error %d): %s', self.logDir, err.errno, err)
+                return False
+        self.logdirs.add(self.logDir)
+        return True
+
+
+    def _dumpJSD(self, jsdtext):
+        """
+        writes the submit description in the log directory.
+        Returns the path to the file.
+        """
+        jsdfilename = os.path.join(self.logDir, 'submit.jdl')
+        jsdfile = open(jsdfilename, 'w')
+        try:
+            jsdfile.write(jsdtext)
+        finally:
+            jsdfile.close()
+        return jsdfilename
+
+
+    def _writeJSDCopy(self, jsdtext):
+        """
+        writes a copy of the submit description, for debugging, 
+        in a separate thread so submission does not wait for the disk.
+        """
+        def _write():
+            try:
+                self._dumpJSD(jsdtext)
+            except Exception as e:
+                self.log.warning('unable to write copy of submit file: %s' %e)
+        t = threading.Thread(target=_write, name='writejsd-%s' %self.apfqname)
+        t.daemon = True
+        t.start()
+
+
     def _writeJSD(self):
         """
         Dumps the whole content of the JSDFile object into a disk file
@@ -2,6 +2,7 @@
 #
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.schedpipeline import SchedStep
 import logging
 
 
@@ -23,6 +24,9 @@ class Fixed(SchedInterface):
             self.log.error("SchedPlugin object initialization failed. Raising exception")
             raise ex
 
+    def compile(self):
+        return SchedStep('fixed', pilotspercycle=self.pilotspercycle)
+
     def calcSubmitNum(self, n=0):
         """ 
         returns always a fixed number of pilots
@@ -43,7 +43,7 @@ class KeepNRunning(SchedInterface):
         if not self.queueinfo:
             self.log.warning("self.queueinfo is None!")
             out = 0
-            msg = "KeepNRunning:comment=Invalid queueinfo"
+            msg = ('KeepNRunning', (('comment', 'Invalid queueinfo'),))
         else:
             (out, msg) = self._calc(n)
             self.log.debug("Returning %d" % out)
@@ -81,13 +81,12 @@ class KeepNRunning(SchedInterface):
             self.log.debug("keep_running is set %d, use it." % self.keep_running) 
             out = self.keep_running - ( running_pilots  + pending_pilots)
 
-        msg = "KeepNRunning:in=%s,keep=%s,running=%s,pending=%s,retiring=%s,ret=%s" % (str(input), 
-                                                                           self.keep_running, 
-                                                                           running_pilots, 
-                                                                           pending_pilots, 
-                                                                           retiring_pilots, 
-                                                                           out)
-        self.log.info(msg)
+        msg = ('KeepNRunning', (('in', input),
+                                ('keep', self.keep_running),
+                                ('running', running_pilots),
+                                ('pending', pending_pilots),
+                                ('retiring', retiring_pilots),
+                                ('ret', out)))
         return (out, msg)
 
 
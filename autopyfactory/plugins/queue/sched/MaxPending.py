@@ -2,6 +2,7 @@
 #
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.schedpipeline import SchedStep
 import logging
 
 
@@ -21,6 +22,9 @@ class MaxPending(SchedInterface):
             self.log.error("SchedPlugin: object initialization failed. Raising exception")
             raise ex
 
+    def compile(self):
+        return SchedStep('maxpending', maximum=self.max_pilots_pending, allow_negative=self.allow_negative)
+
     def calcSubmitNum(self, n=0):
         self.log.debug('Starting with n=%s' %n)
         queueinfo = self.apfqueue.batchstatus_plugin.getInfo(queue = self.apfqueue.apfqname)
@@ -49,5 +53,5 @@ class MaxPending(SchedInterface):
                                                              pending_pilots, 
                                                              self.max_pilots_pending, 
                                                              out)
-        self.log.info(msg)
+        self.log.debug(msg)
         return (out, msg)
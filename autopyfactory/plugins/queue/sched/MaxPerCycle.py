@@ -2,6 +2,7 @@
 #
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.schedpipeline import SchedStep
 import logging
 
 
@@ -19,6 +20,9 @@ class MaxPerCycle(SchedInterface):
             self.log.error("SchedPlugin object initialization failed. Raising exception")
             raise ex
 
+    def compile(self):
+        return SchedStep('maxpercycle', maximum=self.max_pilots_per_cycle)
+
     def calcSubmitNum(self, n=0):
         self.log.debug('Starting with n=%s' %n)
 
@@ -32,5 +36,5 @@ class MaxPerCycle(SchedInterface):
                                          self.max_pilots_per_cycle, 
                                          out)
                 
-        self.log.info(msg)
+        self.log.debug(msg)
         return (out, msg)
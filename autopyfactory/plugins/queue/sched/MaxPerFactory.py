@@ -17,6 +17,12 @@ class MaxPerFactory(SchedInterface):
             self.log = logging.getLogger('autopyfactory.sched.%s' %apfqueue.apfqname)
 
             self.max_pilots_per_factory = self.apfqueue.fcl.generic_get('Factory', 'maxperfactory.maximum', 'getint')
+            # share of this queue, relative to the other queues, when the budget is not enough for all
+            self.weight = self.apfqueue.qcl.generic_get(self.apfqueue.apfqname, 'sched.maxperfactory.weight', 'getfloat', default_value=1.0)
+            # maximum pending+running pilots for all queues serving the same wmsqueue
+            self.max_pilots_per_wmsqueue = self.apfqueue.qcl.generic_get(self.apfqueue.apfqname, 'sched.maxperfactory.wmsqueue.maximum', 'getint')
+            # the budget is shared by all queues
+            self.budget = self.apfqueue.factory.pilotbudget
 
             self.log.debug("SchedPlugin: Object initialized.")
         except Exception as ex:
@@ -25,28 +31,20 @@ class MaxPerFactory(SchedInterface):
 
     def calcSubmitNum(self, n=0):
         """ 
+        returns the part of the factory-wide budget granted to this queue
         """
 
         self.log.debug('Starting.')
-        self.batchinfo = self.apfqueue.batchstatus_plugin.getInfo()
-        self.total_pilots = 0 
-        for batchqueue in self.batchinfo.keys():  
-            self.total_pilots += self.batchinfo[batchqueue].running
-            self.total_pilots += self.batchinfo[batchqueue].pending
-        self.log.debug('the total number of current pending+running pilots being handled by the factory is %s' %self.total_pilots)
-
-        out = n
-
-        if self.total_pilots > self.max_pilots_per_factory:
+        out = self.budget.grant(self.apfqueue.apfqname, 
+                                n, 
+                                self.weight, 
+                                self.apfqueue.wmsqueue, 
+                                self.max_pilots_per_wmsqueue)
+        if out is None:
+            self.log.warning("there is no batch status info yet!")
             out = 0
-        elif n + self.total_pilots > self.max_pilots_per_factory:
-            out = self.max_pilots_per_factory - self.total_pilots
-
-        # Catch all to prevent negative numbers
-        #if n < 0:
-        #    self.log.info('calculated output was negative. Returning 0')
-        #    out = 0
+            msg = ('MaxPerFactory', (('comment', 'No batchinfo'), ('in', n)))
+            return (out, msg)
 
-        msg = 'MaxPerFactory:in=%s,total=%s,maxperfactory=%s,ret=%s' %(n, self.total_pilots, self.max_pilots_per_factory, out)
-        self.log.info(msg)
+        msg = ('MaxPerFactory', (('in', n), ('maxperfactory', self.max_pilots_per_factory), ('weight', self.weight), ('ret', out)))
         return (out, msg)
@@ -2,6 +2,7 @@
 #
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.schedpipeline import SchedStep
 import logging
 
 
@@ -19,6 +20,9 @@ class MaxToRun(SchedInterface):
             self.log.error("SchedPlugin object initialization failed. Raising exception")
             raise ex
 
+    def compile(self):
+        return SchedStep('maxtorun', maximum=self.max_to_run)
+
     def calcSubmitNum(self, n=0):
         self.log.debug('Starting with n=%s' %n)
 
@@ -41,5 +45,5 @@ class MaxToRun(SchedInterface):
                                                             pending_pilots, 
                                                             running_pilots, 
                                                             out)
-        self.log.info(msg)    
+        self.log.debug(msg)    
         return (out, msg) 
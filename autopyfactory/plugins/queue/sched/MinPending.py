@@ -30,9 +30,8 @@ class MinPending(SchedInterface):
         pending_pilots = self.queueinfo.pending
         if self.min_pilots_pending is not None:
             out = max(n, self.min_pilots_pending - pending_pilots)     
-            msg = "MinPending:in=%s,minpending=%s,pending=%s,ret=%s" %(n, self.min_pilots_pending, pending_pilots, out)
+            msg = ('MinPending', (('in', n), ('minpending', self.min_pilots_pending), ('pending', pending_pilots), ('ret', out)))
         else:
-            msg = "MinPending:comment=not set,in=%s,pending=%s,ret=%s" %(n, pending_pilots, out) 
+            msg = ('MinPending', (('comment', 'not set'), ('in', n), ('pending', pending_pilots), ('ret', out)))
            
-        self.log.info(msg)
         return (out, msg) 
@@ -2,6 +2,7 @@
 #
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.schedpipeline import SchedStep
 import logging
 
 
@@ -19,6 +20,9 @@ class MinPerCycle(SchedInterface):
             self.log.error("SchedPlugin object initialization failed. Raising exception")
             raise ex
 
+    def compile(self):
+        return SchedStep('minpercycle', minimum=self.min_pilots_per_cycle)
+
     def calcSubmitNum(self, n=0):
 
         self.log.debug('Starting with n=%s' %n)
@@ -31,5 +35,5 @@ class MinPerCycle(SchedInterface):
             msg = "MinPerCycle:in=%s,minpercycle=%s,ret=%s" %(n, self.min_pilots_per_cycle, out)
 
                
-        self.log.info(msg)
+        self.log.debug(msg)
         return (out, msg)
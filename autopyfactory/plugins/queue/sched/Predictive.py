@@ -0,0 +1,268 @@
+#! /usr/bin/env python
+#
+# Submits for the number of activated jobs expected
+# when the new pilots start running, instead of the current one.
+#
+#   - the activated jobs of each wmsqueue are smoothed with
+#     double exponential smoothing (level and trend),
+#     updated once per new jobs snapshot of the wmsstatus plugin,
+#     timed by the snapshot itself, 
+#     and shared by all APF queues serving the same wmsqueue
+#     with the same smoothing factors.
+#   - for each APF queue, the pilot start latency (QDate to start running)
+#     and the drain rate (pilots leaving the running state per second)
+#     are smoothed too, once per new batchstatus snapshot,
+#     timed by the snapshot itself,
+#     from the JobSnapshot of the batchstatus plugin.
+#     When no pilot started, the latency is estimated as pending/drain rate.
+#
+#   nsub = (level + trend * latency) - offset - pending
+#
+
+import logging
+import math
+import threading
+import time
+
+from autopyfactory.interfaces import SchedInterface
+
+
+class ActivatedHistory(object):
+    """
+    -----------------------------------------------------------------------
+    Smoothed number of activated jobs of a wmsqueue, and its trend,
+    in jobs per second.
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, alpha, beta):
+        self.alpha = alpha
+        self.beta = beta
+        self.level = None
+        self.trend = 0.0
+        self.last = None
+
+    def update(self, activated, now):
+        """
+        :param int activated: activated jobs in a new snapshot
+        :param int now: time of the snapshot
+        """
+        if self.level is None:
+            self.level = float(activated)
+        else:
+            dt = max(1.0, float(now - self.last))
+            forecast = self.level + self.trend * dt
+            level = self.alpha * activated + (1 - self.alpha) * forecast
+            self.trend = self.beta * (level - self.level) / dt + (1 - self.beta) * self.trend
+            self.level = level
+        self.last = now
+
+    def project(self, seconds):
+        """
+        activated jobs expected in some seconds from now
+        """
+        if self.level is None:
+            return 0.0
+        return max(0.0, self.level + self.trend * seconds)
+
+
+class PilotHistory(object):
+    """
+    -----------------------------------------------------------------------
+    Smoothed start latency, in seconds,
+    and drain rate, in pilots per second, of an APF queue.
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, gamma, latency, maxlatency):
+        self.gamma = gamma
+        self.latency = float(latency)
+        self.maxlatency = maxlatency
+        self.drain = None
+        self.running = None
+        self.last = None
+
+    def update(self, pending, running, latency_l, now):
+        """
+        :param int pending: pilots pending in a new snapshot
+        :param int running: pilots running in a new snapshot
+        :param list latency_l: latencies of the pilots started since the previous snapshot
+        :param int now: time of the snapshot
+        """
+        if self.last is not None:
+            dt = max(1.0, float(now - self.last))
+            drained = max(0, self.running + len(latency_l) - running)
+            self.drain = self._smooth(self.drain, drained / dt)
+        if latency_l:
+            self.latency = self._smooth(self.latency, float(sum(latency_l)) / len(latency_l))
+        elif pending > 0 and self.drain:
+            # no pilot started: pending pilots wait for the running ones to leave
+            self.latency = self._smooth(self.latency, pending / self.drain)
+        self.latency = min(self.latency, self.maxlatency)
+        self.running = running
+        self.last = now
+
+    def _smooth(self, old, sample):
+        if old is None:
+            return sample
+        return self.gamma * sample + (1 - self.gamma) * old
+
+
+class Predictive(SchedInterface):
+    id = 'predictive'
+
+    # ActivatedHistory per (wmsqueue, alpha, beta), shared by all APF queues
+    activatedhistories = {}
+    lock = threading.Lock()
+
+    def __init__(self, apfqueue, config, section):
+
+        try:
+            self.apfqueue = apfqueue
+            self.apfqname = apfqueue.apfqname
+            self.log = logging.getLogger('autopyfactory.sched.%s' %apfqueue.apfqname)
+            qcl = self.apfqueue.qcl
+            # smoothing factors for the level and the trend of activated jobs
+            self.alpha = qcl.generic_get(self.apfqname, 'sched.predictive.alpha', 'getfloat', default_value=0.3)
+            self.beta = qcl.generic_get(self.apfqname, 'sched.predictive.beta', 'getfloat', default_value=0.1)
+            # smoothing factor for the pilots start latency and drain rate
+            self.gamma = qcl.generic_get(self.apfqname, 'sched.predictive.gamma', 'getfloat', default_value=0.2)
+            # initial, and maximum, pilot start latency, in seconds
+            self.latency = qcl.generic_get(self.apfqname, 'sched.predictive.latency', 'getint', default_value=300)
+            self.maxlatency = qcl.generic_get(self.apfqname, 'sched.predictive.latency.maximum', 'getint', default_value=3600)
+            self.offset = qcl.generic_get(self.apfqname, 'sched.predictive.offset', 'getint', default_value=0)
+
+            Predictive.lock.acquire()
+            try:
+                key = (self.apfqueue.wmsqueue, self.alpha, self.beta)
+                if key not in Predictive.activatedhistories:
+                    Predictive.activatedhistories[key] = ActivatedHistory(self.alpha, self.beta)
+                self.activated = Predictive.activatedhistories[key]
+            finally:
+                Predictive.lock.release()
+            self.pilots = PilotHistory(self.gamma, self.latency, self.maxlatency)
+            self.projected = None
+
+            self.log.debug("SchedPlugin: Object initialized.")
+        except Exception as ex:
+            self.log.error("SchedPlugin object initialization failed. Raising exception")
+            raise ex
+
+
+    def calcSubmitNum(self, n=0):
+        """
+        returns the activated jobs expected when the new pilots start,
+        minus the pilots already pending
+        """
+        self.log.debug('Starting.')
+        wmsqueueinfo = self.apfqueue.wmsstatus_plugin.getInfo(queue = self.apfqueue.wmsqueue)
+        queueinfo = self.apfqueue.batchstatus_plugin.getInfo(queue = self.apfqname)
+
+        if wmsqueueinfo is None or queueinfo is None:
+            self.log.warning("Missing info. wmsinfo is %s batchinfo is %s. Return=0" % (wmsqueueinfo, queueinfo))
+            out = 0
+            msg = ('Predictive', (('comment', 'Invalid wmsinfo or batchinfo'),))
+            return (out, msg)
+
+        now = time.time()
+        self._updateactivated(wmsqueueinfo.ready, now)
+        self._updatepilots(queueinfo, now)
+
+        self.projected = self.activated.project(self.pilots.latency)
+        out = max(0, int(math.ceil(self.projected)) - self.offset - queueinfo.pending)
+
+        # the internal state goes in the record, for tuning
+        msg = ('Predictive', (('in', n),
+                              ('activated', wmsqueueinfo.ready),
+                              ('level', '%.1f' %self.activated.level),
+                              ('trend', '%.4f' %self.activated.trend),
+                              ('latency', '%.0f' %self.pilots.latency),
+                              ('drain', '%.4f' %(self.pilots.drain or 0)),
+                              ('projected', '%.1f' %self.projected),
+                              ('offset', self.offset),
+                              ('pending', queueinfo.pending),
+                              ('ret', out)))
+        return (out, msg)
+
+
+    def _updateactivated(self, activated, now):
+        """
+        once per new jobs snapshot,
+        no matter how many APF queues serve the wmsqueue,
+        or how many other snapshots the wmsstatus plugin publishes
+        """
+        t = self._jobstime()
+        Predictive.lock.acquire()
+        try:
+            if t is None:
+                # no way to tell the snapshots apart
+                t = now
+            elif self.activated.last is not None and t <= self.activated.last:
+                return
+            self.activated.update(activated, t)
+        finally:
+            Predictive.lock.release()
+
+
+    def _jobstime(self):
+        """
+        time of the current jobs snapshot of the wmsstatus plugin.
+        The PanDA plugin also publishes the sites and clouds specs,
+        so its last_timestamp is only used when there is nothing better.
+        """
+        plugin = self.apfqueue.wmsstatus_plugin
+        jobinfo = getattr(plugin, 'currentjobinfo', None)
+        lasttime = getattr(jobinfo, 'lasttime', None)
+        if lasttime:
+            return lasttime
+        return getattr(plugin, 'last_timestamp', None) or None
+
+
+    def _updatepilots(self, queueinfo, now):
+        """
+        once per new batchstatus snapshot.
+        Pilots started after the time the snapshot was collected 
+        are only counted in the next one.
+        """
+        t = self._batchtime()
+        if t is None:
+            t = now
+        elif self.pilots.last is not None and t <= self.pilots.last:
+            return
+        self.pilots.update(queueinfo.pending, queueinfo.running, self._latencies(), t)
+
+
+    def _batchtime(self):
+        """
+        time the current snapshot of the batchstatus plugin was collected
+        """
+        plugin = self.apfqueue.batchstatus_plugin
+        snapshot = getattr(plugin, 'snapshot', None)
+        timestamp = getattr(snapshot, 'timestamp', None)
+        if timestamp:
+            return timestamp
+        return getattr(plugin, 'last_timestamp', None) or None
+
+
+    def _latencies(self):
+        """
+        start latency of the pilots started since the last update,
+        from the JobSnapshot of the batchstatus plugin
+        """
+        if self.pilots.last is None:
+            return []
+        try:
+            jobinfo = self.apfqueue.batchstatus_plugin.getJobInfo()
+        except Exception:
+            jobinfo = None
+        if not jobinfo or not hasattr(jobinfo, 'column'):
+            return []
+        jobstatus = jobinfo.column(self.apfqname, 'jobstatus')
+        entered = jobinfo.column(self.apfqname, 'enteredcurrentstatus')
+        qdate = jobinfo.column(self.apfqname, 'qdate')
+        latency_l = []
+        for i in range(len(jobstatus)):
+            # jobstatus 2 is running
+            if jobstatus[i] == 2 and entered[i] > self.pilots.last:
+                latency_l.append(max(0, entered[i] - qdate[i]))
+        return latency_l
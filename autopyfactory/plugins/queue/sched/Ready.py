@@ -3,6 +3,7 @@
 import logging
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.schedpipeline import SchedStep
 
 
 class Ready(SchedInterface):
@@ -26,6 +27,10 @@ class Ready(SchedInterface):
             raise ex
 
 
+    def compile(self):
+        return SchedStep('ready', offset=self.offset)
+
+
     def calcSubmitNum(self, n=0):
         """ 
         It just returns nb of Activated Jobs - nb of Pending Pilots
@@ -62,5 +67,5 @@ class Ready(SchedInterface):
         out = max(0, ( activated_jobs - self.offset)  - pending_pilots )
 
         msg = "Ready:in=%s,activated=%d,offset=%d,pending=%d,ret=%d" % (input, activated_jobs, self.offset, pending_pilots, out)
-        self.log.info(msg)
+        self.log.debug(msg)
         return (out,msg)
@@ -2,6 +2,7 @@
 #
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.schedpipeline import SchedStep
 import math
 import logging
 
@@ -26,10 +27,13 @@ class Scale(SchedInterface):
             self.log.error("SchedPlugin object initialization failed. Raising exception")
             raise ex
 
+    def compile(self):
+        return SchedStep('scale', factor=self.factor)
+
     def calcSubmitNum(self, n=0):
         self.log.debug('Starting with n=%s' %n)
         out = math.ceil(n * self.factor)
         out = int(out)  #because the output of ceil() is float
         msg = "Scale:in=%s,factor=%s,ret=%s" %(n, self.factor, out )
-        self.log.info(msg)
+        self.log.debug(msg)
         return (out, msg) 
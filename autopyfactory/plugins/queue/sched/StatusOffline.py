@@ -36,7 +36,7 @@ class StatusOffline(SchedInterface):
         if self.wmsqueueinfo is None or self.siteinfo is None or self.batchinfo is None:
             self.log.warning("wmsinfo, siteinfo, or batchinfo is None!")
             out = 0
-            msg = "StatusOffline:comment=no wms/site/batchinfo,in=%s,ret=0" %n
+            msg = ('StatusOffline', (('comment', 'no wms/site/batchinfo'), ('in', n), ('ret', 0)))
         else:
             sitestatus = self.siteinfo.status
             self.log.debug('site status is %s' %sitestatus)
@@ -46,12 +46,11 @@ class StatusOffline(SchedInterface):
 
             # choosing algorithm 
             if sitestatus == 'offline':
-                self.log.info('Return=%s' %self.pilots_in_offline_mode)
+                self.log.debug('Return=%s' %self.pilots_in_offline_mode)
                 out = self.pilots_in_offline_mode
-                msg = "StatusOffline:comment=offline,in=%s,ret=%s" %(n, self.pilots_in_offline_mode)
+                msg = ('StatusOffline', (('comment', 'offline'), ('in', n), ('ret', self.pilots_in_offline_mode)))
             else:
-                msg = "StatusOffline:comment=not offline,in=%s,ret=%s" %(n, out)
-        self.log.info(msg)
+                msg = ('StatusOffline', (('comment', 'not offline'), ('in', n), ('ret', out)))
         return (out, msg) 
             
 
@@ -34,15 +34,15 @@ class StatusTest(SchedInterface):
         if self.wmsqueueinfo is None or self.batchinfo is None or self.siteinfo is None:
             self.log.warning("wmsinfo, batchinfo, or siteinfo is None!")
             out = 0
-            msg = "StatusTest:comment=no wms/batch/siteinfo,in=%s,ret=0" %n
+            msg = ('StatusTest', (('comment', 'no wms/batch/siteinfo'), ('in', n), ('ret', 0)))
         else:
             sitestatus = self.siteinfo.status
             self.log.debug('site status is %s' %sitestatus)
             out = n
             if sitestatus == 'test':
                 out = self.pilots_in_test_mode
-                msg='StatusTest:comment=test,in=%d,out=%d' % ( n,  self.pilots_in_test_mode )
+                msg = ('StatusTest', (('comment', 'test'), ('in', n), ('out', self.pilots_in_test_mode)))
             else:
-                msg='StatusTest:comment=not test,in=%s,ret=%s' % (n, out)
+                msg = ('StatusTest', (('comment', 'not test'), ('in', n), ('ret', out)))
         return (out, msg)
 
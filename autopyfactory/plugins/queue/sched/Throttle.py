@@ -1,10 +1,9 @@
 #! /usr/bin/env python
 
-import datetime
 import logging
-import htcondor
 
 from autopyfactory.interfaces import SchedInterface
+from autopyfactory.pilothistogram import PilotHistogram
 
 
 class Throttle(SchedInterface):
@@ -16,6 +15,10 @@ class Throttle(SchedInterface):
             self.apfqueue = apfqueue                
             self.apfqname = self.apfqueue.apfqname
             self.log = logging.getLogger('autopyfactory.sched.%s' %apfqueue.apfqname)
+            self.interval = 3600
+            self.maxtime = 10
+            self.ratio = 0.5
+            self.submit = 1
             try:
                 # interval is the time windows we observe. Default, last hour
                 # maxtime is the maximum WallTime for a pilot to be declared "too short" 
@@ -31,6 +34,17 @@ class Throttle(SchedInterface):
                 pass 
                 # Not mandatory
                 
+            # the history is rebuilt from the records kept by the batchstatus plugin,
+            # so only that much of the interval can be observed
+            historywindow = self.apfqueue.fcl.generic_get('Factory', 'batchstatus.condor.history.window', 'getint', default_value=86400)
+            if historywindow and self.interval > historywindow:
+                self.log.warning('sched.throttle.interval %s is longer than batchstatus.condor.history.window %s. Using %s' %(self.interval, historywindow, historywindow))
+                self.interval = historywindow
+
+            # the pilots of this queue are counted from now on
+            self.pilothistogram = PilotHistogram()
+            self.pilothistogram.watch(self.apfqname, self.interval, self.maxtime)
+
             self.log.debug("SchedPlugin: Object initialized.")
         except Exception as ex:
             self.log.error("SchedPlugin object initialization failed. Raising exception")
@@ -52,66 +66,32 @@ class Throttle(SchedInterface):
         algorithm 
         """
 
-        # to convert the current date into seconds since Epoch
-        now_sec_epoch = datetime.datetime.now().strftime('%s')
-
-        # condor_history using the python bindings
-        schedd = htcondor.Schedd()
-        #out = schedd.history("RemoteWallClockTime < 600 && MATCH_APF_QUEUE == \"ANALY_BNL_LONG-gridgk03-htcondor\"", ['ClusterId, ProcID'], 0)
-
-        timeinterval = int(now_sec_epoch) - self.interval
-        condor_constraint_expr = "JobStartDate > %s" %timeinterval
-        pilots = schedd.history(condor_constraint_expr, ['RemoteWallClockTime', 'MATCH_APF_QUEUE'], 0)
-
-        # process the output of condor_history 
-        # we need, for each queue (MATCH_APF_QUEUE), the total number of pilots, 
-        # and the number of pilots that finished too fast (RemoteWallClockTime < maxtime)
-
-        try:
-            #n_pilots = sum(1 for p in pilots)
-            pilots_dict = {}
-            for pilot in pilots:
-                q = pilot['MATCH_APF_QUEUE']
-                if q not in pilots_dict.keys():
-                    pilots_dict[q] = {'total':0, 'short':0}
-                pilots_dict[q]['total'] += 1
-                w = pilot['RemoteWallClockTime']
-                if w < self.maxtime:
-                    pilots_dict[q]['short'] += 1
-
-            # now, we have a look to what happened with this queue:
-            if self.apfqname in pilots_dict.keys():
-                total = pilots_dict[self.apfqname]['total']
-                short = pilots_dict[self.apfqname]['short']
-                
-                
-                ratio = float(short)/total
-                if ratio > self.ratio:
-                    self.log.warning('the ratio short pilots over total pilots %s is higher than limit %s. Submitting just %s' %(ratio, self.ratio, self.submit))
-                    out = self.submit
-                else:
-                    out = input
-                
-                self.log.info('input=%s; totalpilots=%s; shortpilots=%s; ratio=%s; submit=%s; Return=%s' %(input,
-                                                                                                 total,
-                                                                                                 short, 
-                                                                                                 self.ratio, 
-                                                                                                 self.submit, 
-                                                                                                 out))
-
-                msg = 'Throttle:in=%s,total=%s,short=%s,ratio=%s,submit=%s,ret=%s' %(input, total, short, self.ratio, self.submit, out)
-            else:
-                self.log.warning('there is no info for queue %s' %self.apfqname)
-                out = input
-                msg = 'Throttle:in=%s,ret=%s' %(input, out)
-
-            return (out,msg)
-
-        except Exception as ex:        
-            # it is possible it fails if condor_history does not work
+        # we need, for this queue (MATCH_APF_QUEUE), the total number of pilots
+        # started within the interval, and the number of pilots that finished 
+        # too fast (RemoteWallClockTime < maxtime).
+        # They are counted by the batchstatus plugin from its condor_history sweeps.
+        counts = self.pilothistogram.get(self.apfqname)
+        if counts is None or counts[0] == 0:
             # for example, in a fresh installation where there is no history yet
-            self.log.warning('An exception was raised: %s' % ex)
+            self.log.warning('there is no info for queue %s' %self.apfqname)
             out = input
-            msg = 'Throttle:in=%s,ret=%s' %(input, out)
-            self.log.info('input=%s; Return=%s' %(input, out))
+            msg = ('Throttle', (('in', input), ('ret', out)))
             return (out,msg)
+
+        (total, short) = counts
+        ratio = float(short)/total
+        if ratio > self.ratio:
+            self.log.warning('the ratio short pilots over total pilots %s is higher than limit %s. Submitting just %s' %(ratio, self.ratio, self.submit))
+            out = self.submit
+        else:
+            out = input
+        
+        self.log.debug('input=%s; totalpilots=%s; shortpilots=%s; ratio=%s; submit=%s; Return=%s' %(input,
+                                                                                         total,
+                                                                                         short, 
+                                                                                         self.ratio, 
+                                                                                         self.submit, 
+                                                                                         out))
+
+        msg = ('Throttle', (('in', input), ('total', total), ('short', short), ('ratio', self.ratio), ('submit', self.submit), ('ret', out)))
+        return (out,msg)
@@ -39,14 +39,14 @@ class WeightedActivated(SchedInterface):
         if self.wmsinfo is None:
             self.log.warning("wsinfo is None!")
             out = self.default
-            msg = "WeightedActivated:comment=no wmsinfo,in=%s,ret=%s" %(n, out)
+            msg = ('WeightedActivated', (('comment', 'no wmsinfo'), ('in', n), ('ret', out)))
         elif self.batchinfo is None:
             self.log.warning("self.batchinfo is None!")
             out = self.default            
-            msg = "WeightedActivated:comment=no batchinfo,in=%,ret=%s" %(n, out)
+            msg = ('WeightedActivated', (('comment', 'no batchinfo'), ('in', n), ('ret', out)))
         elif not self.wmsinfo.valid() and self.batchinfo.valid():
             out = self.default
-            msg = "WeightedActivated:comment=no wms/batchinfo,in=%s,ret=%s" %(n, out)
+            msg = ('WeightedActivated', (('comment', 'no wms/batchinfo'), ('in', n), ('ret', out)))
             self.log.warn('a status is not valid, returning default = %s' %out)
         else:
             # Carefully get wmsinfo, activated. 
@@ -83,6 +83,10 @@ class WeightedActivated(SchedInterface):
         activated_jobs_w = int(activated_jobs * self.activated_w)
         pending_pilots_w = int(pending_pilots * self.pending_w)
         out = max(0, activated_jobs_w - pending_pilots_w)
-        msg = "WeightedActivated:in=%s,activated=%s,weightedactivated=%s,pending=%s,weightedpending=%s,ret=%s" %(n, activated_jobs, activated_jobs_w, pending_pilots, pending_pilots_w, out)
-        self.log.info(msg)
+        msg = ('WeightedActivated', (('in', n),
+                                     ('activated', activated_jobs),
+                                     ('weightedactivated', activated_jobs_w),
+                                     ('pending', pending_pilots),
+                                     ('weightedpending', pending_pilots_w),
+                                     ('ret', out)))
         return (out, msg)
@@ -10,8 +10,9 @@ import threading
 import traceback
 import xml.dom.minidom
 
+from autopyfactory.adaptiveinterval import AdaptiveInterval
 from autopyfactory.info import SiteInfo
-from autopyfactory.interfaces import WMSStatusInterface, _thread
+from autopyfactory.interfaces import WMSStatusInterface, _thread, _publisher
 
 from libfactory.htcondorlib import HTCondorCollector, HTCondorSchedd, condor_version, condor_config_files
 from libfactory.info import StatusInfo, IndexByKey, IndexByKeyRemap, Count, AnalyzerTransform
@@ -33,7 +34,7 @@ class CreateANY(AnalyzerTransform):
         return new_job_l
 
 
-class _condor(_thread, WMSStatusInterface):
+class _condor(_thread, _publisher, WMSStatusInterface):
     """
     -----------------------------------------------------------------------
     This class is expected to have separate instances for each object. 
@@ -46,6 +47,7 @@ class _condor(_thread, WMSStatusInterface):
 
     def __init__(self, apfqueue, config, section):
         _thread.__init__(self) 
+        _publisher._initpublisher(self)
         apfqueue.factory.threadsregistry.add("plugin", self)
         
         self.log = logging.getLogger('autopyfactory.wmsstatus.%s' %apfqueue.apfqname)
@@ -55,6 +57,10 @@ class _condor(_thread, WMSStatusInterface):
         self.apfqname = apfqueue.apfqname
         self.sleeptime = self.apfqueue.fcl.getint('Factory', 'wmsstatus.condor.sleep')
         self._thread_loop_interval = self.sleeptime
+        # the interval between queries adapts to the changes in the jobs
+        self.pollinterval = AdaptiveInterval('wmsstatus.condor', self.sleeptime,
+                                             self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.condor.sleep.min', 'getint', default_value=self.sleeptime),
+                                             self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.condor.sleep.max', 'getint', default_value=self.sleeptime))
         self.maxage = self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.condor.maxage', default_value=360)
         self.scheddhost = self.apfqueue.qcl.generic_get(self.apfqname, 'wmsstatus.condor.scheddhost', default_value='localhost')
         self.scheddport = self.apfqueue.qcl.generic_get(self.apfqname, 'wmsstatus.condor.scheddport', default_value=9618 )
@@ -92,7 +98,7 @@ class _condor(_thread, WMSStatusInterface):
         #                     M A P P I N G S 
         # ================================================================
         
-        self.jobstatus2info = self.apfqueue.factory.mappingscl.section2dict('CONDORWMSSTATUS-JOBSTATUS2INFO')
+        self.jobstatus2info = self.apfqueue.factory.mappings.get('CONDORWMSSTATUS-JOBSTATUS2INFO')
         self.log.info('jobstatus2info mappings are %s' %self.jobstatus2info)
 
         # variable to record when was last time info was updated
@@ -178,11 +184,17 @@ class _condor(_thread, WMSStatusInterface):
         
             self.rawdata = self.condor_q_classad_l
 
+            # the latest mappings from the Factory registry
+            self.jobstatus2info = self.apfqueue.factory.mappings.get('CONDORWMSSTATUS-JOBSTATUS2INFO')
             self.currentnewinfo = StatusInfo(self.rawdata)
 
             # --- process the status info 
             self.processednewinfo_d = self.__process(self.currentnewinfo)
 
+            # signal the APFQueues waiting for new info
+            self._publish()
+            self._adaptinterval()
+
         except Exception as ex:
             self.log.error("Exception: %s" % str(ex))
             self.log.debug("Exception: %s" % traceback.format_exc())
@@ -190,6 +202,26 @@ class _condor(_thread, WMSStatusInterface):
         self.log.debug('Leaving.')
 
     
+    def _adaptinterval(self):
+        """
+        recalculates the time until the next query.
+        A queue is starved when it has just got idle jobs.
+        """
+        counts = {}
+        for ca in self.rawdata:
+            key = (ca.get('match_apf_queue', None), str(ca.get('jobstatus', None)))
+            counts[key] = counts.get(key, 0) + 1
+        previous = self.pollinterval.counts or {}
+        starved = False
+        if previous:
+            for (queue, jobstatus), n in counts.items():
+                # jobstatus 1 is Idle
+                if jobstatus == '1' and previous.get((queue, jobstatus), 0) == 0:
+                    starved = True
+                    break
+        self._thread_loop_interval = self.pollinterval.update(counts, starved)
+
+
     ### BEGIN TEST ###
     #
     # FIXME
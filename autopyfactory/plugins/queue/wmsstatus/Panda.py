@@ -6,8 +6,10 @@ import time
 import traceback
 
 from urllib import urlopen
+from Queue import Queue
 
-from autopyfactory.interfaces import WMSStatusInterface, _thread
+from autopyfactory.adaptiveinterval import AdaptiveInterval
+from autopyfactory.interfaces import WMSStatusInterface, _thread, _publisher
 from autopyfactory.info import WMSStatusInfo
 from autopyfactory.info import WMSQueueInfo
 from autopyfactory.info import SiteInfo
@@ -16,7 +18,7 @@ import autopyfactory.utils as utils
 
 import autopyfactory.external.panda.Client as Client
 
-class _panda(_thread, WMSStatusInterface):
+class _panda(_thread, _publisher, WMSStatusInterface):
     """
     -----------------------------------------------------------------------
     PanDA-flavored version of WMSStatus class.
@@ -27,6 +29,10 @@ class _panda(_thread, WMSStatusInterface):
             the interfaces inherited from Thread and from WMSStatusInterface
     -----------------------------------------------------------------------
     """
+    # sources of info queried by each cycle.
+    # The jobs go first: the schedulers depend most on their freshness.
+    sources = ['jobs', 'sites', 'clouds']
+
     def __init__(self, apfqueue, config, section):
         # NOTE:
         # the **kw is not needed at this time,
@@ -34,24 +40,93 @@ class _panda(_thread, WMSStatusInterface):
         # However, it would allow for more than one PanDA server.
 
         _thread.__init__(self)
+        _publisher._initpublisher(self)
         apfqueue.factory.threadsregistry.add("plugin", self)
 
         try:
             self.apfqueue = apfqueue
             self.log = logging.getLogger('autopyfactory.wmsstatus.%s' %apfqueue.apfqname)
             self.log.debug("WMSStatusPlugin: Initializing object...")
-            self.maxage = self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.maxage', default_value=360)
+            self.maxage = self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.maxage', 'getint', default_value=360)
+            # info older than maxage is still served, while refreshing it,
+            # until it is older than the hard maxage
+            self.hardmaxage = max(self.maxage, self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.maxage.hard', 'getint', default_value=self.maxage))
             self.sleeptime = self.apfqueue.fcl.getint('Factory', 'wmsstatus.panda.sleep')
             self._thread_loop_interval = self.sleeptime
+            # the interval between cycles adapts to the changes in the jobs
+            self.pollinterval = AdaptiveInterval('wmsstatus.panda', self.sleeptime,
+                                                 self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.sleep.min', 'getint', default_value=self.sleeptime),
+                                                 self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.sleep.max', 'getint', default_value=self.sleeptime))
+
+            # clouds and sites specs change rarely,
+            # so they are refreshed less often than the jobs
+            self.specssleep = self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.specs.sleep', 'getint', default_value=900)
+            self.specsmaxage = self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.specs.maxage', 'getint', default_value=2700)
+            self.specshardmaxage = max(self.specsmaxage, self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.specs.maxage.hard', 'getint', default_value=self.specsmaxage))
+
+            # the three sources are queried concurrently. 
+            # Each cycle waits for each of them at most its deadline.
+            # A query still running after its deadline is not started again
+            # until it finishes, and its result is used when it arrives.
+            self.deadlines = {}
+            for source in self.sources:
+                self.deadlines[source] = self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.%s.deadline' %source, 'getint', default_value=120)
+            # ask the server for the factory sites only.
+            # Requires a PanDA server accepting a comma-separated list of sites.
+            # Otherwise, the other sites are discarded after the query.
+            self.serverfilter = self.apfqueue.fcl.generic_get('Factory', 'wmsstatus.panda.jobs.serverfilter', 'getboolean', default_value=False)
+            self.fetchqueue = Queue()
+            self.fetchworkers = []
+            self.fetchlock = threading.Lock()
+            self.inflight = {}      # source -> threading.Event set when the query is done
+            self.metrics = {}
+            for source in self.sources:
+                self.metrics[source] = {'last_duration': 0.0,
+                                        'last_success': 0,
+                                        'queries': 0,
+                                        'failures': 0,
+                                        'late': 0,
+                                       }
+
+            # mappings for the jobs statistics, compiled
+            self.jobsmappingtable = None
 
             # current WMSStatusIfno object
             self.currentcloudinfo = None
             self.currentjobinfo = None
             self.currentsiteinfo = None
+            # time each source was last confirmed by the server.
+            # Specs that did not change are kept, with their age renewed.
+            self.refreshed = dict([(source, 0) for source in self.sources])
+
+            # raw specs of each cloud and site, and the validators
+            # for the conditional fetch, from the last query
+            self.cloudspecs = {}
+            self.sitespecs = {}
+            self.cloudvalidators = None
+            self.sitevalidators = None
 
             # Using the Squid Cache when contacting the PanDA server
             Client.useWebCache()
 
+            # in-process HTTP transport, with persistent connections
+            fcl = self.apfqueue.fcl
+            Client.setTransport(timeout=fcl.generic_get('Factory', 'wmsstatus.panda.timeout', 'getint', default_value=600),
+                                retries=fcl.generic_get('Factory', 'wmsstatus.panda.retries', 'getint', default_value=3),
+                                backoff=fcl.generic_get('Factory', 'wmsstatus.panda.backoff', 'getint', default_value=1),
+                                maxconnections=fcl.generic_get('Factory', 'wmsstatus.panda.maxconnections', 'getint', default_value=4))
+
+            # formats accepted for the responses, in order of preference.
+            # Pickle is only for servers not supporting JSON
+            decoders = fcl.generic_get('Factory', 'wmsstatus.panda.decoders', default_value='json')
+            Client.setDecoders([x.strip() for x in decoders.split(',')])
+
+            # proxy for the requests needing authentication
+            self.proxylist = None
+            plist = fcl.generic_get('Factory', 'wmsstatus.panda.proxy', default_value=None)
+            if plist:
+                self.proxylist = [x.strip() for x in plist.split(',')]
+
             self.log.info('WMSStatusPlugin: Object initialized.')
         except Exception as ex:
             self.log.error("WMSStatusPlugin object initialization failed. Raising exception")
@@ -70,16 +145,16 @@ class _panda(_thread, WMSStatusInterface):
         """
         Returns current WMSStatusInfo object
     
-        If the info recorded is older than that maxage,
-        None is returned, 
-        
+        If the info recorded is older than maxage,
+        it is still returned, and a new query is started right away.
+        If it is older than the hard maxage, None is returned.
         """
         self.log.debug('get: Starting with inputs maxtime=%s' % self.maxage)
         if self.currentjobinfo is None:
             self.log.debug('Info not initialized. Return None.')
             return None    
-        elif self.maxage > 0 and (int(time.time()) - self.currentjobinfo.lasttime) > self.maxage:
-            self.log.debug('Info is too old. Maxage = %d. Returning None' % self.maxage)
+        elif not self._servable(self.currentjobinfo.lasttime, self.maxage, self.hardmaxage):
+            self.log.debug('Info is too old. Hard maxage = %d. Returning None' % self.hardmaxage)
             return None    
         else:
             if queue:
@@ -95,12 +170,14 @@ class _panda(_thread, WMSStatusInterface):
         from the info retrieved from the PanDA server (as a dict)
         using method userinterface.Client.getCloudSpecs()
 
+        The WMSStatusInfo object is a snapshot, never modified. 
+        Its attribute version increases each time a cloud changes.
         """
         if self.currentcloudinfo is None:
             self.log.debug('Info not initialized. Return None.')
             return None    
-        elif self.maxage > 0 and (int(time.time()) - self.currentcloudinfo.lasttime) > self.maxage:
-            self.log.debug('Info is too old. Maxage = %d. Returning None' % self.maxage)
+        elif not self._servable(self.refreshed['clouds'], self.specsmaxage, self.specshardmaxage):
+            self.log.debug('Info is too old. Hard maxage = %d. Returning None' % self.specshardmaxage)
             return None    
         else:
             if cloud:
@@ -114,12 +191,15 @@ class _panda(_thread, WMSStatusInterface):
         selects the entry corresponding to sites
         from the info retrieved from the PanDA server (as a dict)
         using method userinterface.Client.getSiteSpecs(siteType='all')
+
+        The WMSStatusInfo object is a snapshot, never modified. 
+        Its attribute version increases each time a site changes.
         """
         if self.currentsiteinfo is None:
             self.log.debug('Info not initialized. Return None.')
             return None    
-        elif self.maxage > 0 and (int(time.time()) - self.currentsiteinfo.lasttime) > self.maxage:
-            self.log.debug('Info is too old. Maxage = %d. Returning None' % self.maxage)
+        elif not self._servable(self.refreshed['sites'], self.specsmaxage, self.specshardmaxage):
+            self.log.debug('Info is too old. Hard maxage = %d. Returning None' % self.specshardmaxage)
             return None    
         else:
             if site:
@@ -154,26 +234,37 @@ class _panda(_thread, WMSStatusInterface):
                 - Clouds configuration
                 - Sites configuration
                 - Jobs status per site
+        Queries run in parallel in the fetch workers.
+        Each new snapshot replaces the previous one as soon as it is ready.
         """
         self.log.debug('Starting.')
         
         try:
-            newcloudinfo = self._updateclouds()
-            if newcloudinfo:
-                newcloudinfo.lasttime = int(time.time())
-
-            newsiteinfo = self._updatesites()
-            if newsiteinfo:
-                newsiteinfo.lasttime = int(time.time())
-
-            newjobinfo = self._updatejobs()
-            if newjobinfo:
-                newjobinfo.lasttime = int(time.time())
-            
-            self.log.debug("Replacing old info with newly generated info.")
-            self.currentjobinfo = newjobinfo
-            self.currentcloudinfo = newcloudinfo
-            self.currentsiteinfo = newsiteinfo
+            self._setproxy()
+
+            now = int(time.time())
+            started = {}
+            for source in self.sources:
+                if source != 'jobs' and now - self.metrics[source]['last_success'] < self.specssleep:
+                    continue
+                done = self._startfetch(source)
+                if done is not None:
+                    started[source] = done
+
+            for source in self.sources:
+                if source not in started:
+                    continue
+                done = started[source]
+                # all started at the same time, 
+                # so each one is waited for until its own deadline
+                timeout = max(0, now + self.deadlines[source] - time.time())
+                if not done.wait(timeout):
+                    self.log.warning('query for %s did not finish within %s seconds' %(source, self.deadlines[source]))
+                    self.fetchlock.acquire()
+                    try:
+                        self.metrics[source]['late'] += 1
+                    finally:
+                        self.fetchlock.release()
         
         except Exception as e:
             self.log.error("Exception: %s" % str(e))
@@ -182,6 +273,224 @@ class _panda(_thread, WMSStatusInterface):
         self.log.debug('Leaving.')
 
 
+    def getSnapshotAge(self, source='jobs'):
+        """
+        seconds since the info of a source ('jobs', 'sites' or 'clouds')
+        was collected, or None if there is none yet.
+        """
+        info = {'jobs': self.currentjobinfo,
+                'sites': self.currentsiteinfo,
+                'clouds': self.currentcloudinfo}[source]
+        if info is None:
+            return None
+        return int(time.time()) - self.refreshed[source]
+
+
+    def getMetrics(self):
+        """
+        returns a copy of the timing and counters of each source
+        """
+        self.fetchlock.acquire()
+        try:
+            metrics = dict([(source, dict(m)) for source, m in self.metrics.items()])
+            metrics['interval'] = self.pollinterval.interval
+            return metrics
+        finally:
+            self.fetchlock.release()
+
+
+    # ----------------------------------------------------------------------
+    #  fetch workers
+    # ----------------------------------------------------------------------
+
+    def _prerun(self):
+        for source in self.sources:
+            worker = threading.Thread(target=self._fetchwork, name='panda-fetch-%s' %source)
+            worker.daemon = True
+            worker.start()
+            self.fetchworkers.append(worker)
+
+
+    def _join(self):
+        for worker in self.fetchworkers:
+            self.fetchqueue.put(None)
+
+
+    def _startfetch(self, source):
+        """
+        queues the query of a source, unless a previous one is still running.
+        Returns the Event to be set when the query is done, or None.
+        """
+        self.fetchlock.acquire()
+        try:
+            if source in self.inflight:
+                self.log.debug('previous query for %s still running. Skipping it' %source)
+                return None
+            done = threading.Event()
+            self.inflight[source] = done
+        finally:
+            self.fetchlock.release()
+        self.fetchqueue.put(source)
+        return done
+
+
+    def _fetchwork(self):
+        """
+        body of each fetch worker.
+        """
+        while True:
+            source = self.fetchqueue.get()
+            if source is None:
+                # signal to stop
+                break
+            before = time.time()
+            success = False
+            try:
+                try:
+                    info = self._fetch(source)
+                    if info is not None:
+                        self._swap(source, info)
+                        success = True
+                except Exception as ex:
+                    self.log.error('exception querying %s: %s' %(source, ex))
+                    self.log.debug(traceback.format_exc(None))
+            finally:
+                # otherwise the source would never be queried again
+                self._donefetch(source, success, time.time() - before)
+
+
+    def _fetch(self, source):
+        if source == 'jobs':
+            return self._updatejobs()
+        if source == 'sites':
+            return self._updatesites()
+        if source == 'clouds':
+            return self._updateclouds()
+
+
+    def _swap(self, source, info):
+        """
+        replaces the current info of a source, and signals the APFQueues.
+        If the query failed, the previous info is kept.
+        If the specs did not change, the current info is kept,
+        and only its age is renewed.
+        """
+        now = int(time.time())
+        self.refreshed[source] = now
+        if source == 'jobs':
+            info.lasttime = now
+            self.currentjobinfo = info
+            self._adaptinterval(info)
+        elif source == 'sites':
+            if info is self.currentsiteinfo:
+                self.log.debug("sites info did not change. Keeping version %s" %info.version)
+                return
+            info.lasttime = now
+            self.currentsiteinfo = info
+        elif source == 'clouds':
+            if info is self.currentcloudinfo:
+                self.log.debug("clouds info did not change. Keeping version %s" %info.version)
+                return
+            info.lasttime = now
+            self.currentcloudinfo = info
+        self.log.debug("Replaced %s info with newly generated info." %source)
+        # signal the APFQueues waiting for new info
+        self._publish()
+
+
+    def _adaptinterval(self, jobinfo):
+        """
+        recalculates the time until the next cycle.
+        A site is starved when it has just got jobs ready to run.
+        """
+        counts = {}
+        for wmssite in jobinfo.keys():
+            qi = dict.__getitem__(jobinfo, wmssite)
+            for state, n in qi.getraw().items():
+                if isinstance(n, (int, long)):
+                    counts[(wmssite, state)] = n
+        previous = self.pollinterval.counts or {}
+        starved = False
+        if previous:
+            for (wmssite, state), n in counts.items():
+                if state == 'ready' and n > 0 and previous.get((wmssite, state), 0) == 0:
+                    starved = True
+                    break
+        self._thread_loop_interval = self.pollinterval.update(counts, starved)
+
+
+    def _donefetch(self, source, success, duration):
+        self.fetchlock.acquire()
+        try:
+            m = self.metrics[source]
+            m['queries'] += 1
+            m['last_duration'] = duration
+            if success:
+                m['last_success'] = int(time.time())
+            else:
+                m['failures'] += 1
+            done = self.inflight.pop(source)
+        finally:
+            self.fetchlock.release()
+        self.log.info('query for %s took %.2f seconds, success=%s' %(source, duration, success))
+        done.set()
+
+
+    def _setproxy(self):
+        """
+        passes the proxy from the AuthManager to the PanDA client,
+        to be used as X509 client certificate.
+        """
+        if self.proxylist:
+            Client.setProxy(self.apfqueue.factory.authmanager.getProxyPath(self.proxylist))
+
+
+    def _wmsqueues(self):
+        """
+        set of wmsqueues of all the APFQueues in the factory.
+        An empty set means no filtering.
+        """
+        manager = getattr(self.apfqueue.factory, 'apfqueuesmanager', None)
+        if manager is None:
+            return set()
+        wmsqueues = set()
+        for apfqueue in list(manager.queues.values()):
+            wmsqueue = getattr(apfqueue, 'wmsqueue', None)
+            if wmsqueue:
+                wmsqueues.add(wmsqueue)
+        return wmsqueues
+
+
+    def _diffspecs(self, newspecs, oldspecs, oldinfo, infoclass):
+        """
+        builds a new WMSStatusInfo object from the raw specs.
+        Objects are only created for the entries whose specs changed, 
+        the others are taken from the previous WMSStatusInfo.
+        If nothing changed, the previous WMSStatusInfo is returned.
+        """
+        info = WMSStatusInfo()
+        nchanged = 0
+        for name, attrdict in newspecs.items():
+            obj = None
+            if oldinfo is not None and oldspecs.get(name) == attrdict:
+                obj = dict.get(oldinfo, name)
+            if obj is None:
+                obj = infoclass()
+                obj.fill(attrdict)
+                nchanged += 1
+            info[name] = obj
+        nremoved = len([name for name in oldspecs if name not in newspecs])
+        self.log.debug('%d entries changed, %d removed, out of %d' %(nchanged, nremoved, len(newspecs)))
+
+        if oldinfo is not None and nchanged == 0 and nremoved == 0:
+            return oldinfo
+        if oldinfo is None:
+            info.version = 1
+        else:
+            info.version = oldinfo.version + 1
+        return info
+
+
     def _updateclouds(self):
         """
         
@@ -270,7 +579,7 @@ class _panda(_thread, WMSStatusInterface):
 
         before = time.time()
         # get Clouds Specs
-        clouds_err, all_clouds_config = Client.getCloudSpecs()
+        clouds_err, all_clouds_config, self.cloudvalidators = Client.getCloudSpecsIfModified(self.cloudvalidators)
         delta = time.time() - before
         self.log.debug('it took %s seconds to perform the query' %delta)
         self.log.debug('%s seconds to perform query' %delta)
@@ -278,13 +587,12 @@ class _panda(_thread, WMSStatusInterface):
         if clouds_err:
             self.log.error('Client.getCloudSpecs() failed')
             return None
+        elif all_clouds_config is None:
+            self.log.debug('clouds specs did not change')
+            return self.currentcloudinfo
         else:
-            cloudsinfo = WMSStatusInfo()
-            for cloud in all_clouds_config.keys():
-                    ci = CloudInfo()
-                    cloudsinfo[cloud] = ci
-                    attrdict = all_clouds_config[cloud]
-                    ci.fill(attrdict)
+            cloudsinfo = self._diffspecs(all_clouds_config, self.cloudspecs, self.currentcloudinfo, CloudInfo)
+            self.cloudspecs = all_clouds_config
             return cloudsinfo
                         
 
@@ -421,7 +729,7 @@ class _panda(_thread, WMSStatusInterface):
             """
         before = time.time()
         # get Sites Specs from Client.py
-        sites_err, all_sites_config = Client.getSiteSpecs(siteType='all')
+        sites_err, all_sites_config, self.sitevalidators = Client.getSiteSpecsIfModified(siteType='all', validators=self.sitevalidators)
         delta = time.time() - before
 
         self.log.debug('_updateSites: it took %s seconds to perform the query' %delta)
@@ -430,13 +738,12 @@ class _panda(_thread, WMSStatusInterface):
         if sites_err:
             self.log.error('Client.getSiteSpecs() failed.')
             return None
+        elif all_sites_config is None:
+            self.log.debug('_updateSites: sites specs did not change')
+            return self.currentsiteinfo
         else:
-            sitesinfo = WMSStatusInfo()
-            for site in all_sites_config.keys():
-                    si = SiteInfo()
-                    sitesinfo[site] = si
-                    attrdict = all_sites_config[site]
-                    si.fill(attrdict)
+            sitesinfo = self._diffspecs(all_sites_config, self.sitespecs, self.currentsiteinfo, SiteInfo)
+            self.sitespecs = all_sites_config
             return sitesinfo
 
                         
@@ -501,7 +808,11 @@ class _panda(_thread, WMSStatusInterface):
         #            workingGroup='', 
         #            jobType='test,prod,managed,user,panda,ddm,rc_test,prod_test'
         #            ) 
-        jobs_err, all_jobs_config = Client.getJobStatisticsWithLabel()
+        wmsqueues = self._wmsqueues()
+        if wmsqueues and self.serverfilter:
+            jobs_err, all_jobs_config = Client.getJobStatisticsWithLabel(site=','.join(sorted(wmsqueues)))
+        else:
+            jobs_err, all_jobs_config = Client.getJobStatisticsWithLabel()
         # NOTE: reason to use getJobStatisticsWithLabel()
         #       is because by default PanDA does not give info on all labels.
         #       Jobs info for labels like "rc-test" is hidden,
@@ -514,9 +825,18 @@ class _panda(_thread, WMSStatusInterface):
         if jobs_err:
                 self.log.error('Client.getJobStatisticsPerSite() failed.')
                 return None 
+
+        # only the sites served by this factory are kept
+        if wmsqueues:
+            ntotal = len(all_jobs_config)
+            all_jobs_config = dict([(wmssite, all_jobs_config[wmssite]) for wmssite in wmsqueues if wmssite in all_jobs_config])
+            self.log.debug('_updateJobs: kept %d sites out of %d' %(len(all_jobs_config), ntotal))
                 
-        self.jobsstatisticspersite2info = self.apfqueue.factory.mappingscl.section2dict('PANDAWMSSTATUS-JOBSSTATISTICSPERSITE2INFO')
-        self.log.debug('jobsstatisticspersite2info mappings are %s' %self.jobsstatisticspersite2info)
+        # compiled by the Factory registry, only when the mappings are reloaded
+        jobsmappingtable = self.apfqueue.factory.mappings.table('PANDAWMSSTATUS-JOBSSTATISTICSPERSITE2INFO', WMSQueueInfo.states)
+        if jobsmappingtable is not self.jobsmappingtable:
+            self.log.debug('jobsstatisticspersite2info mappings are %s' %jobsmappingtable.mappings)
+            self.jobsmappingtable = jobsmappingtable
         ###self.jobsstatisticspersite2info = {'pending'     : 'notready',
         ###                                   'defined'     : 'notready',
         ###                                   'assigned'    : 'notready',
@@ -532,12 +852,12 @@ class _panda(_thread, WMSStatusInterface):
         ###                                   'cancelled'   : 'failed'}
 
         wmsstatusinfo = WMSStatusInfo()
-        for wmssite in all_jobs_config.keys():
-                qi = WMSQueueInfo()
-                wmsstatusinfo[wmssite] = qi
-                for label in all_jobs_config[wmssite].keys():
-                    attrdict = all_jobs_config[wmssite][label] 
-                    qi.fill(attrdict, mappings=self.jobsstatisticspersite2info, reset=False)
+        unknown = set()
+        for wmssite, labels in all_jobs_config.iteritems():
+                # counts of all labels added together
+                wmsstatusinfo[wmssite] = WMSQueueInfo.fromdicts(labels.itervalues(), self.jobsmappingtable, unknown)
+        if unknown:
+            self.log.warning('_updateJobs: ignoring job states not in the mappings: %s' %', '.join(sorted([str(k) for k in unknown])))
         return wmsstatusinfo
 
 
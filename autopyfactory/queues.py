@@ -42,7 +42,7 @@ from autopyfactory.apfexceptions import CondorVersionFailure, CondorStatusFailur
 from autopyfactory.configloader import Config, ConfigManager, ConfigsDiff
 from autopyfactory.cleanlogs import CleanLogs
 from autopyfactory.logserver import LogServer
-from autopyfactory.interfaces import _thread
+from autopyfactory.schedpipeline import SchedPipeline
 
 
 class APFQueuesManager(object):
@@ -130,9 +130,10 @@ class APFQueuesManager(object):
 
     def activate(self):
         """
-        starts all APFQueue threads.
+        starts all APFQueue objects, 
+        i.e. hands them to the Factory CycleScheduler.
         We do it here, instead of one by one at the same time the object is created (old style),
-        so we can control which APFQueue threads are started and which ones are not
+        so we can control which APFQueues are started and which ones are not
         in a more clear way
         """
         cycles = self.factory.fcl.generic_get('Factory', 'cycles')
@@ -221,13 +222,19 @@ class APFQueuesManager(object):
         return d1, d2
  
 
-class APFQueue(_thread):
+class APFQueue(object):
     """
     -----------------------------------------------------------------------
     Encapsulates all the functionality related to servicing each queue (i.e. siteid, i.e. site).
+    APFQueue objects do not run their own thread. 
+    Their cycles are fired by the Factory CycleScheduler.
     -----------------------------------------------------------------------
     Public Interface:
-            The class is inherited from Thread, so it has the same public interface.
+            start()
+            join()
+            isAlive()
+            readyforcycle()
+            runcycle()
     -----------------------------------------------------------------------
     """
     
@@ -238,8 +245,9 @@ class APFQueue(_thread):
         factory is the Factory object who created the queue 
         """
 
-        _thread.__init__(self)
         factory.threadsregistry.add("queue", self)
+        self.stopevent = threading.Event()
+        self._started = False
 
         # recording moment the object was created
         self.inittime = datetime.datetime.now()
@@ -268,7 +276,8 @@ class APFQueue(_thread):
             self.cyclesrun = 0
 
             self.sleep = self.qcl.generic_get(apfqname, 'apfqueue.sleep', 'getint')
-            self._thread_loop_interval =  self.sleep
+            # the decisions of the sched plugins are logged once every N cycles. 0 means never
+            self.schedtracesample = self.qcl.generic_get(apfqname, 'sched.trace.sample', 'getint', default_value=1)
            
         except Exception as ex:
             self.log.exception('APFQueue: exception captured while reading configuration variables to create the object.')
@@ -283,11 +292,14 @@ class APFQueue(_thread):
             self.log.exception('APFQueue: Exception getting plugins' )
             raise ex
         
-        self.log.debug('APFQueue: Object initialized.')
+        # version of the BatchStatus snapshot used in the last cycle
+        self.last_batchstatus_version = 0
+        # (nsub, SchedTrace) already calculated by the CycleScheduler 
+        # for the next cycle, if any
+        self.presetsched = None
+        self.schedtrace = None
 
-        ### BEGIN TEST TIMESTAMP ###
-        self.last_batchqueue_timestamp = 0
-        ### END TEST TIMESTAMP ###
+        self.log.debug('APFQueue: Object initialized.')
 
 
     # =========================================================================
@@ -319,6 +331,7 @@ class APFQueue(_thread):
                                                              self, 
                                                              self.qcl, 
                                                              self.apfqname)     
+        self.schedpipeline = SchedPipeline(self, self.scheduler_plugins)
 
 
     def _wmsstatus_plugin(self):
@@ -393,67 +406,91 @@ class APFQueue(_thread):
     # =========================================================================
 
 
-    def _run(self):
+    # =========================================================================
+    #       scheduling
+    # =========================================================================
+
+    def start(self):
+        """
+        hands this APFQueue to the Factory CycleScheduler
+        """
+        if not self._started:
+            self.log.debug('starting')
+            self._started = True
+            self.factory.cyclescheduler.add(self)
+
+
+    def join(self, timeout=None):
+        """
+        stops scheduling new cycles for this APFQueue
+        """
+        if not self.stopevent.isSet():
+            self.log.debug('joining')
+            self.stopevent.set()
+            self.factory.cyclescheduler.remove(self)
+
+
+    def isAlive(self):
+        return self._started and not self.stopevent.isSet()
+
+
+    def readyforcycle(self):
+        """
+        Called by the CycleScheduler when this APFQueue is due.
+        Returns True if the info plugins have valid content
+        and there is fresh batch status info.
+        It never blocks.
+        """
+        if not self._info_services_ready():
+            return False
+        return self._new_status_info()
+
+
+    def runcycle(self):
         """
-        Method called by thread.start()
-        Main functional loop of this APFQueue. 
+        Called by a CycleScheduler worker thread.
+        Main functional cycle of this APFQueue. 
         """        
-        self._wait_for_info_services()
-        ### BEGIN TEST TIMESTAMP ###
-        if self._new_status_info():
-            nsub = self._callscheds()
-            self._submit(nsub)
-            self._monitor()
-        ### END TEST TIMESTAMP ###
+        if self.stopevent.isSet():
+            return
+        nsub = self._callscheds()
+        self._submit(nsub)
+        self._monitor()
         self._exitloop()
         self._logtime() 
 
 
-    def _wait_for_info_services(self):
+    def _info_services_ready(self):
         """
-        wait for the info plugins to have valid content
-        before doing actions
+        checks if the info plugins have valid content
+        before doing actions.
+        After 30 minutes, the APFQueue proceeds anyway. 
         """
-        self.log.debug('starting')
         timeout = 1800 # 30 minutes
-        start = int(time.time())
-        
+        now = datetime.datetime.now()
+        if (now - self.inittime).total_seconds() > timeout:
+            return True
+
         # Only worry about plugins that have been defined...
-        pluginstowait = []
-        if self.wmsstatus_plugin is not None:
-            pluginstowait.append(self.wmsstatus_plugin)
-        if self.batchstatus_plugin is not None:
-            pluginstowait.append(self.batchstatus_plugin)
-                
-        loop = True
-        while loop:
-            self.log.debug("Checking for info plugin valid content...")
-            now = int(time.time())
-            if (now - start) > timeout:
-                loop = False
-            else:
-                infolist = []
-                for p in pluginstowait:
-                    info = p.getInfo()
-
-                    infolist.append(info)
-                if None not in infolist:
-                    loop = False
-                else:
-                    time.sleep(10)
-        self.log.debug('leaving')
+        for p in [self.wmsstatus_plugin, self.batchstatus_plugin]:
+            if p is not None and p.getInfo() is None:
+                self.log.debug("info plugin %s has no valid content yet" %p.__class__.__name__)
+                return False
+        return True
 
 
-    ### BEGIN TEST TIMESTAMP ###
     def _new_status_info(self):
+        """
+        checks if the BatchStatus plugin has published
+        a new snapshot since the last cycle
+        """
         # FIXME
-        # the timestamp for WMS Status is missing !!
-        if not self.batchstatus_plugin.last_timestamp > self.last_batchqueue_timestamp:
-            self.log.info("there is no fresh batch status data. Doing nothing.")
+        # the snapshot version for WMS Status is not checked !!
+        if not self.batchstatus_plugin.snapshotversion > self.last_batchstatus_version:
+            self.log.debug("there is no fresh batch status data. Doing nothing.")
             return False
         else:
             return True
-    ### END TEST TIMESTAMP ###
 
 
     def _callscheds(self, nsub=0):
@@ -461,25 +498,37 @@ class APFQueue(_thread):
         calls the sched plugins 
         and calculates the number of pilot to submit
         """
-        fullmsg = ""
-        self.log.debug("APFQueue [%s] run(): Calling sched plugins..." % self.apfqname)
-        for sched_plugin in self.scheduler_plugins:
-            (nsub, msg) = sched_plugin.calcSubmitNum(nsub)
-            if msg:
-                if fullmsg:
-                    fullmsg = "%s;%s" % (fullmsg, msg)
-                else:
-                    fullmsg = msg
+        presetsched = self.presetsched
+        self.presetsched = None
+        if presetsched is not None:
+            self.log.debug("APFQueue [%s] run(): Using the result of the factory-wide evaluation" % self.apfqname)
+            (nsub, trace) = presetsched
+        else:
+            self.log.debug("APFQueue [%s] run(): Calling sched plugins..." % self.apfqname)
+            (nsub, trace) = self.schedpipeline.evaluate(nsub)
         self.log.debug("APFQueue[%s]: All Sched plugins called. Result nsub=%s" % (self.apfqname, nsub))
-        #return nsub, fullmsg
+        if self.schedtracesample and self.cyclesrun % self.schedtracesample == 0:
+            # the trace is only rendered if some handler emits the message
+            self.log.info("nsub=%s; %s", nsub, trace)
         self.nsub = nsub
-        self.fullmsg = fullmsg
-        ### BEGIN TEST TIMESTAMP ###
-        self.last_batchqueue_timestamp = self.batchstatus_plugin.last_timestamp
-        ### END TEST TIMESTAMP ###
+        self.schedtrace = trace
+        # the snapshot actually evaluated, not a newer one 
+        # published in the meantime
+        self.last_batchstatus_version = trace.batchversion
         return nsub
 
 
+    @property
+    def fullmsg(self):
+        """
+        messages of all sched plugins in the last cycle,
+        only built when needed
+        """
+        if self.schedtrace is None:
+            return ""
+        return self.schedtrace.explain()
+
+
     def _submit(self, nsub):
         """
         submit using this number
@@ -497,12 +546,15 @@ class APFQueue(_thread):
 
     def _monitor(self):
 
+        fullmsg = None
         for m in self.monitor_plugins:
             self.log.debug('APFQueue[%s] run(): calling registerJobs for monitor plugin %s' % (self.apfqname, m))
             m.registerJobs(self, self.jobinfolist)
-            if self.fullmsg:
+            if fullmsg is None:
+                fullmsg = self.fullmsg
+            if fullmsg:
                 self.log.debug('APFQueue[%s] run(): calling updateLabel for monitor plugin %s' % (self.apfqname, m))
-                m.updateLabel(self.apfqname, self.fullmsg)
+                m.updateLabel(self.apfqname, fullmsg)
 
 
     def _exitloop(self):
@@ -0,0 +1,448 @@
+#! /usr/bin/env python
+
+"""
+    Compiled chain of sched plugins.
+
+    When the APFQueue is configured, each sched plugin is compiled
+    into a SchedStep: the name of an operation, and its parameters.
+    Plugins that can not be compiled are kept as they are,
+    and their calcSubmitNum() is called.
+
+    The status info is looked up only once per queue.
+    The decision of each step is kept in a SchedTrace as a record,
+    a tuple (name, ((key, value), ...)), for example
+
+        ('MaxPending', (('in', 40), ('pending', 12), ('maxpending', 20), ('ret', 8)))
+
+    and rendered as text, "MaxPending:in=40,pending=12,maxpending=20,ret=8",
+    only when the monitor or a log handler asks for it.
+    Plugins not compiled can return records too, instead of strings.
+
+    evaluatemany() evaluates the pipelines of many queues at once.
+    Queues with the same chain of operations are evaluated together,
+    one operation at a time over arrays with the status info of all of them.
+    NumPy is used when available. Otherwise, or for pipelines
+    with plugins not compiled, each queue is evaluated on its own.
+"""
+
+import logging
+import math
+
+try:
+    import numpy
+except ImportError:
+    # Not critical. Queues are then evaluated one by one.
+    numpy = None
+
+
+def render(record):
+    """
+    :param record: tuple (name, ((key, value), ...)), or a string
+    :return string: the record as text, or None for no record
+    """
+    if not record or isinstance(record, basestring):
+        return record
+    (name, fields) = record
+    return '%s:%s' %(name, ','.join(['%s=%s' %(key, value) for (key, value) in fields]))
+
+
+class SchedStep(object):
+    """
+    -----------------------------------------------------------------------
+    One compiled sched plugin: the name of the operation in OPS,
+    and its parameters.
+    -----------------------------------------------------------------------
+    """
+    __slots__ = ['op', 'params']
+
+    def __init__(self, op, **params):
+        self.op = op
+        self.params = params
+
+    def __repr__(self):
+        return 'SchedStep(%s, %s)' %(self.op, self.params)
+
+
+# =============================================================================
+#   operations
+# =============================================================================
+
+class SchedOp(object):
+    """
+    -----------------------------------------------------------------------
+    Same algorithm as a sched plugin,
+    for a single queue (scalar), and for arrays of queues (vector).
+    -----------------------------------------------------------------------
+    """
+    name = None
+    needswms = False
+    needsbatch = False
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        raise NotImplementedError
+
+    def vector(self, n, columns, params_l):
+        raise NotImplementedError
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        """
+        :return tuple: ((key, value), ...) explaining the decision,
+                       or None for no record
+        """
+        raise NotImplementedError
+
+
+def _column(params_l, name):
+    """
+    :return tuple: array with the values of a parameter,
+                   and array of booleans, True where the value is not None
+    """
+    values = [params.get(name) for params in params_l]
+    isset = numpy.array([v is not None for v in values], dtype=bool)
+    return (numpy.array([v or 0 for v in values]), isset)
+
+
+class _ready(SchedOp):
+    name = 'Ready'
+    needswms = True
+    needsbatch = True
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        if wmsinfo is None or batchinfo is None:
+            return 0
+        return max(0, (wmsinfo.ready - params['offset']) - batchinfo.pending)
+
+    def vector(self, n, columns, params_l):
+        (offset, isset) = _column(params_l, 'offset')
+        out = numpy.maximum(0, (columns['ready'] - offset) - columns['pending'])
+        return numpy.where(columns['haswms'] & columns['hasbatch'], out, 0)
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        if wmsinfo is None or batchinfo is None:
+            return (('comment', 'Invalid wmsinfo or batchinfo'),)
+        return (('in', n), ('activated', wmsinfo.ready), ('offset', params['offset']), ('pending', batchinfo.pending), ('ret', out))
+
+
+class _scale(SchedOp):
+    name = 'Scale'
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        return int(math.ceil(n * params['factor']))
+
+    def vector(self, n, columns, params_l):
+        (factor, isset) = _column(params_l, 'factor')
+        return numpy.ceil(n * factor).astype(int)
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        return (('in', n), ('factor', params['factor']), ('ret', out))
+
+
+class _maxpercycle(SchedOp):
+    name = 'MaxPerCycle'
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        if params['maximum'] is None:
+            return n
+        return min(n, params['maximum'])
+
+    def vector(self, n, columns, params_l):
+        (maximum, isset) = _column(params_l, 'maximum')
+        return numpy.where(isset, numpy.minimum(n, maximum), n)
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        if params['maximum'] is None:
+            return (('comment', 'Not set'), ('in', n))
+        return (('in', n), ('maxpercycle', params['maximum']), ('ret', out))
+
+
+class _minpercycle(SchedOp):
+    name = 'MinPerCycle'
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        if params['minimum'] is None:
+            return n
+        return max(n, params['minimum'])
+
+    def vector(self, n, columns, params_l):
+        (minimum, isset) = _column(params_l, 'minimum')
+        return numpy.where(isset, numpy.maximum(n, minimum), n)
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        if params['minimum'] is None:
+            return (('comment', 'Not set'),)
+        return (('in', n), ('minpercycle', params['minimum']), ('ret', out))
+
+
+class _maxpending(SchedOp):
+    name = 'MaxPending'
+    needsbatch = True
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        if not batchinfo or batchinfo.pending == 0 or params['maximum'] is None:
+            # if no pending, there may be free slots, so we impose no limit
+            return n
+        tosubmit = params['maximum'] - batchinfo.pending
+        if not params['allow_negative'] and tosubmit < 0:
+            tosubmit = 0
+        return min(n, tosubmit)
+
+    def vector(self, n, columns, params_l):
+        (maximum, isset) = _column(params_l, 'maximum')
+        (allow_negative, x) = _column(params_l, 'allow_negative')
+        pending = columns['pending']
+        tosubmit = maximum - pending
+        tosubmit = numpy.where(allow_negative.astype(bool), tosubmit, numpy.maximum(tosubmit, 0))
+        limited = columns['hasbatch'] & (pending != 0) & isset
+        return numpy.where(limited, numpy.minimum(n, tosubmit), n)
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        if not batchinfo:
+            return (('comment', 'No queueinfo.'),)
+        return (('in', n), ('pending', batchinfo.pending), ('maxpending', params['maximum']), ('ret', out))
+
+
+class _maxtorun(SchedOp):
+    name = 'MaxToRun'
+    needsbatch = True
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        if batchinfo is None:
+            return 0
+        if params['maximum'] is None:
+            return n
+        return min(n, params['maximum'] - batchinfo.pending - batchinfo.running)
+
+    def vector(self, n, columns, params_l):
+        (maximum, isset) = _column(params_l, 'maximum')
+        out = numpy.where(isset, numpy.minimum(n, maximum - columns['pending'] - columns['running']), n)
+        return numpy.where(columns['hasbatch'], out, 0)
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        if batchinfo is None:
+            return (('comment', 'No batchinfo'), ('in', n))
+        if params['maximum'] is None:
+            return None
+        return (('in', n), ('maxtorun', params['maximum']), ('pending', batchinfo.pending), ('running', batchinfo.running), ('ret', out))
+
+
+class _fixed(SchedOp):
+    name = 'Fixed'
+
+    def scalar(self, n, wmsinfo, batchinfo, params):
+        return params['pilotspercycle'] or 0
+
+    def vector(self, n, columns, params_l):
+        (pilotspercycle, isset) = _column(params_l, 'pilotspercycle')
+        return pilotspercycle + 0 * n
+
+    def fields(self, n, out, wmsinfo, batchinfo, params):
+        if params['pilotspercycle']:
+            return (('in', n), ('ret', out))
+        return (('comment', 'nosetup'), ('in', n), ('ret', 0))
+
+
+OPS = {'ready': _ready(),
+       'scale': _scale(),
+       'maxpercycle': _maxpercycle(),
+       'minpercycle': _minpercycle(),
+       'maxpending': _maxpending(),
+       'maxtorun': _maxtorun(),
+       'fixed': _fixed(),
+       }
+
+
+# =============================================================================
+#   pipelines
+# =============================================================================
+
+class SchedTrace(object):
+    """
+    -----------------------------------------------------------------------
+    The numbers of one evaluation of a pipeline,
+    to build the records, and their text, only when needed.
+    values[k][index] is the input of step k,
+    and values[-1][index] the final result.
+    str() of a SchedTrace is its text, so it can be passed
+    as an argument to the logging calls, and is only rendered
+    when some handler emits the message.
+    batchversion is the version of the BatchStatus snapshot
+    the evaluation was based on.
+    -----------------------------------------------------------------------
+    Public Interface:
+            records()
+            messages()
+            explain()
+    -----------------------------------------------------------------------
+    """
+    __slots__ = ['steps', 'wmsinfo', 'batchinfo', 'values', 'index', 'pluginmsgs', 'batchversion']
+
+    def __init__(self, steps, wmsinfo, batchinfo, values, index=0, pluginmsgs=None, batchversion=0):
+        self.steps = steps
+        self.wmsinfo = wmsinfo
+        self.batchinfo = batchinfo
+        self.values = values
+        self.index = index
+        self.pluginmsgs = pluginmsgs or {}
+        self.batchversion = batchversion
+
+    def records(self):
+        """
+        :return list: the record of each step with one,
+                      or the string returned by plugins not using records
+        """
+        record_l = []
+        for k, step in enumerate(self.steps):
+            if step.op is None:
+                record = self.pluginmsgs.get(k)
+            else:
+                op = OPS[step.op]
+                n = int(self.values[k][self.index])
+                out = int(self.values[k + 1][self.index])
+                fields = op.fields(n, out, self.wmsinfo, self.batchinfo, step.params)
+                record = fields and (op.name, fields)
+            if record:
+                record_l.append(record)
+        return record_l
+
+    def messages(self):
+        """
+        :return list: the text of each record, as the sched plugins do
+        """
+        return [render(record) for record in self.records()]
+
+    def explain(self):
+        """
+        :return string: the text of all records, separated by ';'
+        """
+        return ';'.join(self.messages())
+
+    def __str__(self):
+        return self.explain()
+
+
+class SchedPipeline(object):
+    """
+    -----------------------------------------------------------------------
+    The sched plugins of an APFQueue, compiled.
+    -----------------------------------------------------------------------
+    Public Interface:
+            evaluate(n=0)
+            steps
+            signature
+            compiled
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, apfqueue, plugins):
+        """
+        :param APFQueue apfqueue: the queue
+        :param list plugins: the sched plugins, in order
+        """
+        self.log = logging.getLogger('autopyfactory.schedpipeline.%s' %apfqueue.apfqname)
+        self.apfqueue = apfqueue
+        self.plugins = plugins
+        self.steps = []
+        for plugin in plugins:
+            step = plugin.compile()
+            if step is None or step.op not in OPS:
+                # calcSubmitNum() will be called
+                step = SchedStep(None)
+            self.steps.append(step)
+        self.signature = tuple([step.op for step in self.steps])
+        self.compiled = None not in self.signature
+        ops = [OPS[step.op] for step in self.steps if step.op is not None]
+        self.needswms = True in [op.needswms for op in ops]
+        self.needsbatch = True in [op.needsbatch for op in ops]
+        self.log.debug('sched plugins compiled into %s' %self.steps)
+
+
+    def batchversion(self):
+        """
+        version of the current BatchStatus snapshot.
+        Read before the info is looked up, so the info used
+        is never older than the snapshot with this version.
+        """
+        if self.apfqueue.batchstatus_plugin is None:
+            return 0
+        return self.apfqueue.batchstatus_plugin.snapshotversion
+
+
+    def inputs(self):
+        """
+        looks up the status info needed by the steps, once
+        :return tuple: (wmsinfo, batchinfo)
+        """
+        wmsinfo = None
+        batchinfo = None
+        if self.needswms and self.apfqueue.wmsstatus_plugin is not None:
+            wmsinfo = self.apfqueue.wmsstatus_plugin.getInfo(queue=self.apfqueue.wmsqueue)
+        if self.needsbatch and self.apfqueue.batchstatus_plugin is not None:
+            batchinfo = self.apfqueue.batchstatus_plugin.getInfo(queue=self.apfqueue.apfqname)
+        return (wmsinfo, batchinfo)
+
+
+    def evaluate(self, n=0):
+        """
+        :return tuple: (nsub, SchedTrace)
+        """
+        batchversion = self.batchversion()
+        (wmsinfo, batchinfo) = self.inputs()
+        values = [[n]]
+        pluginmsgs = {}
+        for k, step in enumerate(self.steps):
+            if step.op is None:
+                (n, msg) = self.plugins[k].calcSubmitNum(n)
+                pluginmsgs[k] = msg
+            else:
+                n = OPS[step.op].scalar(n, wmsinfo, batchinfo, step.params)
+            values.append([n])
+        return (n, SchedTrace(self.steps, wmsinfo, batchinfo, values, 0, pluginmsgs, batchversion))
+
+
+def _columns(inputs_l):
+    """
+    arrays with the status info of a list of queues
+    """
+    wmsinfo_l = [wmsinfo for (wmsinfo, batchinfo) in inputs_l]
+    batchinfo_l = [batchinfo for (wmsinfo, batchinfo) in inputs_l]
+    return {'ready': numpy.array([w.ready if w is not None else 0 for w in wmsinfo_l]),
+            'haswms': numpy.array([w is not None for w in wmsinfo_l], dtype=bool),
+            'pending': numpy.array([b.pending if b is not None else 0 for b in batchinfo_l]),
+            'running': numpy.array([b.running if b is not None else 0 for b in batchinfo_l]),
+            'hasbatch': numpy.array([b is not None for b in batchinfo_l], dtype=bool),
+            }
+
+
+def evaluatemany(pipelines, n=0):
+    """
+    evaluates the pipelines of many queues.
+    Pipelines not compiled call the calcSubmitNum() of their plugins.
+    :param list pipelines: SchedPipeline objects
+    :param int n: initial value of nsub for all of them
+    :return tuple: (list of nsub, list of SchedTrace),
+                   in the same order as pipelines
+    """
+    nsub_l = [0] * len(pipelines)
+    trace_l = [None] * len(pipelines)
+
+    groups = {}
+    for i, pipeline in enumerate(pipelines):
+        if numpy is None or not pipeline.compiled:
+            (nsub_l[i], trace_l[i]) = pipeline.evaluate(n)
+        else:
+            groups.setdefault(pipeline.signature, []).append(i)
+
+    for signature, index_l in groups.items():
+        members = [pipelines[i] for i in index_l]
+        batchversion_l = [pipeline.batchversion() for pipeline in members]
+        inputs_l = [pipeline.inputs() for pipeline in members]
+        columns = _columns(inputs_l)
+        values = [numpy.array([n] * len(members))]
+        for k, op in enumerate(signature):
+            params_l = [pipeline.steps[k].params for pipeline in members]
+            values.append(OPS[op].vector(values[-1], columns, params_l))
+        for j, i in enumerate(index_l):
+            nsub_l[i] = int(values[-1][j])
+            (wmsinfo, batchinfo) = inputs_l[j]
+            trace_l[i] = SchedTrace(members[j].steps, wmsinfo, batchinfo, values, j, None, batchversion_l[j])
+    return (nsub_l, trace_l)
@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+
+"""
+    Process-wide cache of the latest batch status snapshots,
+    one per schedd, with the rollups precomputed once per snapshot:
+
+        StatusCache
+            get(scheddid)  ->  StatusSnapshot
+                                  .queues     StatusView[apfqname]  -> StateCounts
+                                  .wmsqueues  StatusView[wmsqueue]  -> StateCounts
+                                  .total      StateCounts
+            total()        ->  StateCounts, added over all schedds
+"""
+
+import logging
+import threading
+import time
+
+from autopyfactory.info import StateCounts
+
+
+def addcounts(counts_l):
+    """
+    adds a list of StateCounts objects into a new one
+    """
+    total = {}
+    for counts in counts_l:
+        for state, n in counts.getraw().items():
+            total[state] = total.get(state, 0) + n
+    return StateCounts(total)
+
+
+class StatusView(object):
+    """
+    -----------------------------------------------------------------------
+    Read-only view of a dictionary of StateCounts objects.
+    The dictionary is not copied.
+    An empty StateCounts object is returned for missing keys.
+    -----------------------------------------------------------------------
+    """
+    __slots__ = ['_d']
+
+    def __init__(self, d):
+        self._d = d
+
+    def __getitem__(self, k):
+        try:
+            return self._d[k]
+        except KeyError:
+            return StateCounts()
+
+    def get(self, k, default=None):
+        return self._d.get(k, default)
+
+    def __contains__(self, k):
+        return k in self._d
+
+    def __iter__(self):
+        return iter(self._d)
+
+    def __len__(self):
+        return len(self._d)
+
+    def keys(self):
+        return self._d.keys()
+
+    def values(self):
+        return self._d.values()
+
+    def items(self):
+        return self._d.items()
+
+    def __str__(self):
+        return "StatusView: %s" % self._d
+
+    def __repr__(self):
+        return str(self)
+
+
+class StatusSnapshot(object):
+    """
+    -----------------------------------------------------------------------
+    Counts of jobs per state, for every APF queue in a schedd,
+    plus the rollups per WMS queue and for the entire schedd.
+    Never modified after creation.
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, counts_d, wmsqueue_d=None, version=0, timestamp=None):
+        """
+        :param dict counts_d: StateCounts indexed by APF queue name
+        :param dict wmsqueue_d: WMS queue name indexed by APF queue name
+        :param int version: version of the snapshot in the batchstatus plugin
+        :param int timestamp: when the info was collected, 
+                              as seconds since epoch. Defaults to now.
+        """
+        self.version = version
+        if timestamp is None:
+            timestamp = int(time.time())
+        self.timestamp = timestamp
+        self.queues = StatusView(counts_d)
+        self.total = addcounts(counts_d.values())
+
+        bywmsqueue = {}
+        if wmsqueue_d:
+            for apfqname, counts in counts_d.items():
+                wmsqueue = wmsqueue_d.get(apfqname, None)
+                if wmsqueue is not None:
+                    bywmsqueue.setdefault(wmsqueue, []).append(counts)
+        self.wmsqueues = StatusView(dict([(wmsqueue, addcounts(counts_l)) for wmsqueue, counts_l in bywmsqueue.items()]))
+
+
+    def age(self):
+        """
+        seconds since the info was collected
+        """
+        return int(time.time()) - self.timestamp
+
+
+class StatusCache(object):
+    """
+    -----------------------------------------------------------------------
+    Latest StatusSnapshot of each schedd.
+    There is only one per process, shared by all batchstatus plugins.
+    -----------------------------------------------------------------------
+    Public Interface:
+            put(scheddid, snapshot)
+            get(scheddid)
+            total()
+            generation
+    -----------------------------------------------------------------------
+    """
+
+    instance = None
+
+    def __new__(cls, *k, **kw):
+        if StatusCache.instance is None:
+            StatusCache.instance = object.__new__(cls)
+            StatusCache.instance._initcache()
+        return StatusCache.instance
+
+    def _initcache(self):
+        self.log = logging.getLogger('autopyfactory.statuscache')
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self._total = None
+        # incremented with every new snapshot, from any schedd
+        self.generation = 0
+
+
+    def put(self, scheddid, snapshot):
+        """
+        replaces the snapshot for a schedd
+        """
+        self.lock.acquire()
+        try:
+            self.snapshots[scheddid] = snapshot
+            self._total = None
+            self.generation += 1
+        finally:
+            self.lock.release()
+        self.log.debug('new snapshot version %s for schedd %s' %(snapshot.version, scheddid))
+
+
+    def get(self, scheddid):
+        """
+        latest snapshot for a schedd, or None
+        """
+        return self.snapshots.get(scheddid, None)
+
+
+    def total(self):
+        """
+        counts added over all schedds.
+        Computed only once after each new snapshot.
+        """
+        self.lock.acquire()
+        try:
+            if self._total is None:
+                self._total = addcounts([snapshot.total for snapshot in self.snapshots.values()])
+            return self._total
+        finally:
+            self.lock.release()
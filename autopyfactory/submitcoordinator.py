@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+
+"""
+    Bulk submission of pilots from many APFQueues to the same schedd.
+
+    Each APFQueue asks for its own submission, as before,
+    but requests arriving within a short gathering window
+    are sent to the schedd together, in a single transaction,
+    with one cluster per APFQueue.
+
+    The first request of a batch waits for the window to close,
+    submits the whole batch, and wakes up the other callers
+    with their own cluster ID. The window closes early
+    when no other request has arrived for a short idle time,
+    so a queue submitting on its own does not wait for nothing.
+
+    The other callers wait for the batch at most a timeout.
+    Then they give up, and submit on their own.
+"""
+
+import logging
+import threading
+import time
+import traceback
+
+try:
+    import htcondor
+except ImportError:
+    # Not critical. Each APFQueue then submits on its own.
+    htcondor = None
+
+
+class SubmitTimeout(Exception):
+    """
+    Raised when the batch of a request was not submitted in time.
+    """
+    pass
+
+
+class SubmitRequest(object):
+    """
+    -----------------------------------------------------------------------
+    One APFQueue submission within a batch.
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, apfqname, jsdtext, n):
+        """
+        :param string apfqname: name of the APFQueue, for logging
+        :param string jsdtext: submit description, without the 'queue' line
+        :param int n: number of pilots
+        """
+        self.apfqname = apfqname
+        self.jsdtext = jsdtext
+        self.n = n
+        self.clusterid = None
+        self.error = None
+        self.done = threading.Event()
+        # True once the caller gave up waiting for the batch
+        self.abandoned = False
+
+
+class _submitcoordinator(object):
+    """
+    -----------------------------------------------------------------------
+    Gathers the submissions to a schedd into bulk transactions.
+    -----------------------------------------------------------------------
+    Public Interface:
+            submit(apfqname, jsdtext, n)
+    -----------------------------------------------------------------------
+    """
+
+    def __init__(self, scheddid, window=2, idle=0.2, timeout=120):
+        """
+        :param string scheddid: the schedd
+        :param float window: max seconds to wait for other requests
+                             before submitting a batch
+        :param float idle: the batch is submitted when no other request
+                           has arrived for these many seconds
+        :param float timeout: max seconds a request waits for its batch
+                              to be submitted, after the window
+        """
+        self.log = logging.getLogger('autopyfactory.submitcoordinator')
+        self.scheddid = scheddid
+        self.window = window
+        self.idle = min(idle, window)
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.pending = []
+        self.log.debug('SubmitCoordinator for schedd %s initialized with window=%s, idle=%s, timeout=%s' %(scheddid, window, idle, timeout))
+
+
+    def submit(self, apfqname, jsdtext, n):
+        """
+        submits n pilots, possibly together with other APFQueues.
+        Blocks until the batch has been submitted.
+        :return: the cluster ID of the new pilots
+        :raise SubmitTimeout: if the batch was not submitted in time.
+                              The pilots were not submitted then.
+        :raise Exception: if the submission failed
+        """
+        request = SubmitRequest(apfqname, jsdtext, n)
+        self.cond.acquire()
+        try:
+            self.pending.append(request)
+            leader = len(self.pending) == 1
+            if not leader:
+                self.cond.notify()
+        finally:
+            self.cond.release()
+
+        if leader:
+            batch = self._gather()
+            self._submitbatch(batch)
+        elif not request.done.wait(self.window + self.timeout):
+            self.cond.acquire()
+            try:
+                if not request.done.isSet():
+                    request.abandoned = True
+                    if request in self.pending:
+                        self.pending.remove(request)
+            finally:
+                self.cond.release()
+            if request.abandoned:
+                raise SubmitTimeout('batch for queue %s not submitted after %s seconds' %(apfqname, self.window + self.timeout))
+
+        if request.error is not None:
+            raise request.error
+        return request.clusterid
+
+
+    def _gather(self):
+        """
+        waits for other requests until the window closes,
+        or until none has arrived for the idle time.
+        :return list: the requests of the batch
+        """
+        deadline = time.time() + self.window
+        self.cond.acquire()
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                npending = len(self.pending)
+                self.cond.wait(min(self.idle, remaining))
+                if len(self.pending) == npending:
+                    # nobody else is submitting now
+                    break
+            batch = self.pending
+            self.pending = []
+            return batch
+        finally:
+            self.cond.release()
+
+
+    def _submitbatch(self, batch):
+        """
+        submits all requests in a single schedd transaction.
+        If the transaction fails, every request gets the error.
+        """
+        self.log.info('submitting %d pilots for %d queues in a single transaction' %(sum([r.n for r in batch]), len(batch)))
+        try:
+            schedd = self._getschedd()
+            with schedd.transaction() as txn:
+                for request in batch:
+                    if request.abandoned:
+                        self.log.warning('queue %s gave up waiting. Its pilots are not in the batch' %request.apfqname)
+                        continue
+                    request.clusterid = htcondor.Submit(request.jsdtext).queue(txn, request.n)
+                    self.log.debug('queue %s got cluster %s for %d pilots' %(request.apfqname, request.clusterid, request.n))
+        except Exception as e:
+            self.log.error('bulk submission failed: %s' %e)
+            self.log.debug(traceback.format_exc())
+            for request in batch:
+                request.clusterid = None
+                request.error = e
+        for request in batch:
+            if request.abandoned and request.clusterid is not None:
+                # it gave up while the transaction was running
+                self.log.warning('queue %s gave up waiting, but its pilots were submitted in cluster %s' %(request.apfqname, request.clusterid))
+            request.done.set()
+
+
+    def _getschedd(self):
+        return htcondor.Schedd()
+
+
+# =============================================================================
+#   Singleton wrapper
+# =============================================================================
+
+class SubmitCoordinator(object):
+
+    instances = {}
+    lock = threading.Lock()
+
+    def __new__(cls, *k, **kw):
+        # ---------------------------
+        # get the id:
+        #
+        # one coordinator per schedd
+        id = k[0]
+        # ---------------------------
+
+        SubmitCoordinator.lock.acquire()
+        try:
+            if not id in SubmitCoordinator.instances.keys():
+                SubmitCoordinator.instances[id] = _submitcoordinator(*k, **kw)
+            return SubmitCoordinator.instances[id]
+        finally:
+            SubmitCoordinator.lock.release()
@@ -0,0 +1,165 @@
+#!/bin/env python
+#
+# Compares the ways of building the WMSQueueInfo objects
+# from a getJobStatisticsWithLabel payload:
+#
+#   legacy      one fill() per label, with the quadratic fill()
+#               and the mappings looked up for every key
+#   fill        one fill() per label, with the current fill()
+#   compiled    one WMSQueueInfo.fromdicts() per site,
+#               with the mappings compiled once into a MappingTable
+#
+#   info_fill.py [--nsites N] [--repeat N]
+#
+
+import logging
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from autopyfactory.info import BaseInfo, WMSQueueInfo, MappingTable
+
+
+# section PANDAWMSSTATUS-JOBSSTATISTICSPERSITE2INFO of mappings.conf
+MAPPINGS = {'pending': 'notready',
+            'defined': 'notready',
+            'assigned': 'notready',
+            'waiting': 'notready',
+            'throttled': 'notready',
+            'activated': 'ready',
+            'starting': 'running',
+            'sent': 'running',
+            'running': 'running',
+            'holding': 'running',
+            'transferring': 'running',
+            'finished': 'done',
+            'failed': 'failed',
+            'cancelled': 'failed',
+            }
+
+LABELS = ['managed', 'prod_test', 'rc_test', 'user', 'panda', 'ptest']
+
+
+def makepayload(nsites):
+    payload = {}
+    for i in range(nsites):
+        site = 'SITE_%05d' % i
+        payload[site] = {}
+        for j, label in enumerate(LABELS):
+            counts = {}
+            for k, state in enumerate(sorted(MAPPINGS.keys())):
+                counts[state] = (i + j + k) % 500
+            # a state not in the mappings
+            counts['merging'] = 1
+            payload[site][label] = counts
+    return payload
+
+
+class LegacyQueueInfo(BaseInfo):
+    """
+    the dictionary-based WMSQueueInfo, with the original fill()
+    """
+    def __init__(self):
+        self.log = logging.getLogger('autopyfactory')
+
+    def fill(self, dictionary, mappings=None, reset=True):
+        usedk = []
+        for k,v in dictionary.iteritems():
+            if mappings:
+                if mappings.has_key(k):
+                    k = mappings[k]
+                else:
+                    log = logging.getLogger('autopyfactory')
+                    log.warning('ignoring unkown key %s in the dictionary' %k)
+                    continue
+            if k not in usedk:
+                usedk.append(k)
+                if not reset:
+                    try:
+                        v = self.__dict__[k] + v
+                    except KeyError:
+                        pass
+                    self.__dict__[k] = v
+            else:
+                try:
+                    v = self.__dict__[k] + v
+                except KeyError:
+                    pass
+            self.__dict__[k] = v
+
+
+class FillQueueInfo(BaseInfo):
+    """
+    the dictionary-based WMSQueueInfo, with the current fill()
+    """
+    pass
+
+
+def buildlegacy(payload):
+    out = {}
+    for site, labels in payload.iteritems():
+        qi = LegacyQueueInfo()
+        for counts in labels.itervalues():
+            qi.fill(counts, mappings=MAPPINGS, reset=False)
+        out[site] = qi
+    return out
+
+
+def buildfill(payload):
+    out = {}
+    unknown = set()
+    for site, labels in payload.iteritems():
+        qi = FillQueueInfo()
+        for counts in labels.itervalues():
+            qi.fill(counts, mappings=MAPPINGS, reset=False, unknown=unknown)
+        out[site] = qi
+    return out
+
+
+def buildcompiled(payload):
+    table = MappingTable(MAPPINGS, WMSQueueInfo.states)
+    out = {}
+    unknown = set()
+    for site, labels in payload.iteritems():
+        out[site] = WMSQueueInfo.fromdicts(labels.itervalues(), table, unknown)
+    return out
+
+
+def measure(build, payload, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        build(payload)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--nsites', type='int', default=1000, help='number of sites in the payload')
+    parser.add_option('--repeat', type='int', default=5, help='builds per measurement, the best one is reported')
+    (options, args) = parser.parse_args()
+
+    # the legacy fill() logs a warning for every unknown key
+    logging.getLogger('autopyfactory').addHandler(logging.NullHandler())
+    logging.getLogger('autopyfactory').propagate = False
+
+    payload = makepayload(options.nsites)
+    legacy = buildlegacy(payload)
+    compiled = buildcompiled(payload)
+    for site in payload:
+        assert legacy[site].ready == compiled[site].ready
+        assert legacy[site].running == compiled[site].running
+
+    print('%d sites, %d labels, %d states' % (options.nsites, len(LABELS), len(MAPPINGS) + 1))
+    print('%-10s %12s' % ('method', 'time (ms)'))
+    for name, build in [('legacy', buildlegacy), ('fill', buildfill), ('compiled', buildcompiled)]:
+        print('%-10s %12.1f' % (name, measure(build, payload, options.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
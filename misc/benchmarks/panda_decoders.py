@@ -0,0 +1,136 @@
+#!/bin/env python
+#
+# Compares the decoders of the PanDA client on site specs
+# and job statistics payloads: decoding time and peak memory.
+#
+# Recorded payloads can be passed as pickle or JSON files,
+# for example saved with
+#       curl -o sitespecs.pickle 'http://pandaserver.cern.ch:25085/server/panda/getSiteSpecs?siteType=all'
+# Otherwise payloads with the same shape are generated.
+#
+#   panda_decoders.py [--sites FILE] [--jobs FILE] [--nsites N] [--repeat N]
+#
+
+import cPickle as pickle
+import json
+import optparse
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import autopyfactory.external.panda.Client as Client
+
+
+def makesitespecs(nsites):
+    specs = {}
+    for i in range(nsites):
+        site = 'SITE_%05d' % i
+        attrs = {'sitename': site,
+                 'nickname': '%s-condor' % site,
+                 'cloud': ['US', 'DE', 'FR', 'UK', 'IT'][i % 5],
+                 'status': ['online', 'offline', 'test', 'brokeroff'][i % 4],
+                 'gatekeeper': 'gk%02d.example.org' % (i % 50),
+                 'queue': 'gk%02d.example.org/jobmanager-condor' % (i % 50),
+                 'maxtime': 172800,
+                 'memory': 2000,
+                 'maxinputsize': 14336,
+                 'setokens': {'ATLASDATADISK': 'srm://se.example.org', 'ATLASSCRATCHDISK': 'srm://se.example.org'},
+                 'ddm': '%s_DATADISK' % site,
+                 'releases': ['17.%d.%d' % (j, k) for j in range(5) for k in range(5)],
+                 }
+        for j in range(40):
+            attrs['attribute%02d' % j] = 'value %d' % j
+        specs[site] = attrs
+    return specs
+
+
+def makejobstatistics(nsites):
+    stats = {}
+    for i in range(nsites):
+        site = 'SITE_%05d' % i
+        stats[site] = {}
+        for label in ['managed', 'prod_test', 'rc_test', 'user', 'panda']:
+            stats[site][label] = {'activated': i % 1000,
+                                  'assigned': i % 100,
+                                  'running': i % 3000,
+                                  'holding': i % 50,
+                                  'transferring': i % 200,
+                                  'defined': i % 30,
+                                  }
+    return stats
+
+
+def loadpayload(path):
+    data = open(path).read()
+    if data.lstrip()[:1] in ('{', '['):
+        return json.loads(data)
+    return pickle.loads(data)
+
+
+def encodings(payload):
+    """
+    the payload as the server would send it with each decoder
+    """
+    return {'json': json.dumps(payload),
+            'pickle': pickle.dumps(payload, pickle.HIGHEST_PROTOCOL),
+            }
+
+
+def timedecode(decoder, data, repeat):
+    Client.setDecoders([decoder])
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        Client._decode(data)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peakmemory(decoder, data):
+    """
+    max RSS increase, in KB, of a child process decoding the data once
+    """
+    def childrss(decode):
+        pid = os.fork()
+        if pid == 0:
+            if decode:
+                Client.setDecoders([decoder])
+                Client._decode(data)
+            os._exit(0)
+        return os.wait4(pid, 0)[2].ru_maxrss
+    return childrss(True) - childrss(False)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sites', help='recorded getSiteSpecs payload')
+    parser.add_option('--jobs', help='recorded getJobStatisticsWithLabel payload')
+    parser.add_option('--nsites', type='int', default=2000, help='number of sites for generated payloads')
+    parser.add_option('--repeat', type='int', default=5, help='decodings per measurement, the best one is reported')
+    (options, args) = parser.parse_args()
+
+    payloads = []
+    if options.sites:
+        payloads.append(('site specs', loadpayload(options.sites)))
+    else:
+        payloads.append(('site specs', makesitespecs(options.nsites)))
+    if options.jobs:
+        payloads.append(('job statistics', loadpayload(options.jobs)))
+    else:
+        payloads.append(('job statistics', makejobstatistics(options.nsites)))
+
+    print('json module: %s' % Client.json.__name__)
+    print('%-16s %-8s %12s %12s %12s' % ('payload', 'decoder', 'size (KB)', 'time (ms)', 'peak (KB)'))
+    for name, payload in payloads:
+        for decoder, data in sorted(encodings(payload).items()):
+            elapsed = timedecode(decoder, data, options.repeat)
+            peak = peakmemory(decoder, data)
+            print('%-16s %-8s %12d %12.1f %12d' % (name, decoder, len(data) / 1024, elapsed * 1000, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/bin/env python
+#
+# Compares the ways of running the sched plugins of many queues:
+#
+#   plugins     calcSubmitNum() of each plugin, messages always built
+#   pipeline    SchedPipeline.evaluate() for each queue
+#   factory     evaluatemany() for all queues at once
+#
+#   sched_pipeline.py [--nqueues N] [--repeat N]
+#
+
+import logging
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import autopyfactory.schedpipeline as schedpipeline
+from autopyfactory.configloader import Config
+from autopyfactory.info import StateCounts, WMSQueueInfo
+from autopyfactory.plugins.queue.sched.Ready import Ready
+from autopyfactory.plugins.queue.sched.Scale import Scale
+from autopyfactory.plugins.queue.sched.MaxPerCycle import MaxPerCycle
+from autopyfactory.plugins.queue.sched.MaxPending import MaxPending
+from autopyfactory.plugins.queue.sched.MinPerCycle import MinPerCycle
+from autopyfactory.plugins.queue.sched.MaxToRun import MaxToRun
+
+
+class StatusPlugin(object):
+    def __init__(self):
+        self.info = {}
+
+    def getInfo(self, queue=None):
+        return self.info.get(queue)
+
+
+class Queue(object):
+    def __init__(self, i, wmsstatus, batchstatus):
+        self.apfqname = 'QUEUE_%05d' % i
+        self.wmsqueue = 'SITE_%05d' % i
+        self.qcl = Config()
+        self.qcl.add_section(self.apfqname)
+        self.qcl.set(self.apfqname, 'sched.scale.factor', '0.5')
+        self.qcl.set(self.apfqname, 'sched.maxpercycle.maximum', '100')
+        self.qcl.set(self.apfqname, 'sched.maxpending.maximum', '%d' % (50 + i % 50))
+        self.qcl.set(self.apfqname, 'sched.minpercycle.minimum', '0')
+        self.qcl.set(self.apfqname, 'sched.maxtorun.maximum', '2000')
+        self.wmsstatus_plugin = wmsstatus
+        self.batchstatus_plugin = batchstatus
+        wmsstatus.info[self.wmsqueue] = WMSQueueInfo.fromdicts([{'ready': i % 700}])
+        batchstatus.info[self.apfqname] = StateCounts({'pending': i % 60, 'running': i % 1500})
+        self.plugins = [plugin(self, self.qcl, self.apfqname) for plugin in [Ready, Scale, MaxPerCycle, MaxPending, MinPerCycle, MaxToRun]]
+        self.schedpipeline = schedpipeline.SchedPipeline(self, self.plugins)
+
+
+def runplugins(queues):
+    out = []
+    for queue in queues:
+        nsub = 0
+        fullmsg = ''
+        for plugin in queue.plugins:
+            (nsub, msg) = plugin.calcSubmitNum(nsub)
+            if msg:
+                fullmsg = '%s;%s' % (fullmsg, msg)
+        out.append(nsub)
+    return out
+
+
+def runpipeline(queues):
+    return [queue.schedpipeline.evaluate()[0] for queue in queues]
+
+
+def runfactory(queues):
+    return schedpipeline.evaluatemany([queue.schedpipeline for queue in queues])[0]
+
+
+def measure(run, queues, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        run(queues)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--nqueues', type='int', default=2000, help='number of queues')
+    parser.add_option('--repeat', type='int', default=5, help='runs per measurement, the best one is reported')
+    (options, args) = parser.parse_args()
+
+    # the plugins log every call
+    logging.getLogger('autopyfactory').addHandler(logging.NullHandler())
+    logging.getLogger('autopyfactory').propagate = False
+
+    wmsstatus = StatusPlugin()
+    batchstatus = StatusPlugin()
+    queues = [Queue(i, wmsstatus, batchstatus) for i in range(options.nqueues)]
+    assert runplugins(queues) == runpipeline(queues) == list(runfactory(queues))
+
+    print('%d queues, %d sched plugins each, numpy %s' % (options.nqueues, len(queues[0].plugins), schedpipeline.numpy is not None))
+    print('%-10s %12s' % ('method', 'time (ms)'))
+    for name, run in [('plugins', runplugins), ('pipeline', runpipeline), ('factory', runfactory)]:
+        print('%-10s %12.1f' % (name, measure(run, queues, options.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+#
+#
+
+import unittest
+
+from autopyfactory.adaptiveinterval import AdaptiveInterval, changefraction
+
+
+class TestAdaptiveInterval(unittest.TestCase):
+
+    def test_changefraction(self):
+        self.assertEqual(changefraction({'a': 10, 'b': 10}, {'a': 12, 'b': 8}), 0.2)
+        self.assertEqual(changefraction({}, {}), 0.0)
+        self.assertEqual(changefraction({}, {'a': 1}), 1.0)
+
+    def test_fixed(self):
+        poller = AdaptiveInterval('test', 150)
+        poller.update({'a': 1})
+        self.assertEqual(poller.update({'a': 1}), 150)
+        self.assertEqual(poller.update({'a': 100}), 150)
+
+    def test_backoff(self):
+        poller = AdaptiveInterval('test', 100, 50, 200)
+        self.assertEqual(poller.update({'a': 10}), 100)
+        self.assertEqual(poller.update({'a': 10}), 150)
+        self.assertEqual(poller.update({'a': 10}), 200)
+        self.assertEqual(poller.update({'a': 10}), 200)
+
+    def test_tighten(self):
+        poller = AdaptiveInterval('test', 100, 30, 200)
+        poller.update({'a': 10})
+        self.assertEqual(poller.update({'a': 20}), 50)
+        self.assertEqual(poller.update({'a': 40}), 30)
+        # small changes go back towards the base interval
+        self.assertEqual(poller.update({'a': 41}), 65)
+
+    def test_starved(self):
+        poller = AdaptiveInterval('test', 100, 50, 200)
+        poller.update({'a': 10})
+        self.assertEqual(poller.update({'a': 10}, starved=True), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
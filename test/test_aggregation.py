@@ -0,0 +1,47 @@
+#
+#
+
+import unittest
+
+from autopyfactory.aggregation import StatusAggregator, numpy
+from autopyfactory.info import StateCounts
+
+
+MAPPINGS = {'0': 'pending', '1': 'pending', '2': 'running', '3': 'done', '4': 'done', '5': 'pending', '6': 'running'}
+
+CLASSADS = [ {'match_apf_queue': 'q1', 'jobstatus': 1},
+             {'match_apf_queue': 'q1', 'jobstatus': 2},
+             {'match_apf_queue': 'q1', 'jobstatus': '2'},
+             {'match_apf_queue': 'q2', 'jobstatus': 4},
+             {'match_apf_queue': 'q2', 'jobstatus': 99},
+             {'jobstatus': 1},
+           ]
+
+
+class TestStatusAggregator(unittest.TestCase):
+
+    def test_counts(self):
+        counts = StatusAggregator(MAPPINGS, usenumpy=False).aggregate(CLASSADS)
+        self.assertEqual(sorted(counts.keys()), ['q1', 'q2'])
+        self.assertEqual(counts['q1'].pending, 1)
+        self.assertEqual(counts['q1'].running, 2)
+        self.assertEqual(counts['q1'].done, 0)
+        self.assertEqual(counts['q2'].done, 1)
+        self.assertEqual(counts['q2'].running, 0)
+
+    def test_empty(self):
+        self.assertEqual(StatusAggregator(MAPPINGS, usenumpy=False).aggregate([]), {})
+
+    def test_readonly(self):
+        counts = StatusAggregator(MAPPINGS, usenumpy=False).aggregate(CLASSADS)
+        self.assertRaises(AttributeError, setattr, counts['q1'], 'running', 0)
+        self.assertEqual(StateCounts().running, 0)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy(self):
+        self.assertEqual(StatusAggregator(MAPPINGS, usenumpy=True).aggregate(CLASSADS),
+                         StatusAggregator(MAPPINGS, usenumpy=False).aggregate(CLASSADS))
+
+
+if __name__ == '__main__':
+    unittest.main()
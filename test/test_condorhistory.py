@@ -0,0 +1,89 @@
+#
+#
+
+import unittest
+
+from autopyfactory.condorhistory import CondorHistory, finishtime
+
+
+class MockSchedd(object):
+    """
+    returns the records of each query in turn,
+    and keeps the constraints received
+    """
+    def __init__(self, results):
+        self.results = list(results)
+        self.constraints = []
+
+    def condor_history(self, attribute_l, constraint_l=None):
+        self.constraints.append(constraint_l)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def job(procid, entered, completion=0):
+    return {'clusterid': 10,
+            'procid': procid,
+            'enteredcurrentstatus': entered,
+            'completiondate': completion,
+           }
+
+
+class TestCondorHistory(unittest.TestCase):
+
+    def test_hwm(self):
+        schedd = MockSchedd([[job(0, 1000), job(1, 1100, 1200)],
+                             [],
+                            ])
+        history = CondorHistory(window=0)
+        history.update(schedd, ['clusterid'])
+        self.assertEqual(history.hwm, 1200)
+        history.update(schedd, ['clusterid'])
+        # first query is for all the history, the next only since the hwm
+        self.assertEqual(schedd.constraints[0], None)
+        self.assertEqual(schedd.constraints[1], ['EnteredCurrentStatus >= 1200 || CompletionDate >= 1200'])
+        self.assertEqual(history.hwm, 1200)
+
+    def test_dedup(self):
+        # the records at the hwm are returned again by the next query
+        schedd = MockSchedd([[job(0, 1000), job(1, 1200)],
+                             [job(1, 1200), job(2, 1300)],
+                            ])
+        history = CondorHistory(window=0)
+        history.update(schedd, ['clusterid'])
+        new = history.update(schedd, ['clusterid'])
+        self.assertEqual(len(new), 2)
+        procids = sorted([ca['procid'] for ca in history.records()])
+        self.assertEqual(procids, [0, 1, 2])
+
+    def test_failed_query(self):
+        schedd = MockSchedd([[job(0, 1000)], IOError('schedd down')])
+        history = CondorHistory(window=0)
+        history.update(schedd, ['clusterid'])
+        self.assertRaises(IOError, history.update, schedd, ['clusterid'])
+        self.assertEqual(history.hwm, 1000)
+        self.assertEqual(len(history.records()), 1)
+
+    def test_trim(self):
+        schedd = MockSchedd([[job(0, 1000), job(1, 5000), job(2, 1000, 5500)]])
+        history = CondorHistory(window=3600)
+        history.update(schedd, ['clusterid'])
+        history.trim(now=6000)
+        procids = sorted([ca['procid'] for ca in history.records()])
+        self.assertEqual(procids, [1, 2])
+        # the hwm does not go back
+        self.assertEqual(history.hwm, 5500)
+        # window 0 keeps everything
+        history.window = 0
+        history.trim(now=100000)
+        self.assertEqual(len(history.records()), 2)
+
+    def test_finishtime(self):
+        self.assertEqual(finishtime({'enteredcurrentstatus': '10', 'completiondate': 20}), 20)
+        self.assertEqual(finishtime({'enteredcurrentstatus': None}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
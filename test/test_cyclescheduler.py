@@ -0,0 +1,158 @@
+#
+#
+
+import threading
+import time
+import unittest
+
+import autopyfactory.cyclescheduler as cyclescheduler
+from autopyfactory.configloader import Config
+from autopyfactory.cyclescheduler import CycleScheduler
+from autopyfactory.interfaces import _publisher
+from autopyfactory.threadsmanagement import ThreadsRegistry
+
+
+class MockFactory(object):
+    def __init__(self):
+        self.threadsregistry = ThreadsRegistry()
+        self.fcl = Config()
+        self.fcl.add_section('Factory')
+        self.fcl.set('Factory', 'cyclescheduler.workers', '2')
+        self.fcl.set('Factory', 'cyclescheduler.recheck', '1')
+
+
+class MockStatusPlugin(_publisher):
+    def __init__(self):
+        self._initpublisher()
+
+
+class MockPipeline(object):
+    def __init__(self, compiled=True):
+        self.compiled = compiled
+
+
+class MockQueue(object):
+    def __init__(self, apfqname, sleep=0, ready=True, batchstatus_plugin=None):
+        self.apfqname = apfqname
+        self.sleep = sleep
+        self.ready = ready
+        self.stopevent = threading.Event()
+        self.cycles = 0
+        self.batchstatus_plugin = batchstatus_plugin
+        self.wmsstatus_plugin = None
+        self.schedpipeline = MockPipeline()
+        self.presetsched = None
+
+    def readyforcycle(self):
+        if self.batchstatus_plugin is not None:
+            return self.batchstatus_plugin.snapshotversion > 0
+        return self.ready
+
+    def runcycle(self):
+        self.cycles += 1
+        if self.cycles >= 3:
+            self.stopevent.set()
+
+
+class TestCycleScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = CycleScheduler(MockFactory())
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.join(5)
+
+    def _wait(self, f, timeout=5):
+        start = time.time()
+        while not f() and time.time() - start < timeout:
+            time.sleep(0.05)
+
+    def test_cycles_until_stopped(self):
+        queues = [MockQueue('q%d' % i) for i in range(20)]
+        for q in queues:
+            self.scheduler.add(q)
+        self._wait(lambda: all(q.stopevent.isSet() for q in queues))
+        for q in queues:
+            self.assertEqual(q.cycles, 3)
+        # a pool of workers, not a thread per queue
+        self.assertEqual(len(self.scheduler.workers), 2)
+
+    def test_not_ready_queue_waits(self):
+        q = MockQueue('waiting', ready=False)
+        self.scheduler.add(q)
+        time.sleep(0.3)
+        self.assertEqual(q.cycles, 0)
+        q.ready = True
+        self.scheduler.wakeup()
+        self._wait(lambda: q.cycles > 0)
+        self.assertTrue(q.cycles > 0)
+
+    def test_published_snapshot_wakes_waiting_queue(self):
+        plugin = MockStatusPlugin()
+        q = MockQueue('subscribed', batchstatus_plugin=plugin)
+        self.scheduler.add(q)
+        time.sleep(0.3)
+        self.assertEqual(q.cycles, 0)
+        # recheck interval is 1 second, publishing must be faster
+        plugin._publish()
+        self._wait(lambda: q.cycles > 0, timeout=0.5)
+        self.assertTrue(q.cycles > 0)
+        self.assertEqual(plugin.waitForSnapshot(0, timeout=0), 1)
+
+    def test_readyforcycle_unlocked(self):
+        owned = []
+        class CheckedQueue(MockQueue):
+            def readyforcycle(q):
+                # plugin code runs without the dispatcher lock
+                owned.append(self.scheduler.cond._is_owned())
+                return MockQueue.readyforcycle(q)
+        q = CheckedQueue('checked', ready=False)
+        self.scheduler.add(q)
+        self._wait(lambda: len(owned) > 0)
+        q.ready = True
+        self.scheduler.wakeup()
+        self._wait(lambda: q.cycles > 0)
+        self.assertTrue(q.cycles > 0)
+        self.assertTrue(len(owned) >= 2)
+        self.assertFalse(True in owned)
+
+    def test_presched(self):
+        scheduler = CycleScheduler(MockFactory())
+        scheduler.vectorized = True
+        calls = []
+        def evaluatemany(pipelines):
+            # plugin code runs without the dispatcher lock
+            calls.append((pipelines, scheduler.cond._is_owned()))
+            return ([1] * len(pipelines), ['trace'] * len(pipelines))
+        queues = [MockQueue('compiled%d' %i, sleep=3600) for i in range(2)]
+        queues.append(MockQueue('notcompiled', sleep=3600))
+        queues[-1].schedpipeline = MockPipeline(compiled=False)
+        cyclescheduler.evaluatemany, original = evaluatemany, cyclescheduler.evaluatemany
+        try:
+            # all due at once
+            for q in queues:
+                scheduler.add(q)
+            scheduler.start()
+            self._wait(lambda: all(q.cycles > 0 for q in queues))
+        finally:
+            cyclescheduler.evaluatemany = original
+            scheduler.join(5)
+        self.assertEqual(len(calls), 1)
+        (pipelines, owned) = calls[0]
+        self.assertFalse(owned)
+        self.assertEqual(pipelines, [q.schedpipeline for q in queues[:2]])
+        self.assertEqual(queues[0].presetsched, (1, 'trace'))
+        # the queue not compiled calls its plugins in its own cycle
+        self.assertEqual(queues[-1].presetsched, None)
+
+    def test_removed_queue_is_not_run(self):
+        q = MockQueue('removed', sleep=3600)
+        self.scheduler.add(q)
+        self._wait(lambda: q.cycles > 0)
+        self.scheduler.remove(q)
+        self.assertFalse(q in self.scheduler.queues)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#
+#
+
+import threading
+import time
+import unittest
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from autopyfactory.httpclient import HTTPClient, HTTPClientError
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        self.server.requests.append(self.client_address)
+        body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        if self.server.failures:
+            self.server.failures -= 1
+            code = 503
+        else:
+            code = 201
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.close:
+            self.close_connection = 1
+
+    do_GET = do_PUT
+    do_POST = do_PUT
+
+    def log_message(self, *k):
+        pass
+
+
+class MockServer(HTTPServer):
+
+    def handle_error(self, request, client_address):
+        # the client gave up waiting
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer(('127.0.0.1', 0), MockHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.delay = 0
+        self.server.close = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/api/jobs' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keepalive(self):
+        client = HTTPClient('test-keepalive', maxconnections=1, timeout=5, retries=0)
+        for i in range(3):
+            out = client.request('PUT', self.url, '[%d]' % i)
+            self.assertEqual(out.status, 201)
+            self.assertEqual(out.read(), '[%d]' % i)
+        # all requests were sent over the same connection
+        self.assertEqual(len(set(self.server.requests)), 1)
+        client.close()
+
+    def test_retry(self):
+        self.server.failures = 2
+        client = HTTPClient('test-retry', timeout=5, retries=2, backoff=0)
+        out = client.request('GET', self.url)
+        self.assertEqual(out.status, 201)
+        self.assertEqual(len(self.server.requests), 3)
+        client.close()
+
+    def test_noretry(self):
+        # POST and PUT are only retried if the caller asks for it
+        self.server.failures = 2
+        client = HTTPClient('test-noretry', timeout=5, retries=2, backoff=0)
+        out = client.request('POST', self.url, 'x')
+        self.assertEqual(out.status, 503)
+        self.assertEqual(len(self.server.requests), 1)
+        out = client.request('PUT', self.url, 'x', retry=True)
+        self.assertEqual(out.status, 201)
+        self.assertEqual(len(self.server.requests), 3)
+        client.close()
+
+    def test_timeout(self):
+        # the server may have processed it: not sent again
+        self.server.delay = 2
+        client = HTTPClient('test-timeout', timeout=1, retries=2, backoff=0)
+        self.assertRaises(HTTPClientError, client.request, 'GET', self.url)
+        time.sleep(1.5)
+        self.assertEqual(len(self.server.requests), 1)
+        client.close()
+
+    def test_stale(self):
+        client = HTTPClient('test-stale', maxconnections=1, timeout=5, retries=0)
+        client.request('POST', self.url, 'x')
+        # the server closes the idle connection
+        for pool in client.pools.values():
+            for conn in pool.idle:
+                conn.sock.shutdown(2)
+        out = client.request('POST', self.url, 'y')
+        self.assertEqual(out.status, 201)
+        self.assertEqual(len(self.server.requests), 2)
+        client.close()
+
+    def test_shared(self):
+        self.assertTrue(HTTPClient('test-shared') is HTTPClient('test-shared'))
+
+    def test_unreachable(self):
+        client = HTTPClient('test-unreachable', timeout=1, retries=1, backoff=0)
+        self.assertRaises(HTTPClientError, client.request, 'GET', 'http://127.0.0.1:1/')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#
+#
+
+import unittest
+
+from autopyfactory.info import BatchStatusInfo, WMSQueueInfo, QueueInfo, SiteInfo, MappingTable
+
+
+class TestCountsRecord(unittest.TestCase):
+
+    def test_defaults(self):
+        qi = WMSQueueInfo()
+        self.assertEqual(qi.ready, 0)
+        self.assertEqual(qi.somethingelse, 0)
+        self.assertEqual(QueueInfo().pending, 0)
+        self.assertEqual(BatchStatusInfo()['q1'].getraw(), {})
+
+    def test_fromdicts(self):
+        mappings = {'activated': 'ready', 'running': 'running', 'holding': 'running'}
+        labels = [{'activated': 3, 'running': 2},
+                  {'activated': 1, 'holding': 4, 'nomapping': 7}]
+        qi = WMSQueueInfo.fromdicts(labels, mappings)
+        self.assertEqual(qi.ready, 4)
+        self.assertEqual(qi.running, 6)
+        self.assertEqual(qi.nomapping, 0)
+
+    def test_extra(self):
+        qi = WMSQueueInfo.fromdicts([{'ready': 1, 'throttled': 2}])
+        self.assertEqual(qi.throttled, 2)
+        raw = qi.getraw()
+        self.assertEqual(raw['ready'], 1)
+        self.assertEqual(raw['throttled'], 2)
+        self.assertFalse(hasattr(qi, '__dict__'))
+
+    def test_mappingtable(self):
+        table = MappingTable({'activated': 'ready', 'holding': 'running', 'weird': 'other'}, WMSQueueInfo.states)
+        self.assertEqual(table.states[:6], WMSQueueInfo.states)
+        self.assertEqual(table.states[table.index['weird']], 'other')
+        unknown = set()
+        qi = WMSQueueInfo.fromdicts([{'activated': 2, 'weird': 1, 'new': 5}], table, unknown)
+        self.assertEqual(qi.ready, 2)
+        self.assertEqual(qi.other, 1)
+        self.assertEqual(unknown, set(['new']))
+
+
+class TestFill(unittest.TestCase):
+
+    def test_fill(self):
+        si = SiteInfo()
+        si.fill({'status': 'online', 'nqueue': 10})
+        self.assertEqual(si.status, 'online')
+        self.assertEqual(si.nqueue, 10)
+
+    def test_fill_mappings(self):
+        si = SiteInfo()
+        unknown = set()
+        mappings = {'a': 'x', 'b': 'x', 'c': 'y'}
+        si.fill({'a': 1, 'b': 2, 'c': 3, 'd': 4}, mappings=mappings, unknown=unknown)
+        self.assertEqual(si.x, 3)
+        self.assertEqual(si.y, 3)
+        self.assertEqual(unknown, set(['d']))
+        # reset=False adds to the previous values
+        si.fill({'a': 1, 'c': 1}, mappings=MappingTable(mappings), reset=False)
+        self.assertEqual(si.x, 4)
+        self.assertEqual(si.y, 4)
+        # reset=True overrides them
+        si.fill({'a': 1}, mappings=mappings)
+        self.assertEqual(si.x, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
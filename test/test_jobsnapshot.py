@@ -0,0 +1,43 @@
+#
+#
+
+import unittest
+
+from autopyfactory.jobsnapshot import JobSnapshot
+
+
+class TestJobSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        classad_l = [ {'match_apf_queue': 'q1', 'clusterid': 10, 'procid': 0, 'qdate': 300, 'ec2instancename': 'i-1'},
+                      {'match_apf_queue': 'q2', 'clusterid': 11, 'procid': 0, 'qdate': 100},
+                      {'match_apf_queue': 'q1', 'clusterid': 12, 'procid': 1, 'qdate': '200'},
+                      {'clusterid': 13, 'procid': 0, 'qdate': 50},
+                    ]
+        attribute_l = ['match_apf_queue', 'clusterid', 'procid', 'qdate', 'ec2instancename']
+        self.snapshot = JobSnapshot(classad_l, attribute_l)
+
+    def test_index(self):
+        self.assertEqual(self.snapshot.keys(), ['q1', 'q2'])
+        self.assertEqual(self.snapshot.njobs(), 3)
+        self.assertEqual(self.snapshot.njobs('q1'), 2)
+        self.assertEqual(self.snapshot.njobs('q3'), 0)
+        self.assertEqual(self.snapshot['q3'], [])
+
+    def test_columns(self):
+        self.assertEqual(list(self.snapshot.column('q1', 'qdate')), [300, 200])
+        self.assertEqual(self.snapshot.column('q2', 'ec2instancename'), [None])
+
+    def test_rows(self):
+        jobinfo = self.snapshot['q1']
+        jobinfo.sort(key = lambda x: x.qdate)
+        j = jobinfo.pop()
+        self.assertEqual("%s.%s" % (j.clusterid, j.procid), "10.0")
+        self.assertEqual(j.ec2instancename, 'i-1')
+        self.assertRaises(AttributeError, getattr, j, 'executeinfo')
+        # the snapshot itself is not modified
+        self.assertEqual(len(self.snapshot['q1']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
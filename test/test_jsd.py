@@ -0,0 +1,66 @@
+#
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from autopyfactory.jsd import JSDFile, JSDTemplate
+
+
+def addJSD(jsdfile, logdir, logurl):
+    """
+    the lines CondorBase._addJSD() adds using the log directory and URL
+    """
+    jsdfile.add("Dir", "%s/" % logdir)
+    jsdfile.add('+MATCH_APF_QUEUE', '"%s"' % 'ANALY_TEST-condor')
+    jsdfile.add('+APF_LOGURL', '"%s/$(Cluster).$(Process).log"' % logurl)
+    jsdfile.add('+APF_OUTURL', '"%s/$(Cluster).$(Process).out"' % logurl)
+    jsdfile.add("executable", "/usr/libexec/wrapper.sh")
+    jsdfile.add("output", "$(Dir)/$(Cluster).$(Process).out")
+    jsdfile.add("transfer_executable", "True")
+    jsdfile.add("+Owner = undefined")
+    return jsdfile
+
+
+class TestJSDTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.template = JSDTemplate(addJSD(JSDFile(), JSDTemplate.LOGDIR_TOKEN, JSDTemplate.LOGURL_TOKEN))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def jsdfile(self, logdir, logurl, n):
+        """
+        content of the submit file written as before the templates
+        """
+        jsdfile = addJSD(JSDFile(), logdir, logurl)
+        jsdfile.add("queue %d" % n)
+        return open(jsdfile.write(self.tmpdir, 'submit.jdl')).read()
+
+    def test_same_as_jsdfile(self):
+        logdir = '/var/log/apf/2026-10-18/ANALY_TEST-condor'
+        logurl = 'http://apf.example.org:25880/2026-10-18/ANALY_TEST-condor'
+        self.assertEqual(self.template.render(logdir, logurl, 5), self.jsdfile(logdir, logurl, 5))
+        # without the queue line
+        self.assertEqual(self.template.render(logdir, logurl) + 'queue 5\n', self.jsdfile(logdir, logurl, 5))
+
+    def test_date_dir(self):
+        text = self.template.render('/logs/2026-10-18/q', 'http://h/2026-10-18/q', 1)
+        self.assertTrue('Dir = /logs/2026-10-18/q/' in text)
+        self.assertTrue('+APF_LOGURL = "http://h/2026-10-18/q/$(Cluster).$(Process).log"' in text)
+        rendered = self.template.rendered
+        self.template.render('/logs/2026-10-18/q', 'http://h/2026-10-18/q', 2)
+        # rendered again only when the date directory changes
+        self.assertTrue(self.template.rendered is rendered)
+        text = self.template.render('/logs/2026-10-19/q', 'http://h/2026-10-19/q', 1)
+        self.assertEqual(text, self.jsdfile('/logs/2026-10-19/q', 'http://h/2026-10-19/q', 1))
+        self.assertFalse('2026-10-18' in text)
+        self.assertFalse('@@' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
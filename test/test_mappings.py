@@ -0,0 +1,45 @@
+#
+#
+
+import StringIO
+import unittest
+
+from autopyfactory.configloader import Config
+from autopyfactory.mappings import MappingsRegistry
+
+
+def getConfig(text):
+    config = Config()
+    config.readfp(StringIO.StringIO(text))
+    return config
+
+
+class TestMappingsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MappingsRegistry()
+        self.registry.update(getConfig('[JOBSTATUS2INFO]\n1 = pending\n2 = running\n'))
+
+    def test_get(self):
+        mappings = self.registry.get('JOBSTATUS2INFO')
+        self.assertEqual(mappings, {'1': 'pending', '2': 'running'})
+        self.assertTrue(self.registry.get('JOBSTATUS2INFO') is mappings)
+        self.assertRaises(TypeError, mappings.__setitem__, '3', 'done')
+        self.assertRaises(KeyError, self.registry.get, 'NOSECTION')
+
+    def test_table(self):
+        table = self.registry.table('JOBSTATUS2INFO', ['pending', 'running'])
+        self.assertTrue(self.registry.table('JOBSTATUS2INFO', ['pending', 'running']) is table)
+
+    def test_reload(self):
+        mappings = self.registry.get('JOBSTATUS2INFO')
+        table = self.registry.table('JOBSTATUS2INFO')
+        self.registry.update(getConfig('[JOBSTATUS2INFO]\n1 = pending\n2 = done\n'))
+        self.assertEqual(self.registry.version, 2)
+        self.assertFalse(self.registry.get('JOBSTATUS2INFO') is mappings)
+        self.assertFalse(self.registry.table('JOBSTATUS2INFO') is table)
+        self.assertEqual(self.registry.get('JOBSTATUS2INFO')['2'], 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
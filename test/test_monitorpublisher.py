@@ -0,0 +1,98 @@
+#
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from autopyfactory.monitorpublisher import MonitorPublisher
+from autopyfactory.threadsmanagement import ThreadsRegistry
+
+
+class MockSender(object):
+    def __init__(self):
+        self.jobs = []
+        self.labels = []
+        self.ok = True
+
+    def sendJobs(self, jobs):
+        if self.ok:
+            self.jobs.append(jobs)
+        return self.ok
+
+    def sendLabel(self, label, msg):
+        if self.ok:
+            self.labels.append((label, msg))
+        return self.ok
+
+
+def jobs(label, n, first=0):
+    return [{'cid': '%d.0' % i, 'label': label, 'factory': 'f'} for i in range(first, first + n)]
+
+
+class TestMonitorPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = MockSender()
+        self.publisher = MonitorPublisher('test', self.sender, ThreadsRegistry(), batchsize=3, maxsize=5)
+
+    def test_batches(self):
+        self.publisher.addJobs(jobs('q1', 2))
+        self.publisher.addJobs(jobs('q2', 2))
+        self.publisher.flush()
+        self.assertEqual([len(batch) for batch in self.sender.jobs], [3, 1])
+        self.assertEqual(self.publisher.getMetrics()['jobs_sent'], 4)
+
+    def test_coalesce(self):
+        self.publisher.setLabel('q1', 'old')
+        self.publisher.setLabel('q2', 'msg')
+        self.publisher.setLabel('q1', 'new')
+        self.publisher.flush()
+        self.assertEqual(sorted(self.sender.labels), [('q1', 'new'), ('q2', 'msg')])
+        self.assertEqual(self.publisher.getMetrics()['labels_coalesced'], 1)
+
+    def test_drop_oldest(self):
+        self.publisher.addJobs(jobs('q1', 7))
+        metrics = self.publisher.getMetrics()
+        self.assertEqual(metrics['jobs_dropped'], 2)
+        self.assertEqual(metrics['jobs_pending'], 5)
+        self.publisher.flush()
+        self.assertEqual(self.sender.jobs[0][0]['cid'], '2.0')
+
+    def test_requeue(self):
+        self.sender.ok = False
+        self.publisher.addJobs(jobs('q1', 2))
+        self.publisher.setLabel('q1', 'old')
+        self.publisher.flush()
+        self.publisher.setLabel('q1', 'new')
+        self.publisher.addJobs(jobs('q1', 1, first=2))
+        self.sender.ok = True
+        self.publisher.flush()
+        self.assertEqual([job['cid'] for job in self.sender.jobs[0]], ['0.0', '1.0', '2.0'])
+        self.assertEqual(self.sender.labels, [('q1', 'new')])
+
+    def test_spool(self):
+        spooldir = tempfile.mkdtemp()
+        try:
+            spoolfile = os.path.join(spooldir, 'sub', 'test.json')
+            self.sender.ok = False
+            publisher = MonitorPublisher('test', self.sender, ThreadsRegistry(), spoolfile=spoolfile)
+            publisher.addJobs(jobs('q1', 2))
+            publisher.setLabel('q1', 'msg')
+            publisher._postrun()
+            self.assertTrue(os.path.isfile(spoolfile))
+
+            self.sender.ok = True
+            publisher = MonitorPublisher('test', self.sender, ThreadsRegistry(), spoolfile=spoolfile)
+            publisher._prerun()
+            self.assertFalse(os.path.isfile(spoolfile))
+            publisher.flush()
+            self.assertEqual(len(self.sender.jobs[0]), 2)
+            self.assertEqual(self.sender.labels, [('q1', 'msg')])
+        finally:
+            shutil.rmtree(spooldir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#
+#
+
+import logging
+import threading
+import unittest
+
+from Queue import Queue
+
+from autopyfactory.adaptiveinterval import AdaptiveInterval
+from autopyfactory.info import WMSStatusInfo, WMSQueueInfo
+from autopyfactory.interfaces import _publisher
+from autopyfactory.plugins.queue.wmsstatus.Panda import _panda
+
+
+class MockAPFQueue(object):
+    def __init__(self, wmsqueue=None, factory=None):
+        self.wmsqueue = wmsqueue
+        self.factory = factory
+
+
+class MockAPFQueuesManager(object):
+    def __init__(self, wmsqueues):
+        self.queues = dict([('q%d' %i, MockAPFQueue(wmsqueue)) for i, wmsqueue in enumerate(wmsqueues)])
+
+
+class MockFactory(object):
+    def __init__(self, wmsqueues):
+        self.apfqueuesmanager = MockAPFQueuesManager(wmsqueues)
+
+
+def makeplugin():
+    """
+    a Panda wmsstatus plugin with only what the fetch workers need,
+    without contacting any server
+    """
+    plugin = _panda.__new__(_panda)
+    _publisher._initpublisher(plugin)
+    plugin.log = logging.getLogger('autopyfactory.wmsstatus.test')
+    plugin.pollinterval = AdaptiveInterval('test', 60, 30, 120)
+    plugin._thread_loop_interval = 60
+    plugin.currentjobinfo = None
+    plugin.currentsiteinfo = None
+    plugin.currentcloudinfo = None
+    plugin.refreshed = {'jobs': 0, 'sites': 0, 'clouds': 0}
+    plugin.fetchlock = threading.Lock()
+    plugin.inflight = {}
+    plugin.metrics = {'jobs': {'last_duration': 0.0, 'last_success': 0, 'queries': 0, 'failures': 0, 'late': 0}}
+    return plugin
+
+
+def makejobinfo(ready):
+    jobinfo = WMSStatusInfo()
+    jobinfo['SITE_A'] = WMSQueueInfo.fromdicts([{'ready': ready, 'running': 10}])
+    return jobinfo
+
+
+class TestPandaSwap(unittest.TestCase):
+
+    def test_swap_jobs(self):
+        plugin = makeplugin()
+        plugin._swap('jobs', makejobinfo(0))
+        self.assertEqual(plugin.snapshotversion, 1)
+        self.assertEqual(plugin.pollinterval.counts[('SITE_A', 'running')], 10)
+        # the site just got ready jobs: starved
+        plugin._swap('jobs', makejobinfo(5))
+        self.assertEqual(plugin.snapshotversion, 2)
+        self.assertEqual(plugin.currentjobinfo['SITE_A'].ready, 5)
+        self.assertEqual(plugin._thread_loop_interval, 30)
+
+    def test_swap_unchanged_specs(self):
+        plugin = makeplugin()
+        siteinfo = WMSStatusInfo()
+        siteinfo.version = 1
+        plugin._swap('sites', siteinfo)
+        self.assertEqual(plugin.snapshotversion, 1)
+        siteinfo.lasttime = 1000
+        plugin.refreshed['sites'] = 1000
+        # the specs did not change: the same snapshot is returned
+        plugin._swap('sites', siteinfo)
+        self.assertEqual(plugin.snapshotversion, 1)
+        self.assertEqual(siteinfo.lasttime, 1000)
+        self.assertTrue(plugin.getSnapshotAge('sites') < 5)
+        self.assertTrue(plugin.currentsiteinfo is siteinfo)
+
+    def test_fetchwork_releases_source(self):
+        plugin = makeplugin()
+        plugin.fetchqueue = Queue()
+        def _fetch(source):
+            raise Exception('query failed')
+        plugin._fetch = _fetch
+        done = plugin._startfetch('jobs')
+        plugin.fetchqueue.put(None)
+        plugin._fetchwork()
+        self.assertTrue(done.is_set())
+        self.assertEqual(plugin.inflight, {})
+        self.assertEqual(plugin.metrics['jobs']['failures'], 1)
+
+
+class TestPandaWMSQueues(unittest.TestCase):
+
+    def test_wmsqueues(self):
+        plugin = makeplugin()
+        plugin.apfqueue = MockAPFQueue(factory=MockFactory(['SITE_A', 'SITE_B', 'SITE_A', None]))
+        self.assertEqual(plugin._wmsqueues(), set(['SITE_A', 'SITE_B']))
+        # no APFQueuesManager yet: nothing is filtered
+        plugin.apfqueue = MockAPFQueue(factory=object())
+        self.assertEqual(plugin._wmsqueues(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#
+#
+
+import gzip
+import json
+import pickle
+import unittest
+
+from StringIO import StringIO
+
+import autopyfactory.external.panda.Client as Client
+from autopyfactory.httpclient import HTTPClientError, HTTPResult
+
+
+class MockHTTPClient(object):
+    """
+    replaces HTTPClient in the PanDA client.
+    Returns the responses queued, and keeps the requests received
+    """
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        self.options = []
+
+    def __call__(self, name, **kw):
+        self.options.append((name, kw))
+        return self
+
+    def request(self, method, url, body, headers):
+        self.requests.append((method, url, body, dict(headers)))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def response(content, status=200, headers=None):
+    headers = dict(headers or {})
+    headers.setdefault('content-type', 'application/json')
+    return HTTPResult(status, 'OK', headers.items(), json.dumps(content))
+
+
+def gzipped(text):
+    out = StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(text)
+    f.close()
+    return out.getvalue()
+
+
+class TestPandaClient(unittest.TestCase):
+
+    def setUp(self):
+        self.httpclient = MockHTTPClient()
+        self.original = Client.HTTPClient
+        Client.HTTPClient = self.httpclient
+        Client.setTransport()
+        Client.setDecoders(['json'])
+
+    def tearDown(self):
+        Client.HTTPClient = self.original
+        Client.setTransport()
+        Client.setDecoders(['json'])
+
+    # ------------------------------------------------------------------
+    #   transport
+    # ------------------------------------------------------------------
+
+    def test_transport(self):
+        Client.setTransport(timeout=5, retries=1, backoff=0, maxconnections=2)
+        self.httpclient.responses.append(response({'SITE_A': {'managed': {'running': 1}}}))
+        status, out = Client.getJobStatisticsWithLabel()
+        self.assertEqual(status, 0)
+        self.assertEqual(out, {'SITE_A': {'managed': {'running': 1}}})
+        (name, options) = self.httpclient.options[0]
+        self.assertEqual(options['timeout'], 5)
+        self.assertEqual(options['retries'], 1)
+        self.assertEqual(options['backoff'], 0)
+        self.assertEqual(options['maxconnections'], 2)
+        (method, url, body, headers) = self.httpclient.requests[0]
+        self.assertEqual(method, 'GET')
+        self.assertTrue(url.endswith('/getJobStatisticsWithLabel'))
+        self.assertEqual(headers['Accept-Encoding'], 'gzip')
+
+    def test_certificate(self):
+        curl = Client._Curl()
+        curl.sslCert = curl.sslKey = '/tmp/x509up_test'
+        self.httpclient.responses.append(response([]))
+        curl.get('https://panda.example.org/server/panda/getSiteSpecs', {})
+        (name, options) = self.httpclient.options[0]
+        self.assertEqual(name, 'panda:/tmp/x509up_test:/tmp/x509up_test')
+        self.assertEqual(options['certfile'], '/tmp/x509up_test')
+        self.assertEqual(options['verify'], False)
+
+    def test_gzip(self):
+        self.httpclient.responses.append(HTTPResult(200, 'OK', [('content-encoding', 'gzip'), ('content-type', 'application/json')],
+                                                    gzipped(json.dumps({'SITE_A': {}}))))
+        self.assertEqual(Client.getJobStatisticsWithLabel(), (0, {'SITE_A': {}}))
+
+    def test_errors(self):
+        # same return values as the curl commands
+        self.httpclient.responses.append(HTTPResult(500, 'Internal Server Error', [], 'boom'))
+        status, out = Client._Curl().get('http://panda.example.org/server/panda/getCloudSpecs', {})
+        self.assertEqual((status, out), ((500 % 255, 'boom'), 'boom'))
+        self.httpclient.responses.append(HTTPClientError('connection refused'))
+        status, out = Client.getCloudSpecs()
+        self.assertEqual(status, Client.EC_Failed)
+        self.assertTrue('connection refused' in out)
+
+    # ------------------------------------------------------------------
+    #   conditional fetch
+    # ------------------------------------------------------------------
+
+    def test_etag(self):
+        self.httpclient.responses.append(response({'US': {}}, headers={'etag': '"v1"', 'last-modified': 'Sun, 18 Oct 2026 10:00:00 GMT'}))
+        status, out, validators = Client.getCloudSpecsIfModified()
+        self.assertEqual(out, {'US': {}})
+        self.assertEqual(validators['etag'], '"v1"')
+        self.httpclient.responses.append(HTTPResult(304, 'Not Modified', [], ''))
+        status, out, validators = Client.getCloudSpecsIfModified(validators)
+        self.assertEqual((status, out), (0, None))
+        # the validators of the first response are kept
+        self.assertEqual(validators['etag'], '"v1"')
+        (method, url, body, headers) = self.httpclient.requests[1]
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(headers['If-Modified-Since'], 'Sun, 18 Oct 2026 10:00:00 GMT')
+
+    def test_hash(self):
+        # servers without ETag nor Last-Modified
+        self.httpclient.responses.append(response({'SITE_A': {'status': 'online'}}))
+        status, out, validators = Client.getSiteSpecsIfModified(siteType='all')
+        self.assertEqual(out, {'SITE_A': {'status': 'online'}})
+        self.assertTrue('siteType=all' in self.httpclient.requests[0][1])
+        self.httpclient.responses.append(response({'SITE_A': {'status': 'online'}}))
+        status, out, validators = Client.getSiteSpecsIfModified(siteType='all', validators=validators)
+        self.assertEqual((status, out), (0, None))
+        self.httpclient.responses.append(response({'SITE_A': {'status': 'offline'}}))
+        status, out, validators = Client.getSiteSpecsIfModified(siteType='all', validators=validators)
+        self.assertEqual(out, {'SITE_A': {'status': 'offline'}})
+
+    # ------------------------------------------------------------------
+    #   wmsqueue filter
+    # ------------------------------------------------------------------
+
+    def test_site_filter(self):
+        self.httpclient.responses.append(response({}))
+        Client.getJobStatisticsWithLabel(site='SITE_A,SITE_B')
+        (method, url, body, headers) = self.httpclient.requests[0]
+        self.assertTrue(url.endswith('/getJobStatisticsWithLabel?site=SITE_A%2CSITE_B'))
+
+    # ------------------------------------------------------------------
+    #   decoders
+    # ------------------------------------------------------------------
+
+    def test_json(self):
+        self.httpclient.responses.append(response({'SITE_A': {}}))
+        Client.getJobStatisticsWithLabel()
+        (method, url, body, headers) = self.httpclient.requests[0]
+        self.assertEqual(headers['Accept'], 'application/json')
+        # JSON without the right Content-Type is still recognized
+        self.httpclient.responses.append(HTTPResult(200, 'OK', [('content-type', 'text/plain')], ' {"SITE_A": {}}'))
+        self.assertEqual(Client.getJobStatisticsWithLabel(), (0, {'SITE_A': {}}))
+
+    def test_pickle_disabled(self):
+        self.httpclient.responses.append(HTTPResult(200, 'OK', [('content-type', 'text/plain')], pickle.dumps({'SITE_A': {}})))
+        status, out = Client.getJobStatisticsWithLabel()
+        self.assertEqual(status, Client.EC_Failed)
+
+    def test_pickle_enabled(self):
+        Client.setDecoders(['json', 'pickle'])
+        self.httpclient.responses.append(HTTPResult(200, 'OK', [('content-type', 'text/plain')], pickle.dumps({'SITE_A': {}})))
+        self.assertEqual(Client.getJobStatisticsWithLabel(), (0, {'SITE_A': {}}))
+        (method, url, body, headers) = self.httpclient.requests[0]
+        self.assertEqual(headers['Accept'], 'application/json, */*;q=0.5')
+        self.assertRaises(ValueError, Client.setDecoders, ['yaml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
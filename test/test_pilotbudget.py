@@ -0,0 +1,98 @@
+#
+#
+
+import time
+import unittest
+
+from autopyfactory.configloader import Config
+from autopyfactory.info import StateCounts
+from autopyfactory.pilotbudget import PilotBudget, waterfill
+from autopyfactory.statuscache import StatusCache, StatusSnapshot
+
+
+class MockFactory(object):
+    def __init__(self, maximum):
+        self.fcl = Config()
+        self.fcl.add_section('Factory')
+        self.fcl.set('Factory', 'maxperfactory.maximum', str(maximum))
+
+
+class TestWaterfill(unittest.TestCase):
+
+    def test_enough(self):
+        self.assertEqual(waterfill({'a': 3, 'b': 5}, 10), {'a': 3, 'b': 5})
+        self.assertEqual(waterfill({'a': 3, 'b': 5}, None), {'a': 3, 'b': 5})
+
+    def test_maxmin(self):
+        self.assertEqual(waterfill({'a': 2, 'b': 10, 'c': 10}, 12), {'a': 2, 'b': 5, 'c': 5})
+        self.assertEqual(sorted(waterfill({'a': 10, 'b': 10, 'c': 0}, 7).values()), [0, 3, 4])
+        self.assertEqual(sum(waterfill({'a': 10, 'b': 10, 'c': 10}, 7).values()), 7)
+        self.assertEqual(waterfill({'a': 5}, 0), {'a': 0})
+
+    def test_weights(self):
+        self.assertEqual(waterfill({'a': 100, 'b': 100}, 30, {'a': 2, 'b': 1}), {'a': 20, 'b': 10})
+        self.assertEqual(waterfill({'a': 5, 'b': 100}, 30, {'a': 2, 'b': 1}), {'a': 5, 'b': 25})
+
+
+class TestPilotBudget(unittest.TestCase):
+
+    def setUp(self):
+        StatusCache.instance = None
+        self.statuscache = StatusCache()
+        self.budget = PilotBudget(MockFactory(100))
+
+    def tearDown(self):
+        # the StatusCache is process-wide
+        StatusCache.instance = None
+
+    def put(self, pending, running, wmsqueue_d=None, timestamp=None):
+        counts_d = {'q1': StateCounts({'pending': pending, 'running': running})}
+        self.statuscache.put('schedd', StatusSnapshot(counts_d, wmsqueue_d or {'q1': 'SITE_A'}, timestamp=timestamp))
+
+    def test_no_info(self):
+        self.assertEqual(self.budget.grant('q1', 10), None)
+        self.assertEqual(self.budget.grant('q1', -3), -3)
+
+    def test_never_overshoots(self):
+        self.put(20, 60)
+        # nobody asked in the first round, the budget is all spare
+        self.assertEqual(self.budget.grant('q1', 15), 15)
+        self.assertEqual(self.budget.grant('q2', 15), 5)
+        self.assertEqual(self.budget.grant('q3', 15), 0)
+        # new round, shared among the last requests.
+        # The pilots granted are not in the batch system yet
+        self.put(20, 60, timestamp=int(time.time()) + 1)
+        self.budget.allocate()
+        self.assertEqual(self.budget.grants, {'q1': 7, 'q2': 7, 'q3': 6})
+        self.assertEqual(sum([self.budget.grant(q, 15) for q in ['q3', 'q2', 'q1']]), 20)
+
+    def test_unobserved(self):
+        self.put(20, 60, timestamp=int(time.time()) - 10)
+        self.assertEqual(self.budget.grant('q1', 15), 15)
+        # another schedd publishes, but the first one 
+        # has not been queried since the pilots were granted
+        self.statuscache.put('schedd2', StatusSnapshot({'q9': StateCounts({'running': 5})}))
+        self.budget.allocate()
+        self.assertEqual(self.budget.grant('q1', 15), 0)
+        self.assertEqual(self.budget.grant('q2', 15), 0)
+        # now they are
+        self.put(35, 60, timestamp=int(time.time()) + 1)
+        self.budget.allocate()
+        self.assertEqual(self.budget.handedout, [])
+        self.assertEqual(sum([self.budget.grant(q, 15) for q in ['q1', 'q2']]), 0)
+
+    def test_wmsqueue_maximum(self):
+        self.put(0, 0)
+        self.budget.grant('q1', 50, wmsqueue='SITE_A', wmsmax=10)
+        self.budget.grant('q2', 50, wmsqueue='SITE_A', wmsmax=10)
+        self.budget.grant('q3', 50, wmsqueue='SITE_B')
+        self.put(0, 4, timestamp=int(time.time()) + 1)
+        self.budget.allocate()
+        self.assertEqual(self.budget.grants, {'q1': 3, 'q2': 3, 'q3': 50})
+        self.assertEqual(self.budget.grant('q1', 50, wmsqueue='SITE_A', wmsmax=10), 3)
+        self.assertEqual(self.budget.grant('q2', 50, wmsqueue='SITE_A', wmsmax=10), 3)
+        self.assertEqual(self.budget.grant('q3', 50, wmsqueue='SITE_B'), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
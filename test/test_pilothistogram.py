@@ -0,0 +1,83 @@
+#
+#
+
+import time
+import unittest
+
+from autopyfactory.configloader import Config
+from autopyfactory.pilothistogram import PilotHistogram
+from autopyfactory.plugins.queue.sched.Throttle import Throttle
+
+
+class MockQueue(object):
+    def __init__(self, apfqname, interval, historywindow):
+        self.apfqname = apfqname
+        self.qcl = Config()
+        self.qcl.add_section(apfqname)
+        self.qcl.set(apfqname, 'sched.throttle.interval', str(interval))
+        self.fcl = Config()
+        self.fcl.add_section('Factory')
+        self.fcl.set('Factory', 'batchstatus.condor.history.window', str(historywindow))
+
+
+def pilot(queue, procid, started, wallclock):
+    return {'match_apf_queue': queue,
+            'clusterid': 1,
+            'procid': procid,
+            'jobstartdate': int(time.time()) - started,
+            'remotewallclocktime': wallclock,
+           }
+
+
+class TestPilotHistogram(unittest.TestCase):
+
+    def setUp(self):
+        PilotHistogram.instance = None
+        self.histogram = PilotHistogram()
+        self.histogram.watch('q1', 3600, 10)
+
+    def test_counts(self):
+        self.assertEqual(self.histogram.get('q1'), (0, 0))
+        self.assertEqual(self.histogram.get('q2'), None)
+        self.histogram.feed('s1', [pilot('q1', 0, 100, 5),
+                                   pilot('q1', 1, 200, 500),
+                                   pilot('q1', 2, 7200, 5),
+                                   pilot('q2', 3, 100, 5),
+                                   {'match_apf_queue': 'q1', 'clusterid': 1, 'procid': 4},
+                                  ], replay=True)
+        self.assertEqual(self.histogram.get('q1'), (2, 1))
+
+    def test_no_double_counting(self):
+        self.histogram.feed('s1', [pilot('q1', 0, 100, 5)], replay=True)
+        self.histogram.feed('s1', [pilot('q1', 0, 100, 5), pilot('q1', 1, 100, 50)])
+        self.histogram.feed('s2', [pilot('q1', 0, 100, 5)], replay=True)
+        self.assertEqual(self.histogram.get('q1'), (3, 2))
+
+    def test_expire(self):
+        self.histogram.feed('s1', [pilot('q1', 0, 100, 5), pilot('q1', 1, 3000, 5)], replay=True)
+        queue = self.histogram.queues['q1']
+        queue.expire(time.time() + 1200)
+        self.assertEqual((queue.total, queue.short), (1, 1))
+        self.assertEqual(len(queue.seen), 1)
+        queue.expire(time.time() + 86400)
+        self.assertEqual((queue.total, queue.short, queue.buckets), (0, 0, {}))
+
+    def test_replay(self):
+        self.histogram.feed('s1', [], replay=True)
+        self.assertFalse(self.histogram.needsreplay('s1'))
+        self.histogram.watch('q1', 3600, 10)
+        self.assertFalse(self.histogram.needsreplay('s1'))
+        self.histogram.watch('q1', 3600, 60)
+        self.assertTrue(self.histogram.needsreplay('s1'))
+
+    def test_throttle_window(self):
+        # the interval can not be longer than the history kept
+        throttle = Throttle(MockQueue('q2', 7200, 3600), None, None)
+        self.assertEqual(throttle.interval, 3600)
+        self.assertEqual(self.histogram.queues['q2'].window, 3600)
+        throttle = Throttle(MockQueue('q3', 7200, 0), None, None)
+        self.assertEqual(throttle.interval, 7200)
+
+
+if __name__ == '__main__':
+    unittest.main()
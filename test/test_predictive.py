@@ -0,0 +1,157 @@
+#
+#
+
+import time
+import unittest
+
+from autopyfactory.configloader import Config
+from autopyfactory.info import StateCounts, WMSQueueInfo, WMSStatusInfo
+from autopyfactory.jobsnapshot import JobSnapshot
+from autopyfactory.plugins.queue.sched.Predictive import Predictive, ActivatedHistory, PilotHistory
+
+
+class MockStatusPlugin(object):
+    def __init__(self):
+        self.info = None
+        self.jobinfo = None
+        self.last_timestamp = 0
+
+    def getInfo(self, queue=None):
+        return self.info
+
+    def getJobInfo(self, queue=None):
+        return self.jobinfo
+
+
+class MockQueue(object):
+    def __init__(self, apfqname, wmsqueue):
+        self.apfqname = apfqname
+        self.wmsqueue = wmsqueue
+        self.qcl = Config()
+        self.qcl.add_section(apfqname)
+        self.wmsstatus_plugin = MockStatusPlugin()
+        self.batchstatus_plugin = MockStatusPlugin()
+
+
+class TestHistories(unittest.TestCase):
+
+    def test_activated(self):
+        history = ActivatedHistory(0.5, 0.5)
+        self.assertEqual(history.project(100), 0.0)
+        history.update(100, 0)
+        self.assertEqual(history.project(100), 100.0)
+        history.update(200, 100)
+        self.assertEqual(history.level, 150.0)
+        self.assertEqual(history.trend, 0.25)
+        self.assertEqual(history.project(100), 175.0)
+        self.assertEqual(history.project(-10000), 0.0)
+
+    def test_pilots(self):
+        history = PilotHistory(0.5, 300, 3600)
+        history.update(10, 50, [], 0)
+        self.assertEqual(history.drain, None)
+        # 5 started, running went from 50 to 45: 10 pilots left
+        history.update(10, 45, [100, 100, 100, 100, 100], 100)
+        self.assertEqual(history.drain, 0.1)
+        self.assertEqual(history.latency, 200.0)
+        # nothing started: latency from pending / drain
+        history.update(100, 40, [], 200)
+        self.assertAlmostEqual(history.drain, 0.075)
+        self.assertAlmostEqual(history.latency, 0.5 * 100 / 0.075 + 0.5 * 200)
+        history.update(1000, 40, [], 300)
+        self.assertEqual(history.latency, 3600)
+
+
+class TestPredictive(unittest.TestCase):
+
+    def setUp(self):
+        Predictive.activatedhistories = {}
+        self.queue = MockQueue('q1', 'SITE_A')
+        self.plugin = Predictive(self.queue, self.queue.qcl, 'q1')
+
+    def cycle(self, ready, pending, running, t, jobs=None):
+        self.queue.wmsstatus_plugin.info = WMSQueueInfo.fromdicts([{'ready': ready}])
+        self.queue.wmsstatus_plugin.last_timestamp = t
+        self.queue.batchstatus_plugin.info = StateCounts({'pending': pending, 'running': running})
+        self.queue.batchstatus_plugin.last_timestamp = t
+        self.queue.batchstatus_plugin.jobinfo = jobs
+        return self.plugin.calcSubmitNum(0)[0]
+
+    def test_missing_info(self):
+        self.assertEqual(self.plugin.calcSubmitNum(5)[0], 0)
+
+    def test_first_cycle(self):
+        # same as Ready with no history
+        self.assertEqual(self.cycle(100, 30, 0, 1), 70)
+        # the internal state is in the record
+        (out, msg) = self.plugin.calcSubmitNum(0)
+        fields = dict(msg[1])
+        self.assertEqual(fields['level'], '100.0')
+        self.assertEqual(fields['latency'], '300')
+        self.assertEqual(fields['ret'], 70)
+
+    def test_shared_wmsqueue(self):
+        other = MockQueue('q2', 'SITE_A')
+        plugin = Predictive(other, other.qcl, 'q2')
+        self.assertTrue(plugin.activated is self.plugin.activated)
+        self.cycle(100, 0, 0, 1)
+        other.wmsstatus_plugin = self.queue.wmsstatus_plugin
+        other.batchstatus_plugin = self.queue.batchstatus_plugin
+        plugin.calcSubmitNum(0)
+        # the same snapshot is not counted twice
+        self.assertEqual(self.plugin.activated.level, 100.0)
+
+    def test_smoothing_factors(self):
+        # queues with other factors do not share the history
+        other = MockQueue('q2', 'SITE_A')
+        other.qcl.set('q2', 'sched.predictive.alpha', '0.9')
+        plugin = Predictive(other, other.qcl, 'q2')
+        self.assertFalse(plugin.activated is self.plugin.activated)
+        self.assertEqual(plugin.activated.alpha, 0.9)
+
+    def test_jobs_snapshots(self):
+        # two queues on the same wmsqueue, and a plugin publishing
+        # the sites and clouds too, as the PanDA one
+        other = MockQueue('q2', 'SITE_A')
+        other.wmsstatus_plugin = self.queue.wmsstatus_plugin
+        other.batchstatus_plugin = self.queue.batchstatus_plugin
+        plugin = Predictive(other, other.qcl, 'q2')
+        wmsplugin = self.queue.wmsstatus_plugin
+        wmsplugin.currentjobinfo = WMSStatusInfo()
+
+        wmsplugin.currentjobinfo.lasttime = 1000
+        self.cycle(100, 0, 0, 1000)
+        wmsplugin.currentjobinfo = WMSStatusInfo()
+        wmsplugin.currentjobinfo.lasttime = 1300
+        self.cycle(200, 0, 0, 1300)
+        plugin.calcSubmitNum(0)
+        # specs published, same jobs
+        wmsplugin.last_timestamp = 1302
+        plugin.calcSubmitNum(0)
+        self.plugin.calcSubmitNum(0)
+
+        # a single update, over the 300 seconds between the jobs snapshots
+        self.assertAlmostEqual(self.plugin.activated.level, 0.3 * 200 + 0.7 * 100)
+        self.assertAlmostEqual(self.plugin.activated.trend, 0.1 * 30 / 300)
+        self.assertAlmostEqual(self.plugin.activated.project(300), 133)
+
+    def test_latencies(self):
+        now = int(time.time())
+        self.cycle(100, 10, 0, now - 100)
+        # started after the previous snapshot was collected,
+        # even if before the cycle that used it
+        self.plugin.calcSubmitNum(0)
+        classad_l = [{'match_apf_queue': 'q1', 'jobstatus': 2, 'qdate': now - 150, 'enteredcurrentstatus': now - 90},
+                     {'match_apf_queue': 'q1', 'jobstatus': 2, 'qdate': now - 7200, 'enteredcurrentstatus': now - 7000},
+                     {'match_apf_queue': 'q1', 'jobstatus': 1, 'qdate': now - 10, 'enteredcurrentstatus': now - 10},
+                    ]
+        jobs = JobSnapshot(classad_l, ['match_apf_queue', 'jobstatus', 'qdate', 'enteredcurrentstatus'])
+        self.cycle(100, 1, 1, now, jobs)
+        self.assertAlmostEqual(self.plugin.pilots.latency, 0.8 * 300 + 0.2 * 60)
+        # 0 running + 1 started - 1 running
+        self.assertEqual(self.plugin.pilots.drain, 0.0)
+        self.assertEqual(self.plugin.pilots.last, now)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#
+#
+
+import unittest
+
+import autopyfactory.schedpipeline as schedpipeline
+from autopyfactory.configloader import Config
+from autopyfactory.info import StateCounts, WMSQueueInfo
+from autopyfactory.schedpipeline import SchedPipeline, evaluatemany, render
+from autopyfactory.plugins.queue.sched.Ready import Ready
+from autopyfactory.plugins.queue.sched.Scale import Scale
+from autopyfactory.plugins.queue.sched.MaxPerCycle import MaxPerCycle
+from autopyfactory.plugins.queue.sched.MaxPending import MaxPending
+from autopyfactory.plugins.queue.sched.MinPerCycle import MinPerCycle
+from autopyfactory.plugins.queue.sched.MaxToRun import MaxToRun
+
+
+PLUGINS = [Ready, Scale, MaxPerCycle, MaxPending, MinPerCycle, MaxToRun]
+
+
+class MockStatusPlugin(object):
+    def __init__(self, info):
+        self.info = info
+        self.snapshotversion = 1
+
+    def getInfo(self, queue=None):
+        return self.info.get(queue)
+
+
+class MockQueue(object):
+    def __init__(self, apfqname, options, wmsinfo, batchinfo):
+        self.apfqname = apfqname
+        self.wmsqueue = apfqname
+        self.qcl = Config()
+        self.qcl.add_section(apfqname)
+        for (option, value) in options.items():
+            self.qcl.set(apfqname, option, value)
+        self.wmsstatus_plugin = MockStatusPlugin({apfqname: wmsinfo})
+        self.batchstatus_plugin = MockStatusPlugin({apfqname: batchinfo})
+
+
+def wmsinfo(ready):
+    return WMSQueueInfo.fromdicts([{'ready': ready}])
+
+
+def getQueues():
+    queues = []
+    queues.append(MockQueue('q1', {'sched.scale.factor': '0.25',
+                                   'sched.maxpercycle.maximum': '50',
+                                   'sched.maxpending.maximum': '20',
+                                   'sched.minpercycle.minimum': '1',
+                                   'sched.maxtorun.maximum': '100'},
+                            wmsinfo(300), StateCounts({'pending': 5, 'running': 90})))
+    queues.append(MockQueue('q2', {'sched.ready.offset': '10',
+                                   'sched.maxpending.maximum': '3',
+                                   'sched.maxpending.allow_negative': 'False'},
+                            wmsinfo(30), StateCounts({'pending': 8})))
+    queues.append(MockQueue('q3', {}, None, StateCounts({'pending': 1})))
+    queues.append(MockQueue('q4', {'sched.maxpending.maximum': '3'}, wmsinfo(7), None))
+    return queues
+
+
+def callplugins(queue):
+    """
+    the sched plugins called one by one, as done before the pipelines
+    """
+    nsub = 0
+    msg_l = []
+    for plugin in queue.plugins:
+        (nsub, msg) = plugin.calcSubmitNum(nsub)
+        if msg:
+            msg_l.append(msg)
+    return (nsub, ';'.join(msg_l))
+
+
+class TestSchedPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.queues = getQueues()
+        for queue in self.queues:
+            queue.plugins = [plugin(queue, queue.qcl, queue.apfqname) for plugin in PLUGINS]
+            queue.schedpipeline = SchedPipeline(queue, queue.plugins)
+
+    def test_compiled(self):
+        for queue in self.queues:
+            self.assertTrue(queue.schedpipeline.compiled)
+            self.assertEqual(queue.schedpipeline.signature, ('ready', 'scale', 'maxpercycle', 'maxpending', 'minpercycle', 'maxtorun'))
+
+    def test_evaluate(self):
+        for queue in self.queues:
+            (nsub, trace) = queue.schedpipeline.evaluate()
+            self.assertEqual((nsub, trace.explain()), callplugins(queue))
+
+    def test_evaluatemany(self):
+        (nsub_l, trace_l) = evaluatemany([queue.schedpipeline for queue in self.queues])
+        for i, queue in enumerate(self.queues):
+            self.assertEqual((nsub_l[i], trace_l[i].explain()), callplugins(queue))
+        self.assertEqual(nsub_l, [5, 0, 0, 0])
+
+    def test_evaluatemany_scalar(self):
+        numpy = schedpipeline.numpy
+        schedpipeline.numpy = None
+        try:
+            (nsub_l, trace_l) = evaluatemany([queue.schedpipeline for queue in self.queues])
+        finally:
+            schedpipeline.numpy = numpy
+        self.assertEqual(nsub_l, [5, 0, 0, 0])
+
+    def test_records(self):
+        (nsub, trace) = self.queues[1].schedpipeline.evaluate()
+        self.assertEqual(trace.records()[0], ('Ready', (('in', 0), ('activated', 30), ('offset', 10), ('pending', 8), ('ret', 12))))
+        self.assertEqual(render(('MinPending', (('comment', 'not set'), ('in', 1)))), 'MinPending:comment=not set,in=1')
+        self.assertEqual(render('Plugin:ret=1'), 'Plugin:ret=1')
+        self.assertEqual(str(trace), trace.explain())
+
+    def test_batchversion(self):
+        class PublishingPlugin(MockStatusPlugin):
+            def getInfo(self, queue=None):
+                # a newer snapshot is published while the queue is evaluated
+                info = MockStatusPlugin.getInfo(self, queue)
+                self.snapshotversion += 1
+                return info
+        queue = self.queues[0]
+        queue.batchstatus_plugin = PublishingPlugin(queue.batchstatus_plugin.info)
+        (nsub, trace) = queue.schedpipeline.evaluate()
+        self.assertEqual(trace.batchversion, 1)
+        (nsub_l, trace_l) = evaluatemany([queue.schedpipeline])
+        self.assertEqual(trace_l[0].batchversion, 2)
+
+    def test_not_compiled(self):
+        class Plugin(object):
+            def compile(self):
+                return None
+            def calcSubmitNum(self, n=0):
+                return (n + 1, ('Plugin', (('ret', n + 1),)))
+        queue = self.queues[0]
+        pipeline = SchedPipeline(queue, queue.plugins + [Plugin()])
+        self.assertFalse(pipeline.compiled)
+        (nsub_l, trace_l) = evaluatemany([pipeline])
+        self.assertEqual(nsub_l, [6])
+        self.assertTrue(trace_l[0].explain().endswith(';Plugin:ret=6'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#
+#
+
+import time
+import unittest
+
+from autopyfactory.info import StateCounts
+from autopyfactory.statuscache import StatusCache, StatusSnapshot
+
+
+class TestStatusCache(unittest.TestCase):
+
+    def setUp(self):
+        # the StatusCache is process-wide
+        StatusCache.instance = None
+        counts_d = {'q1': StateCounts({'pending': 2, 'running': 1}),
+                    'q2': StateCounts({'running': 4}),
+                    'q3': StateCounts({'pending': 1, 'done': 7}),
+                   }
+        wmsqueue_d = {'q1': 'SITE_A', 'q2': 'SITE_A', 'q3': 'SITE_B'}
+        self.snapshot = StatusSnapshot(counts_d, wmsqueue_d, 1)
+
+    def tearDown(self):
+        StatusCache.instance = None
+
+    def test_rollups(self):
+        self.assertEqual(self.snapshot.total, StateCounts({'pending': 3, 'running': 5, 'done': 7}))
+        self.assertEqual(self.snapshot.wmsqueues['SITE_A'], StateCounts({'pending': 2, 'running': 5}))
+        self.assertEqual(self.snapshot.wmsqueues['SITE_B'].done, 7)
+        self.assertEqual(self.snapshot.wmsqueues['SITE_C'].running, 0)
+
+    def test_views(self):
+        self.assertEqual(sorted(self.snapshot.queues.keys()), ['q1', 'q2', 'q3'])
+        self.assertEqual(self.snapshot.queues['q1'].pending, 2)
+        self.assertEqual(self.snapshot.queues['q4'].pending, 0)
+        self.assertFalse('q4' in self.snapshot.queues)
+        def setitem():
+            self.snapshot.queues['q4'] = StateCounts()
+        self.assertRaises(TypeError, setitem)
+
+    def test_age(self):
+        self.assertTrue(self.snapshot.age() <= 1)
+        old = StatusSnapshot({}, timestamp=int(time.time()) - 600)
+        self.assertTrue(old.age() >= 600)
+
+    def test_cache(self):
+        cache = StatusCache()
+        self.assertTrue(cache is StatusCache())
+        cache.put('schedd1', self.snapshot)
+        cache.put('schedd2', StatusSnapshot({'q9': StateCounts({'running': 10})}))
+        self.assertTrue(cache.get('schedd1') is self.snapshot)
+        self.assertEqual(cache.total().running, 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#
+#
+
+import threading
+import time
+import unittest
+
+import autopyfactory.submitcoordinator as submitcoordinator
+from autopyfactory.submitcoordinator import _submitcoordinator, SubmitTimeout
+
+
+class MockTransaction(object):
+    def __init__(self, schedd):
+        self.schedd = schedd
+
+    def __enter__(self):
+        self.schedd.transactions += 1
+        self.schedd.stuck.wait()
+        return self
+
+    def __exit__(self, *k):
+        return False
+
+
+class MockSchedd(object):
+    def __init__(self):
+        self.transactions = 0
+        self.clusters = []
+        self.stuck = threading.Event()
+        self.stuck.set()
+
+    def transaction(self):
+        return MockTransaction(self)
+
+
+class MockSubmit(object):
+    schedd = None
+
+    def __init__(self, text):
+        self.text = text
+
+    def queue(self, txn, n):
+        if 'fail' in self.text:
+            raise RuntimeError('submission failed')
+        MockSubmit.schedd.clusters.append((self.text, n))
+        return len(MockSubmit.schedd.clusters)
+
+
+class MockHTCondor(object):
+    Submit = MockSubmit
+
+
+class MockCoordinator(_submitcoordinator):
+    def _getschedd(self):
+        return MockSubmit.schedd
+
+
+class TestSubmitCoordinator(unittest.TestCase):
+
+    def setUp(self):
+        self.htcondor = submitcoordinator.htcondor
+        submitcoordinator.htcondor = MockHTCondor
+        MockSubmit.schedd = MockSchedd()
+        self.coordinator = MockCoordinator('mock', window=0.2)
+
+    def tearDown(self):
+        submitcoordinator.htcondor = self.htcondor
+
+    def _submit_all(self, texts):
+        results = {}
+        def submit(text, n):
+            try:
+                results[text] = self.coordinator.submit(text, text, n)
+            except Exception as e:
+                results[text] = e
+        threads = [threading.Thread(target=submit, args=(text, i + 1)) for i, text in enumerate(texts)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_single_transaction(self):
+        results = self._submit_all(['q1', 'q2', 'q3'])
+        self.assertEqual(MockSubmit.schedd.transactions, 1)
+        self.assertEqual(sorted(results.values()), [1, 2, 3])
+        for text, n in MockSubmit.schedd.clusters:
+            self.assertEqual(results[text], MockSubmit.schedd.clusters.index((text, n)) + 1)
+
+    def test_alone(self):
+        coordinator = MockCoordinator('mock', window=5, idle=0.1)
+        start = time.time()
+        self.assertEqual(coordinator.submit('q1', 'q1', 1), 1)
+        # nobody else submitting: no need to wait for the window
+        self.assertTrue(time.time() - start < 1)
+
+    def test_timeout(self):
+        self.coordinator = MockCoordinator('mock', window=0.2, timeout=0.3)
+        MockSubmit.schedd.stuck.clear()
+        leader = threading.Thread(target=self.coordinator.submit, args=('q1', 'q1', 1))
+        leader.start()
+        time.sleep(0.05)
+        # the leader is stuck in the transaction
+        self.assertRaises(SubmitTimeout, self.coordinator.submit, 'q2', 'q2', 2)
+        MockSubmit.schedd.stuck.set()
+        leader.join()
+        self.assertEqual(MockSubmit.schedd.clusters, [('q1', 1)])
+
+    def test_failure(self):
+        results = self._submit_all(['q1', 'fail'])
+        self.assertTrue(isinstance(results['q1'], RuntimeError))
+        self.assertTrue(isinstance(results['fail'], RuntimeError))
+
+
+if __name__ == '__main__':
+    unittest.main()